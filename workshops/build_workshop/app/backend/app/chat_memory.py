@@ -0,0 +1,139 @@
+"""Conversation memory for multi-turn chat.
+
+Each chat turn is stored as a compact ChatTurn (question, answer, SQL and a short
+summary of the rows it returned) under its conversation_id, so a follow-up like
+"now by borough" can be answered in one LLM call: chat_service replays the most
+recent turns into the prompt, newest first until the token budget is spent.
+
+The store is an in-process LRU over conversations, bounded in both directions
+(conversations kept, turns per conversation). Optionally every turn is also
+written to a SQLite file, so memory survives a backend restart; a conversation
+evicted from the LRU is reloaded from there on its next turn.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any
+
+logger = logging.getLogger("app.chat")
+
+# Result summaries stay small on purpose: the model needs the shape of the answer
+# (columns, a couple of rows, how many), not the data itself.
+_SUMMARY_ROWS = 3
+_SUMMARY_MAX_CHARS = 400
+
+
+def summarize_rows(rows: list[dict[str, Any]] | None) -> str | None:
+    """A one-line description of a result set, capped at _SUMMARY_MAX_CHARS."""
+    if rows is None:
+        return None
+    if not rows:
+        return "0 rows"
+    cols = list(rows[0])
+    head = "; ".join(
+        ", ".join(f"{c}={row.get(c)}" for c in cols) for row in rows[:_SUMMARY_ROWS]
+    )
+    text = f"{len(rows)} rows, columns {', '.join(cols)}; first: {head}"
+    return text if len(text) <= _SUMMARY_MAX_CHARS else text[: _SUMMARY_MAX_CHARS - 3] + "..."
+
+
+@dataclass(frozen=True)
+class ChatTurn:
+    question: str
+    answer: str
+    sql: str | None
+    summary: str | None
+
+    def messages(self) -> list[dict[str, str]]:
+        """The turn as a user/assistant pair, in the same JSON shape the model emits."""
+        reply: dict[str, Any] = {"answer": self.answer, "sql": self.sql}
+        if self.summary:
+            reply["result"] = self.summary
+        return [
+            {"role": "user", "content": self.question},
+            {"role": "assistant", "content": json.dumps(reply, default=str)},
+        ]
+
+
+class ConversationStore:
+    """Thread-safe LRU of recent turns per conversation, with optional SQLite backing.
+
+    FastAPI runs the sync chat endpoint on a threadpool, so every access goes through
+    one lock; the work under it is a dict lookup or a single-row insert.
+    """
+
+    def __init__(self, max_conversations: int, max_turns: int, sqlite_path: str | None = None) -> None:
+        self.max_conversations = max_conversations
+        self.max_turns = max_turns
+        self._turns: OrderedDict[str, deque[ChatTurn]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if sqlite_path:
+            try:
+                self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS chat_turns ("
+                    "conversation_id TEXT NOT NULL, created_at REAL NOT NULL, "
+                    "question TEXT NOT NULL, answer TEXT NOT NULL, sql TEXT, summary TEXT)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS chat_turns_conversation "
+                    "ON chat_turns (conversation_id, created_at)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                # Memory still works in-process; only persistence across restarts is lost.
+                logger.warning("chat memory: SQLite at %s unavailable, keeping memory in-process: %s", sqlite_path, e)
+                self._db = None
+
+    def history(self, conversation_id: str) -> list[ChatTurn]:
+        """Stored turns for a conversation, oldest first."""
+        with self._lock:
+            turns = self._load(conversation_id)
+            return list(turns)
+
+    def append(self, conversation_id: str, turn: ChatTurn) -> None:
+        with self._lock:
+            self._load(conversation_id).append(turn)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT INTO chat_turns VALUES (?, ?, ?, ?, ?, ?)",
+                        (conversation_id, time.time(), turn.question, turn.answer, turn.sql, turn.summary),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning("chat memory: could not persist turn: %s", e)
+
+    def _load(self, conversation_id: str) -> deque[ChatTurn]:
+        # Caller holds the lock.
+        turns = self._turns.get(conversation_id)
+        if turns is not None:
+            self._turns.move_to_end(conversation_id)
+            return turns
+        turns = deque(self._read_persisted(conversation_id), maxlen=self.max_turns)
+        self._turns[conversation_id] = turns
+        while len(self._turns) > self.max_conversations:
+            self._turns.popitem(last=False)
+        return turns
+
+    def _read_persisted(self, conversation_id: str) -> list[ChatTurn]:
+        if self._db is None:
+            return []
+        try:
+            rows = self._db.execute(
+                "SELECT question, answer, sql, summary FROM chat_turns "
+                "WHERE conversation_id = ? ORDER BY created_at DESC LIMIT ?",
+                (conversation_id, self.max_turns),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("chat memory: could not read persisted turns: %s", e)
+            return []
+        return [ChatTurn(*row) for row in reversed(rows)]
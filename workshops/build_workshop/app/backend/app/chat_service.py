@@ -1,25 +1,32 @@
 from __future__ import annotations
 
+import functools
 import json
+import logging
+import os
 import re
+import threading
 import time
 from contextlib import nullcontext
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable, Sequence
 
 from clickhouse_connect.driver.client import Client
 from clickhouse_connect.driver.exceptions import ClickHouseError
 from fastapi import HTTPException
 
+from app.chat_memory import ChatTurn, ConversationStore, summarize_rows
 from app.db import is_not_seeded_error
 from app.settings import settings
 
+logger = logging.getLogger("app.chat")
+
 # Tables the model is allowed to reference. The ClickHouse client connects with
 # database=nyc_tlc_data, so the prompt uses unqualified names like the rest of the app.
 ALLOWED_TABLES = ("taxi_trips", "taxi_zones", "taxi_trips_expanded")
 
 # Fallback schema used when ClickHouse introspection is unavailable (e.g. running the
-# chat prompt/guardrails without a live database). Mirrors db/init/001_schema.sql.
+# chat prompt/guardrails without a live database). Mirrors db/cloud/001_cloud_schema.sql.
 FALLBACK_SCHEMA = """\
 taxi_trips (
   car_type String,
@@ -47,16 +54,25 @@ taxi_zones (
   borough String,
   subregion String
 )
+
+taxi_trips_expanded (
+  -- every taxi_trips column, plus:
+  trip_minutes Float64,
+  mph Float64,
+  reasonable_time_distance_fare UInt8,
+  extra_charges Float64
+)
 """
 
 # A single guardrailed NL-to-SQL turn returns strict JSON with these keys.
+# Deliberately free of per-request content: it is the first message of every call. On
+# its own it is shorter than PROMPT_CACHE_MIN_TOKENS, so no provider caches it; with
+# chat_prompt_cache the full schema and every example follow it unchanged, and that
+# whole prefix is long enough to be cached.
 SYSTEM_PROMPT = """\
 You are a SQL analyst for a NYC taxi analytics dashboard backed by ClickHouse.
 Translate the user's question into ONE read-only ClickHouse SQL query over the
-schema below, then answer in plain English.
-
-Schema (database nyc_tlc_data, reference tables WITHOUT the database prefix):
-{schema}
+schema in the next message, then answer in plain English.
 
 Rules:
 - Emit exactly ONE statement and it MUST be a SELECT (a leading WITH ... SELECT is fine).
@@ -69,6 +85,10 @@ Rules:
 - Join taxi_trips to taxi_zones on taxi_zones.location_id = taxi_trips.pickup_location_id
   (or dropoff_location_id) to turn zone ids into names/boroughs.
 - Revenue: sum(ifNull(total_amount, ifNull(fare_amount, 0) + ifNull(tip_amount, 0))).
+- taxi_trips is sorted by (car_type, pickup_datetime): filter on a pickup_datetime
+  range whenever the question allows, inside the span given under "Data statistics"
+  if that message is present.
+- Use only the tables listed in the schema message.
 - If the question cannot be answered with these tables, set sql to null and explain why.
 
 Respond with a JSON object only, no markdown, with keys:
@@ -79,92 +99,125 @@ Respond with a JSON object only, no markdown, with keys:
   x and y must reference column aliases from the SELECT list.
 """
 
+# OpenAI only caches a prompt prefix of at least this many tokens; other providers
+# that cache have similar floors.
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+SCHEMA_PROMPT = """\
+Schema (database nyc_tlc_data, reference tables WITHOUT the database prefix):
+{schema}
+"""
+
+# Heads the statistics section SchemaCache appends to the rendered tables. It is
+# rebuilt every chat_schema_stats_ttl_seconds, so build_prompt sends it as its own
+# message after the examples rather than inside the cacheable schema message.
+STATS_HEADER = "Data statistics (approximate):"
+
+
+@dataclass(frozen=True)
+class FewShot:
+    """One NL-to-SQL example. `tags` are extra match words beyond the question text,
+    so an example can be found by what it demonstrates, not only by how it is worded."""
+
+    question: str
+    plan: dict[str, Any]
+    tags: tuple[str, ...] = ()
+
+    def messages(self) -> list[dict[str, str]]:
+        return [
+            {"role": "user", "content": self.question},
+            {"role": "assistant", "content": json.dumps(self.plan)},
+        ]
+
+
 # Few-shot examples grounded in the repo's own query patterns (readme sections 4 and 6).
-FEW_SHOTS: list[dict[str, str]] = [
-    {
-        "role": "user",
-        "content": "How many trips per hour on 2022-07-02?",
-    },
-    {
-        "role": "assistant",
-        "content": json.dumps(
-            {
-                "answer": "Hourly trip counts on 2022-07-02.",
-                "sql": (
-                    "SELECT toStartOfInterval(pickup_datetime, INTERVAL 1 HOUR) AS ts, "
-                    "count() AS trips FROM taxi_trips "
-                    "WHERE pickup_datetime >= toDateTime('2022-07-02 00:00:00') "
-                    "AND pickup_datetime < toDateTime('2022-07-03 00:00:00') "
-                    "GROUP BY ts ORDER BY ts LIMIT 100"
-                ),
-                "chart": {"type": "line", "x": "ts", "y": "trips"},
-            }
-        ),
-    },
-    {
-        "role": "user",
-        "content": "Top 10 pickup zones by number of trips in July 2022.",
-    },
-    {
-        "role": "assistant",
-        "content": json.dumps(
-            {
-                "answer": "The 10 busiest pickup zones by trip count in July 2022.",
-                "sql": (
-                    "SELECT z.zone AS zone, z.borough AS borough, count() AS trips "
-                    "FROM taxi_trips t "
-                    "INNER JOIN taxi_zones z ON z.location_id = t.pickup_location_id "
-                    "WHERE t.pickup_datetime >= toDateTime('2022-07-01 00:00:00') "
-                    "AND t.pickup_datetime < toDateTime('2022-08-01 00:00:00') "
-                    "GROUP BY zone, borough ORDER BY trips DESC LIMIT 10"
-                ),
-                "chart": {"type": "bar", "x": "zone", "y": "trips"},
-            }
-        ),
-    },
-    {
-        "role": "user",
-        "content": "What is the p95 trip duration by borough?",
-    },
-    {
-        "role": "assistant",
-        "content": json.dumps(
-            {
-                "answer": "95th-percentile trip duration (seconds) grouped by pickup borough.",
-                "sql": (
-                    "SELECT z.borough AS borough, "
-                    "quantileTDigest(0.95)(dateDiff('second', t.pickup_datetime, t.dropoff_datetime)) "
-                    "AS p95_duration_s FROM taxi_trips t "
-                    "INNER JOIN taxi_zones z ON z.location_id = t.pickup_location_id "
-                    "GROUP BY borough ORDER BY p95_duration_s DESC LIMIT 100"
-                ),
-                "chart": {"type": "bar", "x": "borough", "y": "p95_duration_s"},
-            }
-        ),
-    },
-    {
-        "role": "user",
-        "content": "Show daily revenue for July 2022.",
-    },
-    {
-        "role": "assistant",
-        "content": json.dumps(
-            {
-                "answer": "Daily revenue for July 2022 (total_amount, falling back to fare + tip).",
-                "sql": (
-                    "SELECT toStartOfDay(pickup_datetime) AS ts, "
-                    "sum(ifNull(total_amount, ifNull(fare_amount, 0) + ifNull(tip_amount, 0))) AS revenue "
-                    "FROM taxi_trips "
-                    "WHERE pickup_datetime >= toDateTime('2022-07-01 00:00:00') "
-                    "AND pickup_datetime < toDateTime('2022-08-01 00:00:00') "
-                    "GROUP BY ts ORDER BY ts LIMIT 100"
-                ),
-                "chart": {"type": "line", "x": "ts", "y": "revenue"},
-            }
-        ),
-    },
+# Append to extend: build_prompt picks the chat_few_shot_count best matches per question.
+FEW_SHOT_BANK: list[FewShot] = [
+    FewShot(
+        question="How many trips per hour on 2022-07-02?",
+        plan={
+            "answer": "Hourly trip counts on 2022-07-02.",
+            "sql": (
+                "SELECT toStartOfInterval(pickup_datetime, INTERVAL 1 HOUR) AS ts, "
+                "count() AS trips FROM taxi_trips "
+                "WHERE pickup_datetime >= toDateTime('2022-07-02 00:00:00') "
+                "AND pickup_datetime < toDateTime('2022-07-03 00:00:00') "
+                "GROUP BY ts ORDER BY ts LIMIT 100"
+            ),
+            "chart": {"type": "line", "x": "ts", "y": "trips"},
+        },
+        tags=("count", "volume", "time", "series", "minute", "interval"),
+    ),
+    FewShot(
+        question="Top 10 pickup zones by number of trips in July 2022.",
+        plan={
+            "answer": "The 10 busiest pickup zones by trip count in July 2022.",
+            "sql": (
+                "SELECT z.zone AS zone, z.borough AS borough, count() AS trips "
+                "FROM taxi_trips t "
+                "INNER JOIN taxi_zones z ON z.location_id = t.pickup_location_id "
+                "WHERE t.pickup_datetime >= toDateTime('2022-07-01 00:00:00') "
+                "AND t.pickup_datetime < toDateTime('2022-08-01 00:00:00') "
+                "GROUP BY zone, borough ORDER BY trips DESC LIMIT 10"
+            ),
+            "chart": {"type": "bar", "x": "zone", "y": "trips"},
+        },
+        tags=("busiest", "rank", "dropoff", "location", "borough", "join"),
+    ),
+    FewShot(
+        question="What is the p95 trip duration by borough?",
+        plan={
+            "answer": "95th-percentile trip duration (seconds) grouped by pickup borough.",
+            "sql": (
+                "SELECT z.borough AS borough, "
+                "quantileTDigest(0.95)(dateDiff('second', t.pickup_datetime, t.dropoff_datetime)) "
+                "AS p95_duration_s FROM taxi_trips t "
+                "INNER JOIN taxi_zones z ON z.location_id = t.pickup_location_id "
+                "GROUP BY borough ORDER BY p95_duration_s DESC LIMIT 100"
+            ),
+            "chart": {"type": "bar", "x": "borough", "y": "p95_duration_s"},
+        },
+        tags=("percentile", "median", "p50", "p99", "latency", "long", "time", "zone"),
+    ),
+    FewShot(
+        question="Show daily revenue for July 2022.",
+        plan={
+            "answer": "Daily revenue for July 2022 (total_amount, falling back to fare + tip).",
+            "sql": (
+                "SELECT toStartOfDay(pickup_datetime) AS ts, "
+                "sum(ifNull(total_amount, ifNull(fare_amount, 0) + ifNull(tip_amount, 0))) AS revenue "
+                "FROM taxi_trips "
+                "WHERE pickup_datetime >= toDateTime('2022-07-01 00:00:00') "
+                "AND pickup_datetime < toDateTime('2022-08-01 00:00:00') "
+                "GROUP BY ts ORDER BY ts LIMIT 100"
+            ),
+            "chart": {"type": "line", "x": "ts", "y": "revenue"},
+        },
+        tags=("money", "fare", "fares", "tip", "tips", "total", "amount", "earnings", "week", "month"),
+    ),
+    FewShot(
+        question="Average speed by hour of day for reasonable trips in July 2022.",
+        plan={
+            "answer": "Mean mph per pickup hour, excluding implausible trips (taxi_trips_expanded).",
+            "sql": (
+                "SELECT toHour(pickup_datetime) AS hour, round(avg(mph), 1) AS avg_mph "
+                "FROM taxi_trips_expanded "
+                "WHERE reasonable_time_distance_fare "
+                "AND pickup_datetime >= toDateTime('2022-07-01 00:00:00') "
+                "AND pickup_datetime < toDateTime('2022-08-01 00:00:00') "
+                "GROUP BY hour ORDER BY hour LIMIT 24"
+            ),
+            "chart": {"type": "line", "x": "hour", "y": "avg_mph"},
+        },
+        tags=("mph", "fast", "slow", "traffic", "outliers", "valid", "minutes", "expanded"),
+    ),
 ]
 
+# Every example in the bank, flattened into chat messages: build_prompt's token report
+# measures savings against sending all of them. That baseline grows with the bank, so
+# it is named for what it is, not for any prompt that was sent before selection.
+FEW_SHOTS: list[dict[str, str]] = [m for shot in FEW_SHOT_BANK for m in shot.messages()]
+
 
 # --- SQL guardrails -------------------------------------------------------
 
@@ -172,6 +225,19 @@ class SqlGuardrailError(ValueError):
     """Raised when a model-generated statement fails the read-only guardrails."""
 
 
+class QueryCostError(SqlGuardrailError):
+    """Raised when EXPLAIN ESTIMATE says a generated query would read more rows than
+    CHAT_MAX_ESTIMATED_ROWS. run_chat asks the model for one rewrite before giving up."""
+
+    def __init__(self, estimated_rows: int, budget: int) -> None:
+        super().__init__(
+            f"Query would read ~{estimated_rows:,} rows (budget {budget:,}); "
+            "narrow the time range or filter on pickup_datetime."
+        )
+        self.estimated_rows = estimated_rows
+        self.budget = budget
+
+
 class SchemaNotSeededError(Exception):
     """Raised when a generated query references a table/database that does not
     exist yet -- the schema has not been created and seeded (module 02). Lets
@@ -225,35 +291,384 @@ def sanitize_select_sql(raw_sql: str) -> str:
 
 # --- ClickHouse schema introspection (cached) -----------------------------
 
-_schema_cache: str | None = None
+# Columns whose distinct values are few enough to list in the prompt, so the model
+# filters on a real value ('yellow') instead of guessing one ('Yellow Cab').
+_LOW_CARDINALITY_COLUMNS = (("taxi_trips", "car_type"), ("taxi_zones", "borough"))
+_MAX_LISTED_VALUES = 20
+# Statistics are hints, not correctness: each probe gets a short server-side budget
+# and is simply left out of the prompt if it fails or times out.
+_STATS_TIMEOUT_SECONDS = 5
+
+
+@dataclass(frozen=True)
+class _SchemaSnapshot:
+    text: str
+    # (table, column, type) rows from system.columns. Compared on every revalidation,
+    # so an ALTER TABLE or a recreated view rebuilds the prompt without a restart.
+    version: tuple[tuple[str, str, str], ...]
+    checked_at: float
+    built_at: float
+
+
+def _fetch_columns(client: Client) -> tuple[tuple[str, str, str], ...]:
+    # One round trip for every allowed table (views included), instead of one
+    # DESCRIBE TABLE per table. Also serves as the cheap version probe.
+    result = client.query(
+        "SELECT table, name, type FROM system.columns "
+        "WHERE database = currentDatabase() AND table IN {tables:Array(String)} "
+        "ORDER BY table, position",
+        parameters={"tables": list(ALLOWED_TABLES)},
+    )
+    return tuple((str(t), str(n), str(ty)) for t, n, ty in result.result_rows)
+
+
+def _render_tables(columns: tuple[tuple[str, str, str], ...]) -> str:
+    by_table: dict[str, list[tuple[str, str]]] = {}
+    for table, name, col_type in columns:
+        by_table.setdefault(table, []).append((name, col_type))
+
+    blocks = []
+    base = by_table.get("taxi_trips", [])
+    for table in ALLOWED_TABLES:
+        cols = by_table.get(table)
+        if not cols:
+            continue
+        if table != "taxi_trips" and base and cols[: len(base)] == base:
+            # taxi_trips_expanded is SELECT * FROM taxi_trips plus derived columns; list
+            # only the additions so the prompt does not carry the same columns twice.
+            body = ",\n".join(f"  {n} {t}" for n, t in cols[len(base) :])
+            blocks.append(f"{table} (\n  -- every taxi_trips column, plus:\n{body}\n)")
+        else:
+            body = ",\n".join(f"  {n} {t}" for n, t in cols)
+            blocks.append(f"{table} (\n{body}\n)")
+    return "\n\n".join(blocks)
+
+
+def _stats_query(client: Client, sql: str, parameters: dict[str, Any] | None = None) -> list[tuple]:
+    return client.query(
+        sql,
+        parameters=parameters or {},
+        settings={"readonly": 2, "max_execution_time": _STATS_TIMEOUT_SECONDS},
+    ).result_rows
+
+
+def _collect_stats(client: Client, tables: set[str]) -> list[str]:
+    """Cheap cardinality hints for the prompt, each probe best-effort.
+
+    Row counts and sort keys come from system.tables metadata (no scan). The
+    pickup_datetime range and the low-cardinality value lists read one column each.
+    """
+    lines: list[str] = []
+    try:
+        for name, total_rows, sorting_key in _stats_query(
+            client,
+            "SELECT name, total_rows, sorting_key FROM system.tables "
+            "WHERE database = currentDatabase() AND name IN {tables:Array(String)} ORDER BY name",
+            {"tables": list(ALLOWED_TABLES)},
+        ):
+            parts = []
+            if total_rows is not None:
+                parts.append(f"~{int(total_rows):,} rows")
+            if sorting_key:
+                parts.append(f"sorted by ({sorting_key})")
+            if parts:
+                lines.append(f"- {name}: {'; '.join(parts)}")
+    except ClickHouseError:
+        pass
+
+    if "taxi_trips" in tables:
+        try:
+            rows = _stats_query(
+                client,
+                "SELECT toString(min(pickup_datetime)), toString(max(pickup_datetime)), count() "
+                "FROM taxi_trips",
+            )
+            if rows and rows[0][2]:
+                lines.append(f"- taxi_trips.pickup_datetime spans {rows[0][0]} to {rows[0][1]}")
+        except ClickHouseError:
+            pass
 
+    for table, column in _LOW_CARDINALITY_COLUMNS:
+        if table not in tables:
+            continue
+        try:
+            rows = _stats_query(
+                client, f"SELECT groupUniqArray({_MAX_LISTED_VALUES + 1})(toString({column})) FROM {table}"
+            )
+        except ClickHouseError:
+            continue
+        values = sorted(rows[0][0]) if rows else []
+        # More distinct values than the cap means the list would mislead; say nothing.
+        if values and len(values) <= _MAX_LISTED_VALUES:
+            lines.append(f"- {table}.{column} values: " + ", ".join(f"'{v}'" for v in values))
+    return lines
 
-def _describe_table(client: Client, table: str) -> str:
-    result = client.query(f"DESCRIBE TABLE {table}")
-    cols = [f"  {row[0]} {row[1]}" for row in result.result_rows]
-    return f"{table} (\n" + ",\n".join(cols) + "\n)"
 
+class SchemaCache:
+    """Prompt schema text, revalidated against system.columns instead of cached forever.
 
-def get_schema_text(client: Client | None) -> str:
-    """Return a cached, human-readable schema for the prompt.
+    Within `ttl_seconds` the cached text is returned with no query at all. After that,
+    one system.columns read decides: an unchanged column list only refreshes the
+    timestamp, a changed one rebuilds the text. Statistics (row counts, time range,
+    value lists) drift with ingestion rather than DDL, so they are rebuilt on their own
+    `stats_ttl_seconds` even when the columns have not changed.
 
-    Introspects taxi_trips / taxi_zones once via DESCRIBE TABLE and caches the result.
-    Falls back to the checked-in schema if the database is unreachable.
+    If ClickHouse is unreachable the last good text is kept; with nothing cached the
+    checked-in FALLBACK_SCHEMA is returned and not stored, so the next request retries.
+
+    FastAPI runs the chat handler in a threadpool, so revalidation happens under a lock:
+    when the TTL lapses, one request runs the system.columns and statistics queries and
+    the others wait for its result instead of each repeating them.
     """
-    global _schema_cache
-    if _schema_cache is not None:
-        return _schema_cache
 
-    if client is not None:
+    def __init__(
+        self,
+        ttl_seconds: float | None = None,
+        stats_ttl_seconds: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl_seconds = settings.chat_schema_ttl_seconds if ttl_seconds is None else ttl_seconds
+        self.stats_ttl_seconds = (
+            settings.chat_schema_stats_ttl_seconds if stats_ttl_seconds is None else stats_ttl_seconds
+        )
+        self.clock = clock
+        self._snapshot: _SchemaSnapshot | None = None
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._snapshot = None
+
+    def get(self, client: Client | None) -> str:
+        snap = self._snapshot
+        if snap is not None and self.clock() - snap.checked_at < self.ttl_seconds:
+            return snap.text
+        if client is None:
+            return snap.text if snap is not None else FALLBACK_SCHEMA
+        with self._lock:
+            # Re-read under the lock: the request we waited behind may have refreshed it.
+            now = self.clock()
+            snap = self._snapshot
+            if snap is not None and now - snap.checked_at < self.ttl_seconds:
+                return snap.text
+            return self._revalidate(client, snap, now)
+
+    def _revalidate(self, client: Client, snap: _SchemaSnapshot | None, now: float) -> str:
         try:
-            blocks = [_describe_table(client, "taxi_trips"), _describe_table(client, "taxi_zones")]
-            _schema_cache = "\n\n".join(blocks)
-            return _schema_cache
+            columns = _fetch_columns(client)
         except ClickHouseError:
-            pass  # fall back to the static schema below
+            return snap.text if snap is not None else FALLBACK_SCHEMA
+        if not columns:
+            # Tables not created yet (before module 02): nothing to describe.
+            return FALLBACK_SCHEMA
+
+        if snap is not None and snap.version == columns and now - snap.built_at < self.stats_ttl_seconds:
+            self._snapshot = _SchemaSnapshot(snap.text, snap.version, now, snap.built_at)
+            return snap.text
+
+        text = _render_tables(columns)
+        stats = _collect_stats(client, {table for table, _, _ in columns})
+        if stats:
+            text += f"\n\n{STATS_HEADER}\n" + "\n".join(stats)
+        self._snapshot = _SchemaSnapshot(text=text, version=columns, checked_at=now, built_at=now)
+        return text
+
+
+_schema_cache = SchemaCache()
+
+
+def get_schema_text(client: Client | None) -> str:
+    """Return the human-readable schema (plus data statistics) for the prompt.
+
+    Covers every table in ALLOWED_TABLES via system.columns, revalidated on a TTL by
+    the module SchemaCache. Falls back to the checked-in schema if the database is
+    unreachable and nothing has been cached yet.
+    """
+    return _schema_cache.get(client)
+
+
+# --- Prompt assembly (few-shot selection + schema trimming) ---------------
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STATS_TABLE = re.compile(r"- (\w+)")
+_STOPWORDS = frozenset(
+    "a an and are as at by do does for from how i in is it me of on or per show the "
+    "to what which with".split()
+)
+
+# Words that mean a question needs a table beyond taxi_trips. taxi_trips itself is
+# always kept: every example and every rule in SYSTEM_PROMPT is written against it.
+_TABLE_KEYWORDS: dict[str, frozenset[str]] = {
+    "taxi_zones": frozenset(
+        "zone zones borough boroughs neighborhood neighbourhood location locations area "
+        "manhattan brooklyn queens bronx staten island airport airports jfk laguardia "
+        "subregion where".split()
+    ),
+    "taxi_trips_expanded": frozenset(
+        "speed mph fast slow minutes reasonable outlier outliers implausible valid "
+        "surcharge surcharges charges extra".split()
+    ),
+}
+
+
+def _words(text: str) -> set[str]:
+    return {w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS}
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English + SQL on OpenAI tokenizers. Only used for
+    # the saved-tokens report, so a tokenizer dependency is not worth it.
+    return (len(text) + 3) // 4
+
+
+def select_few_shots(question: str, k: int, bank: list[FewShot] | None = None) -> list[FewShot]:
+    """The k examples sharing the most words with `question`, in bank order.
+
+    Ties (including all-zero scores) go to the earlier example, and the result keeps
+    bank order rather than score order, so the same question always yields the same
+    messages.
+    """
+    bank = FEW_SHOT_BANK if bank is None else bank
+    if k >= len(bank):
+        return list(bank)
+    asked = _words(question)
+    scored = sorted(
+        range(len(bank)),
+        key=lambda i: (-len(asked & (_words(bank[i].question) | set(bank[i].tags))), i),
+    )
+    return [bank[i] for i in sorted(scored[:k])]
+
+
+def relevant_tables(question: str, shots: list[FewShot], history: Sequence[ChatTurn] = ()) -> set[str]:
+    """taxi_trips plus whichever other allowed tables the question, the chosen
+    examples, or the replayed conversation turns refer to."""
+    asked = _words(question)
+    sqls = [shot.plan.get("sql") or "" for shot in shots] + [turn.sql or "" for turn in history]
+    tables = {"taxi_trips"}
+    for table, keywords in _TABLE_KEYWORDS.items():
+        if asked & keywords or any(table in sql for sql in sqls):
+            tables.add(table)
+    return tables
+
+
+def select_history(history: Sequence[ChatTurn], max_tokens: int) -> list[ChatTurn]:
+    """The most recent turns that fit in `max_tokens`, oldest first.
+
+    Walks back from the newest turn and stops at the first one that does not fit, so
+    the replayed context is always a contiguous tail of the conversation.
+    """
+    kept: list[ChatTurn] = []
+    spent = 0
+    for turn in reversed(history):
+        cost = sum(_estimate_tokens(m["content"]) for m in turn.messages())
+        if spent + cost > max_tokens:
+            break
+        kept.append(turn)
+        spent += cost
+    kept.reverse()
+    return kept
+
+
+def trim_schema_text(schema_text: str, tables: set[str]) -> str:
+    """Keep only the blocks (and statistics lines) of `tables`.
+
+    Works on the rendered text -- blank-line separated `table (...)` blocks, then an
+    optional statistics section of `- table...` lines -- so it applies equally to the
+    introspected schema and to FALLBACK_SCHEMA.
+    """
+    kept: list[str] = []
+    for block in schema_text.split("\n\n"):
+        head = block.split(" ", 1)[0]
+        if head in ALLOWED_TABLES:
+            if head in tables:
+                kept.append(block)
+            continue
+        header, *lines = block.splitlines()
+        lines = [line for line in lines if (m := _STATS_TABLE.match(line)) is None or m.group(1) in tables]
+        if lines:
+            kept.append("\n".join([header, *lines]))
+    return "\n\n".join(kept)
+
+
+def split_statistics(schema_text: str) -> tuple[str, str]:
+    """The table blocks of `schema_text`, and its statistics section ("" if it has none)."""
+    tables, found, stats = schema_text.partition(f"\n\n{STATS_HEADER}")
+    return tables, f"{STATS_HEADER}{stats}" if found else ""
+
 
-    _schema_cache = FALLBACK_SCHEMA
-    return _schema_cache
+@dataclass(frozen=True)
+class ChatPrompt:
+    messages: list[dict[str, str]]
+    tables: tuple[str, ...]
+    few_shots: int
+    history_turns: int
+    estimated_tokens: int
+    # What the full schema plus every FEW_SHOT_BANK example would have cost.
+    estimated_tokens_full_bank: int
+    # The leading messages that do not vary per question: what a provider can cache.
+    estimated_tokens_stable_prefix: int
+
+    @property
+    def estimated_tokens_saved_vs_full_bank(self) -> int:
+        return max(0, self.estimated_tokens_full_bank - self.estimated_tokens)
+
+
+def build_prompt(message: str, schema_text: str, history: Sequence[ChatTurn] = ()) -> ChatPrompt:
+    """Assemble the chat messages for one question under the token budget settings.
+
+    Order is stable prefix first: SYSTEM_PROMPT (identical on every call), then the
+    schema's tables, the examples, its data statistics, the conversation so far (within
+    chat_memory_max_tokens), and the question. By default the schema is trimmed and the
+    examples selected per question, so only SYSTEM_PROMPT is shared between questions.
+    With chat_prompt_cache the full schema and every bank example are sent instead, and
+    the prefix through the examples changes only when the columns do; the statistics,
+    refreshed on their own TTL, come after it so a refresh does not invalidate it.
+    """
+    system = {"role": "system", "content": SYSTEM_PROMPT.format(row_limit=settings.chat_row_limit)}
+    turns = select_history(history, settings.chat_memory_max_tokens)
+    if settings.chat_prompt_cache:
+        shots = list(FEW_SHOT_BANK)
+        tables = set(ALLOWED_TABLES)
+    else:
+        shots = select_few_shots(message, settings.chat_few_shot_count)
+        tables = relevant_tables(message, shots, turns) if settings.chat_trim_schema else set(ALLOWED_TABLES)
+    table_text, stats_text = split_statistics(trim_schema_text(schema_text, tables))
+    schema = {"role": "system", "content": SCHEMA_PROMPT.format(schema=table_text)}
+    stats = [{"role": "system", "content": stats_text}] if stats_text else []
+    messages = [
+        system,
+        schema,
+        *(m for shot in shots for m in shot.messages()),
+        *stats,
+        *(m for turn in turns for m in turn.messages()),
+        {"role": "user", "content": message},
+    ]
+
+    # Decided by the settings, not by this question's selection: a trimmed schema that
+    # happens to keep every table still differs from the next question's.
+    stable = [system]
+    if settings.chat_prompt_cache or not settings.chat_trim_schema:
+        stable.append(schema)
+        if settings.chat_prompt_cache or settings.chat_few_shot_count >= len(FEW_SHOT_BANK):
+            stable.extend(m for shot in shots for m in shot.messages())
+
+    full_schema = SCHEMA_PROMPT.format(schema=schema_text)
+    full = [
+        system["content"],
+        full_schema,
+        *(m["content"] for m in FEW_SHOTS),
+        *(m["content"] for turn in turns for m in turn.messages()),
+        message,
+    ]
+    return ChatPrompt(
+        messages=messages,
+        tables=tuple(t for t in ALLOWED_TABLES if t in tables),
+        few_shots=len(shots),
+        history_turns=len(turns),
+        estimated_tokens=sum(_estimate_tokens(m["content"]) for m in messages),
+        estimated_tokens_full_bank=sum(_estimate_tokens(text) for text in full),
+        estimated_tokens_stable_prefix=sum(_estimate_tokens(m["content"]) for m in stable),
+    )
 
 
 # --- LLM client (with optional Langfuse tracing) --------------------------
@@ -265,10 +680,21 @@ _langfuse_enabled = bool(settings.langfuse_public_key and settings.langfuse_secr
 def _configure_langfuse() -> bool:
     """Configure the Langfuse singleton so the OpenAI drop-in traces to it.
 
+    Export never runs on the request path: the v4 SDK hands finished spans to an
+    OpenTelemetry BatchSpanProcessor, whose worker thread ships them in batches of
+    LANGFUSE_FLUSH_AT every LANGFUSE_FLUSH_INTERVAL seconds. Its queue is bounded
+    by LANGFUSE_MAX_QUEUE_SIZE and drops new spans when full, so a slow or
+    unreachable Langfuse costs trace completeness, never chat latency. The queue
+    size is only readable from OTEL_BSP_MAX_QUEUE_SIZE, so it is set for the
+    duration of the constructor and restored, leaving the ClickStack exporter
+    (created at interpreter start by opentelemetry-instrument) untouched.
+
     Returns True if Langfuse is active, False if unavailable (tracing disabled).
     """
     if not _langfuse_enabled:
         return False
+    previous = os.environ.get("OTEL_BSP_MAX_QUEUE_SIZE")
+    os.environ["OTEL_BSP_MAX_QUEUE_SIZE"] = str(settings.langfuse_max_queue_size)
     try:
         from langfuse import Langfuse
 
@@ -276,29 +702,72 @@ def _configure_langfuse() -> bool:
             public_key=settings.langfuse_public_key,
             secret_key=settings.langfuse_secret_key,
             host=settings.langfuse_base_url,
+            flush_at=settings.langfuse_flush_at,
+            flush_interval=settings.langfuse_flush_interval,
         )
         return True
     except Exception:  # noqa: BLE001 - never let tracing break the endpoint
         return False
+    finally:
+        if previous is None:
+            os.environ.pop("OTEL_BSP_MAX_QUEUE_SIZE", None)
+        else:
+            os.environ["OTEL_BSP_MAX_QUEUE_SIZE"] = previous
 
 
 _langfuse_active = _configure_langfuse()
 
 
+# Time spent inside the undecorated run_chat, per thread: FastAPI runs sync
+# endpoints on a threadpool, so concurrent turns must not share one slot.
+_turn_timing = threading.local()
+
+
 def _chat_trace(fn):
     """Wrap a function with the Langfuse v4 @observe decorator when tracing is active.
 
-    When Langfuse is not configured (or not installed) the function is returned
-    unchanged, so no tracer is touched and no warnings are emitted.
+    Every turn is also timed twice -- outside the decorator and inside it -- and the
+    difference is logged as tracing_overhead_ms, so the cost of tracing on the request
+    path is measured per turn rather than assumed. With tracing off no tracer is
+    touched and the overhead is 0 by construction; compare total_ms across the two
+    modes for the end-to-end view.
     """
-    if not _langfuse_active:
-        return fn
-    try:
-        from langfuse import observe
 
-        return observe(name="chat")(fn)
-    except Exception:  # noqa: BLE001
-        return fn
+    @functools.wraps(fn)
+    def inner(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _turn_timing.inner_ms = (time.perf_counter() - started) * 1000.0
+
+    traced = inner
+    if _langfuse_active:
+        try:
+            from langfuse import observe
+
+            traced = observe(name="chat")(inner)
+        except Exception:  # noqa: BLE001
+            traced = inner
+
+    @functools.wraps(fn)
+    def outer(*args, **kwargs):
+        _turn_timing.inner_ms = None
+        started = time.perf_counter()
+        try:
+            return traced(*args, **kwargs)
+        finally:
+            total_ms = (time.perf_counter() - started) * 1000.0
+            inner_ms = _turn_timing.inner_ms
+            overhead_ms = max(0.0, total_ms - inner_ms) if inner_ms is not None else 0.0
+            logger.info(
+                "chat turn: total_ms=%.1f tracing=%s tracing_overhead_ms=%.2f",
+                total_ms,
+                "on" if traced is not inner else "off",
+                overhead_ms,
+            )
+
+    return outer
 
 
 def _get_openai_client() -> Any:
@@ -333,6 +802,56 @@ def shutdown_tracing() -> None:
         pass
 
 
+def _record_trace_metadata(**metadata: Any) -> None:
+    """Attach metadata to the current Langfuse observation (no-op when tracing is off)."""
+    if not _langfuse_active:
+        return
+    try:
+        from langfuse import get_client
+
+        get_client().update_current_span(metadata=metadata)
+    except Exception:  # noqa: BLE001 - never let tracing break the endpoint
+        pass
+
+
+def _report_prompt_usage(prompt: ChatPrompt, usage: Any) -> None:
+    """Log (and attach to the trace) what prompt trimming saved on this turn.
+
+    The estimate is compared against the full schema with every FEW_SHOT_BANK example;
+    the provider's own prompt_tokens and cached_tokens are added when the response
+    carries them.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    report = {
+        "prompt_tokens_estimated": prompt.estimated_tokens,
+        "prompt_tokens_saved_vs_full_bank_estimated": prompt.estimated_tokens_saved_vs_full_bank,
+        "prompt_tables": list(prompt.tables),
+        "prompt_few_shots": prompt.few_shots,
+        "prompt_history_turns": prompt.history_turns,
+        "prompt_stable_prefix_tokens_estimated": prompt.estimated_tokens_stable_prefix,
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "prompt_tokens_cached": getattr(details, "cached_tokens", None),
+    }
+    logger.info(
+        "chat prompt: ~%d tokens (~%d saved vs full schema and every bank example), "
+        "tables=%s, few_shots=%d, provider prompt_tokens=%s cached=%s",
+        prompt.estimated_tokens,
+        prompt.estimated_tokens_saved_vs_full_bank,
+        ",".join(prompt.tables),
+        prompt.few_shots,
+        report["prompt_tokens"],
+        report["prompt_tokens_cached"],
+    )
+    if settings.chat_prompt_cache and prompt.estimated_tokens_stable_prefix < PROMPT_CACHE_MIN_TOKENS:
+        logger.warning(
+            "CHAT_PROMPT_CACHE is on but the stable prefix is ~%d tokens, under the %d a "
+            "provider needs before it caches one; add FEW_SHOT_BANK examples or turn it off",
+            prompt.estimated_tokens_stable_prefix,
+            PROMPT_CACHE_MIN_TOKENS,
+        )
+    _record_trace_metadata(**report)
+
+
 @dataclass(frozen=True)
 class ChatPlan:
     answer: str
@@ -361,15 +880,29 @@ def _parse_plan_json(content: str) -> dict[str, Any]:
     raise HTTPException(status_code=502, detail="LLM returned invalid JSON.")
 
 
-def generate_plan(message: str, schema_text: str, conversation_id: str | None) -> ChatPlan:
-    """Call the model to turn a question into an answer + SELECT + chart spec."""
+def generate_plan(
+    message: str,
+    schema_text: str,
+    conversation_id: str | None,
+    rejected: tuple[str, str] | None = None,
+    history: Sequence[ChatTurn] = (),
+) -> ChatPlan:
+    """Call the model to turn a question into an answer + SELECT + chart spec.
+
+    `history` is the conversation so far, replayed within the memory token budget.
+    `rejected` is a (sql, reason) pair from a previous attempt; it is replayed as the
+    model's own answer plus a corrective user turn so the rewrite sees what failed.
+    """
     client = _get_openai_client()
 
-    messages: list[dict[str, str]] = [
-        {"role": "system", "content": SYSTEM_PROMPT.format(schema=schema_text, row_limit=settings.chat_row_limit)},
-        *FEW_SHOTS,
-        {"role": "user", "content": message},
-    ]
+    prompt = build_prompt(message, schema_text, history)
+    messages = list(prompt.messages)
+    if rejected is not None:
+        rejected_sql, reason = rejected
+        messages += [
+            {"role": "assistant", "content": json.dumps({"sql": rejected_sql})},
+            {"role": "user", "content": f"That query was rejected: {reason} Rewrite it to read less data."},
+        ]
 
     # The "name" kwarg is a Langfuse drop-in extension (names the generation) and is
     # rejected by the plain OpenAI client, so only attach it when tracing is active.
@@ -398,6 +931,8 @@ def generate_plan(message: str, schema_text: str, conversation_id: str | None) -
     except Exception as e:  # noqa: BLE001 - surface provider/network errors as 502
         raise HTTPException(status_code=502, detail=f"LLM request failed: {e}") from e
 
+    _report_prompt_usage(prompt, getattr(completion, "usage", None))
+
     content = completion.choices[0].message.content or "{}"
     data = _parse_plan_json(content)
 
@@ -407,6 +942,46 @@ def generate_plan(message: str, schema_text: str, conversation_id: str | None) -
     return ChatPlan(answer=str(data.get("answer", "")), sql=data.get("sql"), chart=chart)
 
 
+# --- Pre-execution cost guard -------------------------------------------
+
+def estimate_rows_read(client: Client, sql: str) -> int | None:
+    """Rows ClickHouse expects to read for `sql`, from EXPLAIN ESTIMATE.
+
+    The estimate is mark-granular (it counts whole granules the primary key cannot
+    skip), which is exactly what a time-range filter on pickup_datetime reduces.
+    Returns None when the estimate is unavailable, e.g. a missing table, which the
+    execution path already reports more helpfully.
+    """
+    try:
+        result = client.query(
+            f"EXPLAIN ESTIMATE {sql}",
+            settings={"readonly": 2, "max_execution_time": settings.chat_query_timeout_seconds},
+        )
+    except ClickHouseError:
+        return None
+    cols = list(result.column_names)
+    if "rows" not in cols:
+        return None
+    idx = cols.index("rows")
+    return sum(int(row[idx]) for row in result.result_rows)
+
+
+def check_query_cost(client: Client, sql: str) -> int | None:
+    """Raise QueryCostError if `sql` would read more than the configured row budget.
+
+    Returns the estimate (or None) so the caller can report it. A budget of 0
+    disables the check.
+    """
+    budget = settings.chat_max_estimated_rows
+    if budget <= 0:
+        return None
+    estimated = estimate_rows_read(client, sql)
+    _record_trace_metadata(estimated_rows_read=estimated, rows_read_budget=budget)
+    if estimated is not None and estimated > budget:
+        raise QueryCostError(estimated, budget)
+    return estimated
+
+
 # --- Read-only query execution -------------------------------------------
 
 @dataclass(frozen=True)
@@ -453,21 +1028,60 @@ class ChatResult:
     chart: dict[str, Any] | None
 
 
+_conversations = ConversationStore(
+    max_conversations=settings.chat_memory_max_conversations,
+    max_turns=settings.chat_memory_max_turns,
+    sqlite_path=settings.chat_memory_sqlite_path or None,
+)
+
+
 @_chat_trace
 def run_chat(client: Client, message: str, conversation_id: str | None) -> ChatResult:
     """Run one chat turn end to end (schema -> LLM -> guardrail -> execution).
 
     Decorated with Langfuse @observe (when active) so the whole turn is one trace.
     Raises SqlGuardrailError for the router to map to a 400.
+
+    With a conversation_id, earlier turns of the same conversation are replayed into
+    the prompt and this turn is stored for the next one, so follow-ups need not
+    restate the question. A turn rejected by the guardrails is not stored.
+
+    A query over the EXPLAIN ESTIMATE row budget gets one rewrite: the model sees its
+    rejected SQL and the estimate, and a second over-budget answer is rejected.
     """
+    result = _run_chat_turn(client, message, conversation_id)
+    if conversation_id:
+        _conversations.append(
+            conversation_id,
+            ChatTurn(
+                question=message,
+                answer=result.answer,
+                sql=result.sql,
+                summary=summarize_rows(result.rows),
+            ),
+        )
+    return result
+
+
+def _run_chat_turn(client: Client, message: str, conversation_id: str | None) -> ChatResult:
     schema_text = get_schema_text(client)
-    plan = generate_plan(message, schema_text, conversation_id)
+    history = _conversations.history(conversation_id) if conversation_id else []
+    plan = generate_plan(message, schema_text, conversation_id, history=history)
 
     # Conversational / out-of-scope answers come back without SQL.
     if not plan.sql:
         return ChatResult(answer=plan.answer, sql=None, rows=None, chart=None)
 
     safe_sql = sanitize_select_sql(plan.sql)
+    try:
+        check_query_cost(client, safe_sql)
+    except QueryCostError as e:
+        plan = generate_plan(message, schema_text, conversation_id, rejected=(safe_sql, str(e)), history=history)
+        if not plan.sql:
+            return ChatResult(answer=plan.answer, sql=None, rows=None, chart=None)
+        safe_sql = sanitize_select_sql(plan.sql)
+        check_query_cost(client, safe_sql)
+
     try:
         result = execute_readonly_select(client, safe_sql)
     except SchemaNotSeededError:
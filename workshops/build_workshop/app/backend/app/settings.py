@@ -40,6 +40,31 @@ class Settings(BaseSettings):
     chat_row_limit: int = 100  # appended as LIMIT when the model omits one
     chat_max_result_rows: int = 1000
     chat_query_timeout_seconds: int = 30
+    # Rows-read budget checked with EXPLAIN ESTIMATE before a generated query runs, so
+    # a full-history scan is rejected up front instead of burning the whole timeout.
+    # 0 disables the check.
+    chat_max_estimated_rows: int = 100_000_000
+    # Prompt schema cache: how long the text is trusted before system.columns is
+    # re-checked, and how long the row-count/time-range statistics are kept.
+    chat_schema_ttl_seconds: int = 60
+    chat_schema_stats_ttl_seconds: int = 900
+    # Prompt size: how many few-shot examples are sent per question (best keyword
+    # matches from chat_service.FEW_SHOT_BANK), and whether tables the question does
+    # not touch are dropped from the schema message.
+    chat_few_shot_count: int = 2
+    chat_trim_schema: bool = True
+    # Trade trimming for provider prefix caching: send the full schema and every
+    # FEW_SHOT_BANK example, in the same order on every call, so the prompt opens with
+    # a prefix long enough to cache (chat_service.PROMPT_CACHE_MIN_TOKENS). Overrides
+    # the two settings above.
+    chat_prompt_cache: bool = False
+    # Multi-turn memory, keyed by ChatRequest.conversation_id. Recent turns are
+    # replayed into the prompt within chat_memory_max_tokens. Set
+    # CHAT_MEMORY_SQLITE_PATH to keep conversations across backend restarts.
+    chat_memory_max_conversations: int = 500
+    chat_memory_max_turns: int = 10
+    chat_memory_max_tokens: int = 1000
+    chat_memory_sqlite_path: str = ""
 
     # --- Langfuse tracing (optional, v4 SDK) ---
     # When both keys are set the chat flow is traced; when absent tracing is disabled gracefully.
@@ -51,6 +76,12 @@ class Settings(BaseSettings):
         validation_alias=AliasChoices("LANGFUSE_BASE_URL", "LANGFUSE_HOST"),
     )
 
+    # Background export tuning. Spans are batched by a worker thread (never flushed on
+    # the request path); a full queue drops new spans instead of blocking chat.
+    langfuse_flush_at: int = 64
+    langfuse_flush_interval: float = 2.0
+    langfuse_max_queue_size: int = 2048
+
     @property
     def clickhouse_secure_effective(self) -> bool:
         if self.clickhouse_secure is not None:
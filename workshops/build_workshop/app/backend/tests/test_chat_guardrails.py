@@ -1,13 +1,28 @@
 from __future__ import annotations
 
+import threading
+import time
+
 import pytest
+from clickhouse_connect.driver.exceptions import DatabaseError
 from fastapi import HTTPException
 
+import app.chat_service as chat_service
 from app.chat_service import (
+    FALLBACK_SCHEMA,
+    ChatPlan,
+    QueryCostError,
+    SchemaCache,
     SqlGuardrailError,
     _parse_plan_json,
+    build_prompt,
+    check_query_cost,
+    estimate_rows_read,
     get_schema_text,
+    relevant_tables,
     sanitize_select_sql,
+    select_few_shots,
+    trim_schema_text,
 )
 from app.settings import settings
 
@@ -125,3 +140,359 @@ def test_schema_fallback_without_client() -> None:
     text = get_schema_text(None)
     assert "taxi_trips" in text
     assert "taxi_zones" in text
+
+
+def test_schema_fallback_covers_every_allowed_table() -> None:
+    assert "taxi_trips_expanded" in get_schema_text(None)
+
+
+# --- Schema cache (TTL + system.columns versioning) -----------------------
+
+_TRIPS = [("taxi_trips", "car_type", "String"), ("taxi_trips", "pickup_datetime", "DateTime('UTC')")]
+_ZONES = [("taxi_zones", "location_id", "UInt16"), ("taxi_zones", "borough", "String")]
+_EXPANDED = [
+    ("taxi_trips_expanded", "car_type", "String"),
+    ("taxi_trips_expanded", "pickup_datetime", "DateTime('UTC')"),
+    ("taxi_trips_expanded", "mph", "Float64"),
+]
+
+
+class _Result:
+    def __init__(self, result_rows) -> None:
+        self.result_rows = result_rows
+
+
+class _SchemaClient:
+    """Answers the introspection queries by matching on the SQL text."""
+
+    def __init__(self, columns, fail_stats: bool = False) -> None:
+        self.columns = list(columns)
+        self.fail_stats = fail_stats
+        self.queries: list[str] = []
+
+    def query(self, sql: str, **_kwargs):
+        self.queries.append(sql)
+        if "system.columns" in sql:
+            return _Result(self.columns)
+        if self.fail_stats:
+            raise DatabaseError("Code: 159. TIMEOUT_EXCEEDED")
+        if "system.tables" in sql:
+            return _Result([("taxi_trips", 1234567, "car_type, pickup_datetime"), ("taxi_trips_expanded", None, "")])
+        if "min(pickup_datetime)" in sql:
+            return _Result([("2022-07-01 00:00:03", "2022-07-31 23:59:58", 1234567)])
+        if "car_type" in sql:
+            return _Result([(["yellow", "green"],)])
+        if "borough" in sql:
+            return _Result([(["Queens", "Manhattan"],)])
+        raise AssertionError(f"unexpected query: {sql}")
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_schema_cache_lists_every_table_and_statistics() -> None:
+    cache = SchemaCache(ttl_seconds=60, stats_ttl_seconds=900, clock=_Clock())
+    text = cache.get(_SchemaClient(_TRIPS + _ZONES + _EXPANDED))
+
+    assert "taxi_trips (" in text and "taxi_zones (" in text
+    # The view repeats taxi_trips' columns; only its additions are spelled out.
+    assert "taxi_trips_expanded (\n  -- every taxi_trips column, plus:\n  mph Float64\n)" in text
+    assert "~1,234,567 rows; sorted by (car_type, pickup_datetime)" in text
+    assert "spans 2022-07-01 00:00:03 to 2022-07-31 23:59:58" in text
+    assert "taxi_trips.car_type values: 'green', 'yellow'" in text
+    assert "taxi_zones.borough values: 'Manhattan', 'Queens'" in text
+
+
+def test_schema_cache_skips_queries_within_ttl() -> None:
+    clock = _Clock()
+    cache = SchemaCache(ttl_seconds=60, stats_ttl_seconds=900, clock=clock)
+    client = _SchemaClient(_TRIPS + _ZONES)
+    first = cache.get(client)
+    issued = len(client.queries)
+
+    clock.now = 59.0
+    assert cache.get(client) == first
+    assert len(client.queries) == issued
+
+
+def test_schema_cache_revalidates_cheaply_when_columns_unchanged() -> None:
+    clock = _Clock()
+    cache = SchemaCache(ttl_seconds=60, stats_ttl_seconds=900, clock=clock)
+    client = _SchemaClient(_TRIPS + _ZONES)
+    first = cache.get(client)
+    issued = len(client.queries)
+
+    clock.now = 61.0
+    assert cache.get(client) == first
+    # Only the system.columns probe ran; statistics were not recomputed.
+    assert client.queries[issued:] == [client.queries[0]]
+
+
+def test_schema_cache_rebuilds_after_a_schema_change() -> None:
+    clock = _Clock()
+    cache = SchemaCache(ttl_seconds=60, stats_ttl_seconds=900, clock=clock)
+    client = _SchemaClient(_TRIPS + _ZONES)
+    assert "tip_amount" not in cache.get(client)
+
+    client.columns.insert(2, ("taxi_trips", "tip_amount", "Nullable(Float64)"))
+    clock.now = 61.0
+    assert "tip_amount Nullable(Float64)" in cache.get(client)
+
+
+def test_schema_cache_refreshes_statistics_on_their_own_ttl() -> None:
+    clock = _Clock()
+    cache = SchemaCache(ttl_seconds=60, stats_ttl_seconds=900, clock=clock)
+    client = _SchemaClient(_TRIPS + _ZONES)
+    cache.get(client)
+
+    clock.now = 901.0
+    client.queries.clear()
+    cache.get(client)
+    assert any("system.tables" in sql for sql in client.queries)
+
+
+def test_schema_cache_omits_failed_statistics() -> None:
+    cache = SchemaCache(ttl_seconds=60, stats_ttl_seconds=900, clock=_Clock())
+    text = cache.get(_SchemaClient(_TRIPS + _ZONES, fail_stats=True))
+
+    assert "taxi_trips (" in text
+    assert "Data statistics" not in text
+
+
+def test_schema_cache_keeps_last_good_text_when_clickhouse_fails() -> None:
+    clock = _Clock()
+    cache = SchemaCache(ttl_seconds=60, stats_ttl_seconds=900, clock=clock)
+    good = cache.get(_SchemaClient(_TRIPS + _ZONES))
+
+    class _Down:
+        def query(self, *_args, **_kwargs):
+            raise DatabaseError("Code: 210. Connection refused")
+
+    clock.now = 61.0
+    assert cache.get(_Down()) == good
+
+
+def test_schema_cache_does_not_store_the_fallback() -> None:
+    cache = SchemaCache(ttl_seconds=60, stats_ttl_seconds=900, clock=_Clock())
+    assert cache.get(_SchemaClient([])) == FALLBACK_SCHEMA
+    # The tables appear (module 02 ran): the next call must see them, TTL or not.
+    assert "taxi_trips (" in cache.get(_SchemaClient(_TRIPS))
+
+
+def test_schema_cache_refreshes_once_for_concurrent_requests() -> None:
+    # FastAPI runs the handler in a threadpool: when the TTL lapses, the requests that
+    # arrive while one is revalidating wait for its text instead of querying too.
+    entered, release = threading.Event(), threading.Event()
+
+    class _SlowClient(_SchemaClient):
+        def query(self, sql: str, **kwargs):
+            if "system.columns" in sql:
+                entered.set()
+                release.wait(5)
+            return super().query(sql, **kwargs)
+
+    cache = SchemaCache(ttl_seconds=60, stats_ttl_seconds=900, clock=_Clock())
+    client = _SlowClient(_TRIPS + _ZONES)
+    texts: list[str] = []
+    threads = [threading.Thread(target=lambda: texts.append(cache.get(client))) for _ in range(4)]
+
+    threads[0].start()
+    assert entered.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)  # let the others reach the lock
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert sum("system.columns" in sql for sql in client.queries) == 1
+    assert len(texts) == 4 and len(set(texts)) == 1
+
+
+# --- EXPLAIN ESTIMATE cost guard ------------------------------------------
+
+class _ExplainResult:
+    column_names = ("database", "table", "parts", "rows", "marks")
+
+    def __init__(self, *rows: int) -> None:
+        self.result_rows = [("nyc_tlc_data", f"t{i}", 1, r, 1) for i, r in enumerate(rows)]
+
+
+class _CostClient:
+    """Returns a scripted row estimate per EXPLAIN, and one empty result otherwise."""
+
+    def __init__(self, *estimates) -> None:
+        self.estimates = list(estimates)
+        self.queries: list[str] = []
+
+    def query(self, sql: str, **_kwargs):
+        self.queries.append(sql)
+        if sql.startswith("EXPLAIN ESTIMATE"):
+            effect = self.estimates.pop(0)
+            if isinstance(effect, Exception):
+                raise effect
+            return _ExplainResult(*effect)
+        result = _ExplainResult()
+        result.column_names = ("x",)
+        return result
+
+
+def test_estimate_sums_rows_across_tables() -> None:
+    client = _CostClient((1_000, 265))
+    assert estimate_rows_read(client, "SELECT 1 LIMIT 1") == 1_265
+    assert client.queries == ["EXPLAIN ESTIMATE SELECT 1 LIMIT 1"]
+
+
+def test_estimate_unavailable_is_none() -> None:
+    client = _CostClient(DatabaseError("Code: 60. UNKNOWN_TABLE"))
+    assert estimate_rows_read(client, "SELECT 1 LIMIT 1") is None
+
+
+def test_cost_guard_rejects_over_budget(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "chat_max_estimated_rows", 1_000)
+    with pytest.raises(QueryCostError) as excinfo:
+        check_query_cost(_CostClient((5_000,)), "SELECT 1 LIMIT 1")
+    assert excinfo.value.estimated_rows == 5_000
+    # Still a guardrail rejection, so the router maps it to a 400.
+    assert isinstance(excinfo.value, SqlGuardrailError)
+
+
+def test_cost_guard_disabled_with_zero_budget(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "chat_max_estimated_rows", 0)
+    client = _CostClient()
+    assert check_query_cost(client, "SELECT 1 LIMIT 1") is None
+    assert client.queries == []
+
+
+def test_run_chat_asks_for_one_rewrite_when_over_budget(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "chat_max_estimated_rows", 1_000)
+    monkeypatch.setattr(chat_service, "get_schema_text", lambda _client: "schema")
+    calls: list = []
+
+    def fake_plan(message, schema_text, conversation_id, rejected=None, history=()):
+        calls.append(rejected)
+        sql = "SELECT 1 AS x FROM taxi_trips LIMIT 1" if rejected is None else "SELECT 2 AS x LIMIT 1"
+        return ChatPlan(answer="a", sql=sql, chart=None)
+
+    monkeypatch.setattr(chat_service, "generate_plan", fake_plan)
+    result = chat_service.run_chat(_CostClient((50_000,), (10,)), "how many?", None)
+
+    assert result.sql == "SELECT 2 AS x LIMIT 1"
+    assert calls[0] is None
+    assert calls[1][0] == "SELECT 1 AS x FROM taxi_trips LIMIT 1"
+    assert "50,000" in calls[1][1]
+
+
+def test_run_chat_rejects_a_rewrite_that_is_still_over_budget(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "chat_max_estimated_rows", 1_000)
+    monkeypatch.setattr(chat_service, "get_schema_text", lambda _client: "schema")
+    monkeypatch.setattr(
+        chat_service,
+        "generate_plan",
+        lambda *a, **k: ChatPlan(answer="a", sql="SELECT 1 AS x LIMIT 1", chart=None),
+    )
+    with pytest.raises(QueryCostError):
+        chat_service.run_chat(_CostClient((50_000,), (60_000,)), "how many?", None)
+
+
+# --- Prompt assembly -------------------------------------------------------
+
+def test_few_shots_are_picked_by_keyword_overlap() -> None:
+    shots = select_few_shots("What was the daily revenue from tips last month?", 1)
+    assert shots[0].question == "Show daily revenue for July 2022."
+
+
+def test_few_shot_selection_is_deterministic_without_matches() -> None:
+    # No overlap at all: the first k of the bank, so the prompt is still stable.
+    first = select_few_shots("xyzzy", 2)
+    assert first == select_few_shots("xyzzy", 2)
+    assert [s.question for s in first] == [s.question for s in chat_service.FEW_SHOT_BANK[:2]]
+
+
+def test_relevant_tables_follow_the_question() -> None:
+    assert relevant_tables("How many trips yesterday?", []) == {"taxi_trips"}
+    assert "taxi_zones" in relevant_tables("Trips per borough", [])
+    assert "taxi_trips_expanded" in relevant_tables("average mph by hour", [])
+
+
+def test_trim_schema_drops_unused_tables_and_their_statistics() -> None:
+    text = (
+        "taxi_trips (\n  car_type String\n)\n\n"
+        "taxi_zones (\n  borough String\n)\n\n"
+        "Data statistics (approximate):\n"
+        "- taxi_trips: ~10 rows\n"
+        "- taxi_zones.borough values: 'Queens'"
+    )
+    trimmed = trim_schema_text(text, {"taxi_trips"})
+    assert "taxi_zones" not in trimmed
+    assert "- taxi_trips: ~10 rows" in trimmed
+
+
+def test_prompt_keeps_a_stable_prefix_and_reports_savings(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "chat_few_shot_count", 1)
+    monkeypatch.setattr(settings, "chat_trim_schema", True)
+    one = build_prompt("How many trips per hour yesterday?", FALLBACK_SCHEMA)
+    two = build_prompt("Busiest zones in Queens", FALLBACK_SCHEMA)
+
+    # The first message never varies per question: it is what prefix caching reuses.
+    assert one.messages[0] == two.messages[0]
+    assert one.messages[-1] == {"role": "user", "content": "How many trips per hour yesterday?"}
+    assert one.few_shots == 1
+    assert len(one.messages) == 2 + 2 + 1
+    assert one.tables == ("taxi_trips",)
+    assert "taxi_zones (" not in one.messages[1]["content"]
+    assert one.estimated_tokens < one.estimated_tokens_full_bank
+    assert one.estimated_tokens_saved_vs_full_bank == one.estimated_tokens_full_bank - one.estimated_tokens
+    # Trimmed per question, only the system prompt is shared, and that is too short to cache.
+    assert one.estimated_tokens_stable_prefix < chat_service.PROMPT_CACHE_MIN_TOKENS
+
+
+def test_cache_layout_sends_one_prefix_long_enough_to_cache(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "chat_prompt_cache", True)
+    one = build_prompt("How many trips per hour yesterday?", FALLBACK_SCHEMA)
+    two = build_prompt("Busiest zones in Queens", FALLBACK_SCHEMA)
+
+    prefix = 2 + 2 * len(chat_service.FEW_SHOT_BANK)
+    assert one.messages[:prefix] == two.messages[:prefix]
+    assert one.messages[prefix:] == [{"role": "user", "content": "How many trips per hour yesterday?"}]
+    assert one.tables == chat_service.ALLOWED_TABLES
+    assert one.estimated_tokens_stable_prefix >= chat_service.PROMPT_CACHE_MIN_TOKENS
+    question_tokens = chat_service._estimate_tokens("How many trips per hour yesterday?")
+    assert one.estimated_tokens_stable_prefix == one.estimated_tokens - question_tokens
+
+
+def test_a_statistics_refresh_leaves_the_cached_prefix_alone(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "chat_prompt_cache", True)
+    before = FALLBACK_SCHEMA + "\n\nData statistics (approximate):\n- taxi_trips: ~10 rows"
+    after = FALLBACK_SCHEMA + "\n\nData statistics (approximate):\n- taxi_trips: ~12 rows"
+    one = build_prompt("How many trips per hour yesterday?", before)
+    two = build_prompt("How many trips per hour yesterday?", after)
+
+    prefix = 2 + 2 * len(chat_service.FEW_SHOT_BANK)
+    assert one.messages[:prefix] == two.messages[:prefix]
+    assert "Data statistics" not in one.messages[1]["content"]
+    assert one.messages[prefix] == {
+        "role": "system",
+        "content": "Data statistics (approximate):\n- taxi_trips: ~10 rows",
+    }
+    assert one.messages[prefix + 1:] == [{"role": "user", "content": "How many trips per hour yesterday?"}]
+    assert one.estimated_tokens_stable_prefix == build_prompt("x", FALLBACK_SCHEMA).estimated_tokens_stable_prefix
+
+
+# --- Per-turn tracing overhead measurement --------------------------------
+
+def test_chat_turn_logs_its_tracing_overhead(caplog) -> None:
+    # Tracing is off in the unit tests, so the wrapper must add no tracer and report
+    # zero overhead while still timing the turn (the "off" baseline to compare with).
+    wrapped = chat_service._chat_trace(lambda x: x * 2)
+
+    with caplog.at_level("INFO", logger="app.chat"):
+        assert wrapped(21) == 42
+
+    assert "tracing=off tracing_overhead_ms=0.00" in caplog.text
+    assert "chat turn: total_ms=" in caplog.text
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+import app.chat_service as chat_service
+from app.chat_memory import ChatTurn, ConversationStore, summarize_rows
+from app.chat_service import ChatPlan, build_prompt, select_history
+from app.settings import settings
+
+
+@pytest.fixture(scope="session", autouse=True)
+def wait_for_api() -> None:
+    # Override the integration-test fixture from conftest.py: these are pure unit
+    # tests for the conversation store and do not need a running API / ClickHouse.
+    return None
+
+
+def _turn(n: int, sql: str | None = "SELECT 1 LIMIT 1") -> ChatTurn:
+    return ChatTurn(question=f"question {n}", answer=f"answer {n}", sql=sql, summary=None)
+
+
+# --- Result summaries ------------------------------------------------------
+
+def test_summary_is_compact() -> None:
+    rows = [{"zone": f"z{i}", "trips": i} for i in range(50)]
+    text = summarize_rows(rows)
+    assert text.startswith("50 rows, columns zone, trips; first: zone=z0, trips=0")
+    assert "z3" not in text  # only the first three rows
+
+
+def test_summary_of_no_result() -> None:
+    assert summarize_rows(None) is None
+    assert summarize_rows([]) == "0 rows"
+
+
+def test_summary_is_capped() -> None:
+    text = summarize_rows([{"x": "y" * 1000}])
+    assert len(text) <= 400 and text.endswith("...")
+
+
+# --- Store -----------------------------------------------------------------
+
+def test_turns_are_kept_oldest_first_and_bounded() -> None:
+    store = ConversationStore(max_conversations=10, max_turns=3)
+    for n in range(5):
+        store.append("c1", _turn(n))
+    assert [t.question for t in store.history("c1")] == ["question 2", "question 3", "question 4"]
+    assert store.history("other") == []
+
+
+def test_least_recently_used_conversation_is_evicted() -> None:
+    store = ConversationStore(max_conversations=2, max_turns=3)
+    store.append("a", _turn(1))
+    store.append("b", _turn(2))
+    store.history("a")  # touch a, so b is now the oldest
+    store.append("c", _turn(3))
+    assert store.history("a")
+    assert store.history("b") == []
+
+
+def test_sqlite_persists_across_store_instances(tmp_path) -> None:
+    path = str(tmp_path / "memory.db")
+    first = ConversationStore(max_conversations=10, max_turns=2, sqlite_path=path)
+    for n in range(3):
+        first.append("c1", _turn(n))
+
+    second = ConversationStore(max_conversations=10, max_turns=2, sqlite_path=path)
+    assert [t.question for t in second.history("c1")] == ["question 1", "question 2"]
+
+
+def test_unusable_sqlite_path_falls_back_to_memory(tmp_path) -> None:
+    store = ConversationStore(max_conversations=10, max_turns=2, sqlite_path=str(tmp_path / "missing" / "x.db"))
+    store.append("c1", _turn(1))
+    assert len(store.history("c1")) == 1
+
+
+# --- Prompt injection under a token budget ----------------------------------
+
+def test_history_keeps_the_newest_turns_within_budget() -> None:
+    turns = [_turn(n) for n in range(10)]
+    one_turn = sum(chat_service._estimate_tokens(m["content"]) for m in turns[0].messages())
+    kept = select_history(turns, max_tokens=one_turn * 2)
+    assert [t.question for t in kept] == ["question 8", "question 9"]
+    assert select_history(turns, max_tokens=0) == []
+
+
+def test_history_is_replayed_between_examples_and_question(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "chat_memory_max_tokens", 1000)
+    turn = ChatTurn(
+        question="Top pickup zones in July 2022",
+        answer="Busiest zones.",
+        sql="SELECT z.zone AS zone FROM taxi_trips t JOIN taxi_zones z ON z.location_id = t.pickup_location_id LIMIT 10",
+        summary="10 rows, columns zone",
+    )
+    prompt = build_prompt("now only for green cabs", chat_service.FALLBACK_SCHEMA, [turn])
+
+    assert prompt.history_turns == 1
+    assert prompt.messages[-3] == {"role": "user", "content": "Top pickup zones in July 2022"}
+    assert json.loads(prompt.messages[-2]["content"])["result"] == "10 rows, columns zone"
+    assert prompt.messages[-1]["content"] == "now only for green cabs"
+    # The follow-up never mentions zones, but the turn it builds on joined them.
+    assert "taxi_zones" in prompt.tables
+
+
+def test_run_chat_stores_turns_and_replays_them(monkeypatch) -> None:
+    store = ConversationStore(max_conversations=10, max_turns=5)
+    monkeypatch.setattr(chat_service, "_conversations", store)
+    monkeypatch.setattr(chat_service, "get_schema_text", lambda _client: "schema")
+    seen: list = []
+
+    def fake_plan(message, schema_text, conversation_id, rejected=None, history=()):
+        seen.append([t.question for t in history])
+        return ChatPlan(answer=f"re: {message}", sql=None, chart=None)
+
+    monkeypatch.setattr(chat_service, "generate_plan", fake_plan)
+    chat_service.run_chat(None, "first", "conv-1")
+    chat_service.run_chat(None, "second", "conv-1")
+    chat_service.run_chat(None, "stateless", None)
+
+    assert seen == [[], ["first"], []]
+    assert [t.answer for t in store.history("conv-1")] == ["re: first", "re: second"]
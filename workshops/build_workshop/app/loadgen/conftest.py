@@ -0,0 +1,6 @@
+"""Makes `import pg_trip_writer` resolve from tests/.
+
+pytest inserts the directory holding a conftest.py at the front of sys.path, so this
+file existing beside pg_trip_writer.py is what lets tests/ import it however pytest
+is invoked.
+"""
@@ -1,11 +1,16 @@
 from __future__ import annotations
 
+import csv
 import logging
+import mmap
+import multiprocessing as mp
 import os
-import random
+import sys
 import time
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
+import clickhouse_connect
+import numpy as np
 import psycopg
 from psycopg import errors, sql
 
@@ -37,6 +42,108 @@ PG_PUBLICATION = env("PG_PUBLICATION", "pub_taxi")
 
 RATE_PER_SEC = float(env("RATE_PER_SEC", "5"))
 BATCH_SIZE = int(env("BATCH_SIZE", "25"))
+# Worker processes, each with its own connection, all drawing batch slots from one
+# shared schedule, so RATE_PER_SEC stays the total offered load. Raise it when a
+# single connection cannot keep up with the target rate.
+WORKERS = int(env("WORKERS", "1"))
+# How far the shared schedule may fall behind before the backlog is dropped.
+MAX_LAG_SECONDS = float(env("MAX_LAG_SECONDS", "1.0"))
+# Replay real trips instead of synthesizing them: a CSV shaped like
+# db/sample/trips.csv or a TLC Parquet file (needs pyarrow). The file's own arrival
+# times set the rate, so RATE_PER_SEC is ignored; REPLAY_SPEED=60 plays an hour
+# of history per minute. Empty keeps the synthetic generator.
+REPLAY_FILE = env("REPLAY_FILE", "")
+REPLAY_SPEED = float(env("REPLAY_SPEED", "1"))
+# Mutation mix, as a fraction of inserted trips: UPDATE_RATIO=0.05 corrects the
+# fare on 5 recent trips per 100 inserted, DELETE_RATIO cancels (deletes) them.
+# Both default to 0 (append-only, as the CDC MV originally assumed). Targets are
+# drawn from the newest MUTATION_WINDOW ids, where real corrections happen.
+UPDATE_RATIO = float(env("UPDATE_RATIO", "0"))
+DELETE_RATIO = float(env("DELETE_RATIO", "0"))
+MUTATION_WINDOW = int(env("MUTATION_WINDOW", "10000"))
+# End-to-end CDC lag probe: every CDC_PROBE_INTERVAL seconds one marker trip is
+# committed to Postgres and ClickHouse is polled until it shows up in
+# nyc_tlc_data.taxi_trips. 0 disables it; enabling it needs the CLICKHOUSE_* vars.
+CDC_PROBE_INTERVAL = float(env("CDC_PROBE_INTERVAL", "0"))
+# Lag percentiles are logged once per window; a marker unseen after the timeout
+# is counted missing (pipe paused, MV dropped) rather than waited on forever.
+CDC_PROBE_WINDOW = float(env("CDC_PROBE_WINDOW", "10"))
+CDC_PROBE_TIMEOUT = float(env("CDC_PROBE_TIMEOUT", "300"))
+CDC_PROBE_POLL = 0.5
+CLICKHOUSE_HOST = env("CLICKHOUSE_HOST", "")
+CLICKHOUSE_PORT = int(env("CLICKHOUSE_PORT", "8443"))
+CLICKHOUSE_USER = env("CLICKHOUSE_USER", "default")
+CLICKHOUSE_PASSWORD = env("CLICKHOUSE_PASSWORD", "")
+CLICKHOUSE_DATABASE = env("CLICKHOUSE_DATABASE", "nyc_tlc_data")
+CLICKHOUSE_SECURE = env("CLICKHOUSE_SECURE", "true").lower() in ("1", "true", "yes")
+# How each batch reaches Postgres:
+#   executemany -- one parameterized INSERT per row (the default; fine at demo rates)
+#   pipeline    -- the same INSERTs in libpq pipeline mode, one transaction per batch
+#   copy        -- one binary COPY per batch; use this to push 50k+ rows/s into the
+#                  CDC path when stress-testing ClickPipes and the MV behind it
+INSERT_MODE = env("INSERT_MODE", "executemany")
+# psycopg (default): the process-per-worker writer below. asyncpg: the asyncio
+# variant in pg_trip_writer_async.py, several connections in one process each
+# keeping a batch in flight; it supports the synthetic executemany/copy path only.
+LOADGEN_DRIVER = env("LOADGEN_DRIVER", "psycopg")
+# Seed for the row generator; unset draws fresh OS entropy on every start. Set it
+# to replay the exact same stream of trips (e.g. when comparing insert modes).
+LOADGEN_SEED = os.getenv("LOADGEN_SEED") or None
+
+# Column order shared by the INSERT, the COPY and the row tuples built below.
+COLUMNS = (
+    "pickup_datetime",
+    "dropoff_datetime",
+    "pickup_location_id",
+    "dropoff_location_id",
+    "passenger_count",
+    "trip_distance",
+    "fare_amount",
+    "tip_amount",
+    "total_amount",
+    "payment_type",
+    "vendor_id",
+    "car_type",
+)
+# Binary COPY sends values in the server's wire format, so psycopg must be told the
+# Postgres type of every column up front (same order as COLUMNS).
+COPY_TYPES = (
+    "timestamptz",
+    "timestamptz",
+    "int4",
+    "int4",
+    "int2",
+    "float8",
+    "float8",
+    "float8",
+    "float8",
+    "int2",
+    "int2",
+    "text",
+)
+
+INSERT_SQL = "INSERT INTO realtime_trips ({}) VALUES ({})".format(
+    ", ".join(COLUMNS), ", ".join(["%s"] * len(COLUMNS))
+)
+COPY_SQL = "COPY realtime_trips ({}) FROM STDIN (FORMAT BINARY)".format(", ".join(COLUMNS))
+
+# Both mutations pick their targets at random among the newest ids; max(id) is one
+# index probe on the primary key, so the sample costs a short range scan at most.
+RECENT_IDS_SQL = """
+    SELECT id FROM realtime_trips
+    WHERE id > (SELECT coalesce(max(id), 0) FROM realtime_trips) - %(window)s
+    ORDER BY random() LIMIT %(n)s
+"""
+# Fare correction: the fare moves by up to +/-20% and the total follows it.
+UPDATE_SQL = f"""
+    UPDATE realtime_trips t
+    SET fare_amount = round((t.fare_amount * c.factor)::numeric, 2)::float8,
+        total_amount = round((t.total_amount + t.fare_amount * (c.factor - 1))::numeric, 2)::float8
+    FROM (SELECT id, 0.8 + random() * 0.4 AS factor FROM ({RECENT_IDS_SQL}) recent) c
+    WHERE t.id = c.id
+"""
+# Cancellation: the trip disappears, which CDC carries as _peerdb_is_deleted = 1.
+DELETE_SQL = f"DELETE FROM realtime_trips WHERE id IN ({RECENT_IDS_SQL})"
 
 
 def ensure_publication(conn: psycopg.Connection, pub_name: str) -> None:
@@ -74,20 +181,531 @@ def ensure_publication(conn: psycopg.Connection, pub_name: str) -> None:
         )
 
 
-def pick_zone_id() -> int:
+PASSENGER_COUNTS = np.array([1, 1, 1, 2, 2, 3])
+PAYMENT_TYPES = np.array([1, 1, 1, 2, 2, 1])
+VENDOR_IDS = np.array([1, 2])
+CAR_TYPES = np.array(["yellow", "green"], dtype=object)
+
+
+def pick_zone_ids(rng: np.random.Generator, n: int) -> np.ndarray:
     # Very rough weighting toward Manhattan-ish IDs, but still covers full range.
     # TLC taxi zones are typically 1..263.
-    r = random.random()
-    if r < 0.65:
-        return random.randint(140, 250)
-    return random.randint(1, 263)
+    manhattan = rng.random(n) < 0.65
+    return np.where(manhattan, rng.integers(140, 251, n), rng.integers(1, 264, n))
 
 
-def main() -> None:
-    dsn = f"host={PGHOST} port={PGPORT} dbname={PGDATABASE} user={PGUSER} password={PGPASSWORD}"
-    logger.info(f"[loadgen] connecting: {PGHOST}:{PGPORT} db={PGDATABASE} user={PGUSER}")
+def make_batch(rng: np.random.Generator, now: datetime, n: int) -> list[tuple]:
+    """n synthetic trips as tuples in COLUMNS order.
+
+    Every column is drawn in one vectorized call, with the same distributions the
+    per-row generator used: pickups up to 30s in the past, gaussian duration and
+    distance with floors, fare proportional to distance, 20% of trips untipped.
+    Only the timestamps are built per row, because psycopg needs tz-aware datetimes.
+    """
+    base = now.timestamp()
+    pickup_ts = base + rng.integers(-30, 1, n)
+    duration_s = np.maximum(30, rng.normal(12 * 60, 6 * 60, n).astype(np.int64))
+    dropoff_ts = pickup_ts + duration_s
+
+    dist = np.maximum(0.2, rng.normal(2.5, 1.8, n))
+    fare = np.maximum(2.5, dist * rng.uniform(2.5, 4.5, n))
+    tip = np.where(rng.random(n) < 0.2, 0.0, fare * rng.uniform(0.10, 0.35, n))
+    total = fare + tip + rng.uniform(0, 3.0, n)
+
+    # tolist() turns the arrays into Python ints/floats/strs, which is what the
+    # INSERT adapters and COPY's binary dumpers expect.
+    return list(
+        zip(
+            [datetime.fromtimestamp(t, timezone.utc) for t in pickup_ts.tolist()],
+            [datetime.fromtimestamp(t, timezone.utc) for t in dropoff_ts.tolist()],
+            pick_zone_ids(rng, n).tolist(),
+            pick_zone_ids(rng, n).tolist(),
+            rng.choice(PASSENGER_COUNTS, n).tolist(),
+            np.round(dist, 3).tolist(),
+            np.round(fare, 2).tolist(),
+            np.round(tip, 2).tolist(),
+            np.round(total, 2).tolist(),
+            rng.choice(PAYMENT_TYPES, n).tolist(),
+            rng.choice(VENDOR_IDS, n).tolist(),
+            rng.choice(CAR_TYPES, n).tolist(),
+        )
+    )
+
+
+def bench_generation(seconds: float = 3.0, batch_size: int = 10_000) -> None:
+    """Report how many rows/s make_batch produces on one core, without a database.
+
+    Run as `python pg_trip_writer.py bench [batch_size]` to check the generator has
+    headroom over the rate you plan to offer (COPY mode tops out well above 50k rows/s).
+    """
+    rng = np.random.default_rng(None if LOADGEN_SEED is None else int(LOADGEN_SEED))
+    now = datetime.now(timezone.utc)
+    rows = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        rows += len(make_batch(rng, now, batch_size))
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"[loadgen] generated {rows} rows in {elapsed:.2f}s with batch_size={batch_size}: "
+        f"{rows / elapsed:,.0f} rows/s on one core"
+    )
+
+
+# Accepted spellings per field: this repo's sample CSV, realtime_trips itself, and the
+# TLC yellow (tpep_) / green (lpep_) Parquet files. Fields marked optional below get
+# a default when the source lacks them.
+REPLAY_COLUMNS = {
+    "pickup": ("pickup_datetime", "tpep_pickup_datetime", "lpep_pickup_datetime"),
+    "dropoff": ("dropoff_datetime", "tpep_dropoff_datetime", "lpep_dropoff_datetime"),
+    "pickup_zone": ("pickup_zone_id", "pickup_location_id", "PULocationID"),
+    "dropoff_zone": ("dropoff_zone_id", "dropoff_location_id", "DOLocationID"),
+    "passenger_count": ("passenger_count",),
+    "trip_distance": ("trip_distance",),
+    "fare_amount": ("fare_amount",),
+    "tip_amount": ("tip_amount",),
+    "total_amount": ("total_amount",),
+    "payment_type": ("payment_type",),
+    "vendor_id": ("vendor_id", "VendorID"),
+    "car_type": ("car_type",),
+}
+REPLAY_OPTIONAL = {"total_amount", "car_type"}
+
+
+def _replay_column(available: list[str], field: str) -> str | None:
+    for name in REPLAY_COLUMNS[field]:
+        if name in available:
+            return name
+    if field in REPLAY_OPTIONAL:
+        return None
+    raise SystemExit(f"[loadgen] {REPLAY_FILE}: no column for {field} (tried {', '.join(REPLAY_COLUMNS[field])})")
+
+
+def _read_csv(path: str) -> tuple[list[str], dict[str, list[str]]]:
+    # Memory-mapped so the raw bytes are read from the page cache rather than copied
+    # into a buffer this process then holds alongside the parsed columns.
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        reader = csv.reader(line.decode() for line in iter(mm.readline, b""))
+        header = next(reader)
+        values = list(zip(*reader))
+    return header, {name: list(col) for name, col in zip(header, values)}
+
+
+def _read_parquet(path: str) -> tuple[list[str], dict]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("[loadgen] replaying Parquet needs pyarrow: pip install pyarrow") from None
+    table = pq.read_table(path, memory_map=True)
+    return table.column_names, {name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names}
+
+
+def load_trips(path: str) -> dict[str, np.ndarray]:
+    """Read a trips file into one array per field, sorted by pickup time.
+
+    Timestamps become integer epoch seconds of the file's naive local times. Missing
+    numeric values (TLC files often leave passenger_count blank) fall back to 1 for
+    counts and IDs and to 0 for distances and money, so a blank fare is not $1.00.
+    """
+    header, raw = _read_parquet(path) if path.endswith(".parquet") else _read_csv(path)
+    names = {field: _replay_column(header, field) for field in REPLAY_COLUMNS}
+
+    def times(field: str) -> np.ndarray:
+        return np.asarray(raw[names[field]], dtype="datetime64[s]").astype(np.int64)
+
+    def numbers(field: str, dtype, missing: float) -> np.ndarray:
+        col = np.asarray(raw[names[field]])
+        if col.dtype.kind == "U":
+            # A blank CSV field; Parquet nulls already arrive as NaN.
+            col = np.where(col == "", "nan", col)
+        return np.nan_to_num(col.astype(np.float64), nan=missing).astype(dtype)
+
+    trips = {
+        "pickup": times("pickup"),
+        "dropoff": times("dropoff"),
+        "pickup_zone": numbers("pickup_zone", np.int64, 1.0),
+        "dropoff_zone": numbers("dropoff_zone", np.int64, 1.0),
+        "passenger_count": numbers("passenger_count", np.int64, 1.0),
+        "trip_distance": numbers("trip_distance", np.float64, 0.0),
+        "fare_amount": numbers("fare_amount", np.float64, 0.0),
+        "tip_amount": numbers("tip_amount", np.float64, 0.0),
+        "payment_type": numbers("payment_type", np.int64, 1.0),
+        "vendor_id": numbers("vendor_id", np.int64, 1.0),
+    }
+    trips["total_amount"] = (
+        numbers("total_amount", np.float64, 0.0)
+        if names["total_amount"]
+        else trips["fare_amount"] + trips["tip_amount"]
+    )
+    if names["car_type"]:
+        trips["car_type"] = np.asarray(raw[names["car_type"]], dtype=object)
+    else:
+        # TLC files say which fleet they are in the column prefix.
+        car_type = "green" if names["pickup"].startswith("lpep_") else "yellow"
+        trips["car_type"] = np.full(len(trips["pickup"]), car_type, dtype=object)
+    if not len(trips["pickup"]):
+        raise SystemExit(f"[loadgen] {path} has no trips to replay")
+
+    order = np.argsort(trips["pickup"], kind="stable")
+    return {field: col[order] for field, col in trips.items()}
+
+
+class Replay:
+    """Plays recorded trips back on the wall clock, looping the file when it runs out.
+
+    Source time advances REPLAY_SPEED seconds per wall second from `origin`, and a
+    trip is due once source time passes its pickup. Emitted timestamps are shifted so
+    the trip lands at the moment it was due (durations are kept as recorded), so the
+    live dashboards see the file's arrival pattern and zone mix as current traffic.
+    A file covering a day or more starts at the current time of day, which keeps the
+    hourly shape lined up with the clock at REPLAY_SPEED=1; times compare in the
+    container's local time, so set TZ=America/New_York for TLC files.
+
+    With several workers each takes every `shards`-th trip, all on the same clock.
+    """
+
+    def __init__(
+        self, trips: dict[str, np.ndarray], speed: float, shard: int, shards: int,
+        started_at: float, started_mono: float,
+    ) -> None:
+        pickup = trips["pickup"]
+        gaps = np.diff(pickup)
+        # One loop of the file, plus a typical gap so the wrap does not double up.
+        self.period = int(pickup[-1] - pickup[0]) + max(1, int(np.median(gaps)) if len(gaps) else 1)
+        origin = int(pickup[0])
+        if pickup[-1] - pickup[0] >= 86400:
+            local = time.localtime(started_at)
+            time_of_day = local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec
+            origin = origin - origin % 86400 + time_of_day
+            if origin < pickup[0]:
+                origin += 86400
+            if origin > pickup[-1]:
+                origin -= 86400
+        self.origin = origin
+        self.speed = speed
+        self.started_at = started_at
+        self.started_mono = started_mono
+        self.trips = {field: col[shard::shards] for field, col in trips.items()}
+        self.pos = int(np.searchsorted(self.trips["pickup"], origin))
+        self.loop = 0
+        if self.pos >= len(self.trips["pickup"]):
+            self.pos, self.loop = 0, 1
+
+    def _source_time(self, index: int) -> int:
+        return int(self.trips["pickup"][index]) + self.loop * self.period
+
+    def due(self, mono_now: float, limit: int) -> tuple[list[tuple], float]:
+        """Up to `limit` due trips in COLUMNS order, and the wall seconds until the next one."""
+        if not len(self.trips["pickup"]):
+            return [], 1.0
+        source_now = self.origin + (mono_now - self.started_mono) * self.speed
+        rows: list[tuple] = []
+        t = self._source_time(self.pos)
+        while len(rows) < limit and t <= source_now:
+            rows.append(self._row(self.pos, t))
+            self.pos += 1
+            if self.pos == len(self.trips["pickup"]):
+                self.pos, self.loop = 0, self.loop + 1
+            t = self._source_time(self.pos)
+        return rows, max(0.0, (t - source_now) / self.speed)
+
+    def lag(self, mono_now: float) -> float:
+        """Wall seconds the oldest undelivered trip is overdue."""
+        if not len(self.trips["pickup"]):
+            return 0.0
+        source_now = self.origin + (mono_now - self.started_mono) * self.speed
+        return max(0.0, (source_now - self._source_time(self.pos)) / self.speed)
+
+    def _row(self, i: int, source_time: int) -> tuple:
+        t = self.trips
+        pickup = datetime.fromtimestamp(self.started_at + (source_time - self.origin) / self.speed, timezone.utc)
+        duration = max(0, int(t["dropoff"][i] - t["pickup"][i]))
+        return (
+            pickup,
+            datetime.fromtimestamp(pickup.timestamp() + duration, timezone.utc),
+            int(t["pickup_zone"][i]),
+            int(t["dropoff_zone"][i]),
+            int(t["passenger_count"][i]),
+            float(t["trip_distance"][i]),
+            float(t["fare_amount"][i]),
+            float(t["tip_amount"][i]),
+            float(round(t["total_amount"][i], 2)),
+            int(t["payment_type"][i]),
+            int(t["vendor_id"][i]),
+            str(t["car_type"][i]),
+        )
+
+
+def insert_executemany(conn: psycopg.Connection, rows: list[tuple]) -> None:
+    with conn.cursor() as cur:
+        cur.executemany(INSERT_SQL, rows)
+
+
+def insert_pipeline(conn: psycopg.Connection, rows: list[tuple]) -> None:
+    # Pipeline mode sends every INSERT before reading any result, so the batch costs
+    # one network round trip instead of one per row; the transaction makes it one
+    # commit (and one CDC transaction) per batch, like COPY.
+    with conn.pipeline(), conn.transaction(), conn.cursor() as cur:
+        cur.executemany(INSERT_SQL, rows)
+
+
+def insert_copy(conn: psycopg.Connection, rows: list[tuple]) -> None:
+    with conn.cursor() as cur, cur.copy(COPY_SQL) as copy:
+        copy.set_types(COPY_TYPES)
+        for row in rows:
+            copy.write_row(row)
+
+
+WRITERS = {
+    "executemany": insert_executemany,
+    "pipeline": insert_pipeline,
+    "copy": insert_copy,
+}
+
+
+def write_batch(conn: psycopg.Connection, rows: list[tuple]) -> None:
+    WRITERS[INSERT_MODE](conn, rows)
 
-    # Create table if missing (idempotent). Debezium will capture changes.
+
+class Pacer:
+    """Hands out batch start slots against one monotonic schedule shared by all workers.
+
+    Sleeping a fixed BATCH_SIZE / RATE_PER_SEC after every insert makes the real rate
+    batch / (sleep + insert time), which sags whenever Postgres slows down. Here each
+    slot is fixed on the schedule up front, so insert time only eats into the wait for
+    the next one. The schedule lives in shared memory and CLOCK_MONOTONIC is
+    system-wide, so worker processes claim from it under one lock and a fast worker
+    picks up the slots a slow one cannot take.
+
+    A schedule more than max_lag_seconds behind is restarted from now instead of
+    bursting the whole backlog into Postgres once it recovers.
+    """
+
+    def __init__(self, batches_per_sec: float, max_lag_seconds: float) -> None:
+        self.interval = 1.0 / batches_per_sec
+        self.max_lag_seconds = max_lag_seconds
+        self._next_at = mp.Value("d", -1.0)
+        self._restarts = mp.Value("q", 0)
+
+    def claim(self, now: float) -> float:
+        """Reserve the next start slot and return how long to wait for it."""
+        with self._next_at.get_lock():
+            next_at = self._next_at.value
+            if next_at < 0.0:
+                next_at = now
+            elif next_at < now - self.max_lag_seconds:
+                with self._restarts.get_lock():
+                    self._restarts.value += 1
+                next_at = now
+            self._next_at.value = next_at + self.interval
+        delay = next_at - now
+        return delay if delay > 0.0 else 0.0
+
+    def lag(self, now: float) -> float:
+        """Seconds the next unclaimed slot is overdue; 0.0 while the workers keep up."""
+        next_at = self._next_at.value
+        return max(0.0, now - next_at) if next_at >= 0.0 else 0.0
+
+    @property
+    def restarts(self) -> int:
+        return self._restarts.value
+
+
+class Mutations:
+    """Fare corrections and cancellations issued in proportion to inserted trips.
+
+    Each kind is one statement per batch covering all of its rows, so the mix adds
+    two round trips per batch at most. Fractional counts carry over between
+    batches, so small ratios on small batches still come out exact over time.
+    """
+
+    def __init__(self, update_ratio: float, delete_ratio: float, window: int) -> None:
+        self.update_ratio = update_ratio
+        self.delete_ratio = delete_ratio
+        self.window = window
+        self.updated = mp.Value("q", 0)
+        self.deleted = mp.Value("q", 0)
+        self._owed_updates = 0.0
+        self._owed_deletes = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.update_ratio > 0 or self.delete_ratio > 0
+
+    def after_insert(self, conn: psycopg.Connection, inserted: int) -> None:
+        self._owed_updates += inserted * self.update_ratio
+        self._owed_deletes += inserted * self.delete_ratio
+        # The epsilon keeps float drift (0.1 summed ten times < 1.0) from losing a row.
+        n_update, n_delete = int(self._owed_updates + 1e-9), int(self._owed_deletes + 1e-9)
+        self._owed_updates -= n_update
+        self._owed_deletes -= n_delete
+        with conn.cursor() as cur:
+            if n_update:
+                cur.execute(UPDATE_SQL, {"window": self.window, "n": n_update})
+                with self.updated.get_lock():
+                    self.updated.value += cur.rowcount
+            if n_delete:
+                cur.execute(DELETE_SQL, {"window": self.window, "n": n_delete})
+                with self.deleted.get_lock():
+                    self.deleted.value += cur.rowcount
+
+
+def run_worker(
+    index: int, dsn: str, pacer: Pacer, written, mutations: Mutations, seed: np.random.SeedSequence
+) -> None:
+    """Insert batches on the slots the shared pacer hands out, until killed."""
+    rng = np.random.default_rng(seed)
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        while True:
+            time.sleep(pacer.claim(time.monotonic()))
+            rows = make_batch(rng, datetime.now(timezone.utc), BATCH_SIZE)
+            write_batch(conn, rows)
+            with written.get_lock():
+                written.value += len(rows)
+            mutations.after_insert(conn, len(rows))
+            logger.debug(f"[loadgen] worker {index} inserted {len(rows)} trips")
+
+
+def run_replay_worker(
+    index: int,
+    dsn: str,
+    trips: dict[str, np.ndarray],
+    written,
+    mutations: Mutations,
+    lags,
+    started_at: float,
+    started_mono: float,
+) -> None:
+    """Insert this worker's share of `trips` (main()'s load of REPLAY_FILE) as each falls due, until killed."""
+    replay = Replay(trips, REPLAY_SPEED, index, WORKERS, started_at, started_mono)
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        while True:
+            rows, wait = replay.due(time.monotonic(), BATCH_SIZE)
+            if not rows:
+                time.sleep(min(wait, 1.0))
+                continue
+            write_batch(conn, rows)
+            with written.get_lock():
+                written.value += len(rows)
+            mutations.after_insert(conn, len(rows))
+            lags[index] = replay.lag(time.monotonic())
+            logger.debug(f"[loadgen] worker {index} replayed {len(rows)} trips")
+
+
+# Markers carry no extra column: a marker is an ordinary synthetic trip whose
+# (pickup second, zones, fare) the probe remembers, so dashboards see nothing odd.
+# The MV copies those fields verbatim, and taxi_trips is ordered by
+# (car_type, pickup_datetime), so the lookup is a primary-key range read.
+MARKER_LOOKUP_SQL = """
+    SELECT toUnixTimestamp(pickup_datetime), pickup_location_id, dropoff_location_id, fare_amount
+    FROM taxi_trips
+    WHERE filename = 'realtime_cdc'
+      AND has({car_types:Array(String)}, car_type)
+      AND has({pickups:Array(UInt32)}, toUnixTimestamp(pickup_datetime))
+"""
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _cdc_client():
+    return clickhouse_connect.get_client(
+        host=CLICKHOUSE_HOST,
+        port=CLICKHOUSE_PORT,
+        username=CLICKHOUSE_USER,
+        password=CLICKHOUSE_PASSWORD,
+        database=CLICKHOUSE_DATABASE,
+        secure=CLICKHOUSE_SECURE,
+    )
+
+
+def run_cdc_probe(dsn: str, seed: np.random.SeedSequence) -> None:
+    """Commit marker trips to Postgres and time how long each takes to reach ClickHouse.
+
+    Lag runs from the marker's commit returning to the first poll that finds it in
+    taxi_trips, both on this process's monotonic clock, so it is accurate to about
+    CDC_PROBE_POLL. Every CDC_PROBE_WINDOW seconds one log line reports the lag
+    percentiles of the markers seen in that window, which makes a time series.
+
+    The probe is a measurement, not load: a failed connect, insert or lookup is logged
+    (the first per window), counted in the report, and retried on the next poll with a
+    fresh connection. Markers still unseen at CDC_PROBE_TIMEOUT count as missing.
+    """
+    rng = np.random.default_rng(seed)
+    ch = None
+    conn: psycopg.Connection | None = None
+    pending: dict[tuple, tuple[int, float, str]] = {}
+    lags: list[float] = []
+    missing = errors = 0
+    next_marker = time.monotonic()
+    next_report = next_marker + CDC_PROBE_WINDOW
+    while True:
+        now = time.monotonic()
+        try:
+            if now >= next_marker:
+                next_marker += CDC_PROBE_INTERVAL
+                if conn is None:
+                    conn = psycopg.connect(dsn, autocommit=True)
+                # ClickHouse keeps whole seconds, so the marker must too to match.
+                trip = make_batch(rng, datetime.now(timezone.utc).replace(microsecond=0), 1)[0]
+                trip = (trip[0].replace(microsecond=0), trip[1].replace(microsecond=0)) + trip[2:]
+                with conn.cursor() as cur:
+                    cur.execute(INSERT_SQL + " RETURNING id", trip)
+                    marker_id = cur.fetchone()[0]
+                key = (int(trip[0].timestamp()), trip[2], trip[3], trip[6])
+                pending[key] = (marker_id, time.monotonic(), trip[11])
+
+            if pending:
+                if ch is None:
+                    ch = _cdc_client()
+                result = ch.query(
+                    MARKER_LOOKUP_SQL,
+                    parameters={
+                        "car_types": sorted({car for _, _, car in pending.values()}),
+                        "pickups": sorted({key[0] for key in pending}),
+                    },
+                )
+                seen_at = time.monotonic()
+                for row in result.result_rows:
+                    marker = pending.pop(tuple(row), None)
+                    if marker is not None:
+                        lags.append(seen_at - marker[1])
+        except Exception as exc:  # noqa: BLE001 - never let the probe stop the load it measures
+            if not errors:
+                logger.warning(f"[loadgen] cdc probe error, retrying next poll: {type(exc).__name__}: {exc}")
+            errors += 1
+            if conn is not None:
+                conn.close()
+            conn, ch = None, None
+
+        checked_at = time.monotonic()
+        for key, (marker_id, committed_at, _) in list(pending.items()):
+            if checked_at - committed_at > CDC_PROBE_TIMEOUT:
+                del pending[key]
+                missing += 1
+                logger.warning(
+                    f"[loadgen] cdc marker id={marker_id} not in ClickHouse after {CDC_PROBE_TIMEOUT:g}s"
+                )
+
+        if now >= next_report:
+            next_report += CDC_PROBE_WINDOW
+            if lags or pending or missing or errors:
+                logger.info(
+                    f"[loadgen] cdc lag: seen={len(lags)} p50={percentile(lags, 0.50):.2f}s "
+                    f"p95={percentile(lags, 0.95):.2f}s p99={percentile(lags, 0.99):.2f}s "
+                    f"max={max(lags, default=0.0):.2f}s pending={len(pending)} missing={missing} "
+                    f"errors={errors}"
+                )
+            lags, missing, errors = [], 0, 0
+        time.sleep(CDC_PROBE_POLL)
+
+
+def prepare_database(dsn: str) -> None:
+    """Create realtime_trips if missing (idempotent) and make sure CDC can see it."""
     create_sql = """
     CREATE TABLE IF NOT EXISTS realtime_trips (
       id bigserial PRIMARY KEY,
@@ -107,63 +725,103 @@ def main() -> None:
     );
     """
 
-    insert_sql = """
-    INSERT INTO realtime_trips
-      (pickup_datetime, dropoff_datetime, pickup_location_id, dropoff_location_id,
-       passenger_count, trip_distance, fare_amount, tip_amount, total_amount,
-       payment_type, vendor_id, car_type)
-    VALUES
-      (%(pickup_datetime)s, %(dropoff_datetime)s, %(pickup_location_id)s, %(dropoff_location_id)s,
-       %(passenger_count)s, %(trip_distance)s, %(fare_amount)s, %(tip_amount)s, %(total_amount)s,
-       %(payment_type)s, %(vendor_id)s, %(car_type)s)
-    """
-
-    delay = max(0.01, BATCH_SIZE / max(0.001, RATE_PER_SEC))
-    now = datetime.now(timezone.utc)
-
     with psycopg.connect(dsn, autocommit=True) as conn:
         with conn.cursor() as cur:
             cur.execute(create_sql)
             logger.info(f"[loadgen] ensured realtime_trips table exists")
         ensure_publication(conn, PG_PUBLICATION)
 
-        while True:
-            rows = []
-            for _ in range(BATCH_SIZE):
-                pickup = now + timedelta(seconds=random.randint(-30, 0))
-                duration_s = max(30, int(random.gauss(12 * 60, 6 * 60)))
-                dropoff = pickup + timedelta(seconds=duration_s)
-
-                dist = max(0.2, random.gauss(2.5, 1.8))
-                fare = max(2.5, dist * random.uniform(2.5, 4.5))
-                tip = 0.0 if random.random() < 0.2 else fare * random.uniform(0.10, 0.35)
-                total = fare + tip + random.uniform(0, 3.0)
-
-                rows.append(
-                    {
-                        "pickup_datetime": pickup,
-                        "dropoff_datetime": dropoff,
-                        "pickup_location_id": pick_zone_id(),
-                        "dropoff_location_id": pick_zone_id(),
-                        "passenger_count": random.choice([1, 1, 1, 2, 2, 3]),
-                        "trip_distance": float(round(dist, 3)),
-                        "fare_amount": float(round(fare, 2)),
-                        "tip_amount": float(round(tip, 2)),
-                        "total_amount": float(round(total, 2)),
-                        "payment_type": random.choice([1, 1, 1, 2, 2, 1]),
-                        "vendor_id": random.choice([1, 2]),
-                        "car_type": random.choice(["yellow", "green"]),
-                    }
-                )
 
-            with conn.cursor() as cur:
-                cur.executemany(insert_sql, rows)
-            now = datetime.now(timezone.utc)
-            logger.info(f"[loadgen] inserted {len(rows)} trips @ {now.isoformat(timespec='seconds')}")
-            time.sleep(delay)
+def main() -> None:
+    if INSERT_MODE not in WRITERS:
+        raise SystemExit(f"[loadgen] INSERT_MODE must be one of {', '.join(WRITERS)}; got {INSERT_MODE!r}")
+    if WORKERS < 1:
+        raise SystemExit(f"[loadgen] WORKERS must be >= 1; got {WORKERS}")
+    if REPLAY_FILE and REPLAY_SPEED <= 0:
+        raise SystemExit(f"[loadgen] REPLAY_SPEED must be > 0; got {REPLAY_SPEED}")
+    if CDC_PROBE_INTERVAL > 0 and not CLICKHOUSE_HOST:
+        raise SystemExit("[loadgen] CDC_PROBE_INTERVAL needs CLICKHOUSE_HOST (and CLICKHOUSE_PASSWORD) set")
+    if UPDATE_RATIO < 0 or DELETE_RATIO < 0:
+        raise SystemExit(f"[loadgen] UPDATE_RATIO and DELETE_RATIO must be >= 0; got {UPDATE_RATIO}, {DELETE_RATIO}")
+    dsn = f"host={PGHOST} port={PGPORT} dbname={PGDATABASE} user={PGUSER} password={PGPASSWORD}"
+    logger.info(
+        f"[loadgen] connecting: {PGHOST}:{PGPORT} db={PGDATABASE} user={PGUSER} "
+        f"mode={INSERT_MODE} workers={WORKERS}"
+        + (f" replay={REPLAY_FILE} speed={REPLAY_SPEED:g}x" if REPLAY_FILE else "")
+        + (f" update_ratio={UPDATE_RATIO:g} delete_ratio={DELETE_RATIO:g}" if UPDATE_RATIO or DELETE_RATIO else "")
+    )
+
+    prepare_database(dsn)
+
+    written = mp.Value("q", 0)
+    mutations = Mutations(UPDATE_RATIO, DELETE_RATIO, MUTATION_WINDOW)
+    seeds = np.random.SeedSequence(None if LOADGEN_SEED is None else int(LOADGEN_SEED)).spawn(WORKERS + 1)
+    if REPLAY_FILE:
+        # Parsed once, before forking: a bad file fails here, and the workers get the
+        # arrays instead of each re-reading the file.
+        trips = load_trips(REPLAY_FILE)
+        logger.info(f"[loadgen] replaying {len(trips['pickup'])} trips from {REPLAY_FILE}")
+        lags = mp.Array("d", WORKERS)
+        started_at, started_mono = time.time(), time.monotonic()
+        workers = [
+            mp.Process(
+                target=run_replay_worker,
+                args=(i, dsn, trips, written, mutations, lags, started_at, started_mono),
+                daemon=True,
+            )
+            for i in range(WORKERS)
+        ]
+
+        def status(now: float) -> str:
+            return f"target=replay x{REPLAY_SPEED:g} lag={max(lags):.3f}s"
+    else:
+        pacer = Pacer(max(0.001, RATE_PER_SEC) / BATCH_SIZE, MAX_LAG_SECONDS)
+        workers = [
+            mp.Process(target=run_worker, args=(i, dsn, pacer, written, mutations, seeds[i]), daemon=True)
+            for i in range(WORKERS)
+        ]
+
+        def status(now: float) -> str:
+            return f"target={RATE_PER_SEC:g}/s lag={pacer.lag(now):.3f}s restarts={pacer.restarts}"
+
+    # Not one of the workers: the probe is optional, so its exit is reported, not fatal.
+    probe = None
+    if CDC_PROBE_INTERVAL > 0:
+        probe = mp.Process(target=run_cdc_probe, args=(dsn, seeds[-1]), daemon=True, name="cdc-probe")
+        probe.start()
+    for w in workers:
+        w.start()
+
+    # Once a second: rows actually committed vs the target, and how far behind the
+    # shared schedule is. Lag above zero means the workers cannot sustain the rate.
+    last_rows, last_at = 0, time.monotonic()
+    while True:
+        time.sleep(1.0)
+        for w in workers:
+            if not w.is_alive():
+                raise SystemExit(f"[loadgen] worker {w.name} exited with code {w.exitcode}")
+        if probe is not None and not probe.is_alive():
+            logger.warning(f"[loadgen] cdc probe exited with code {probe.exitcode}; CDC lag is no longer measured")
+            probe = None
+        now = time.monotonic()
+        rows = written.value
+        mutated = (
+            f" updated={mutations.updated.value} deleted={mutations.deleted.value}" if mutations.enabled else ""
+        )
+        logger.info(
+            f"[loadgen] inserted {rows - last_rows} trips: rate={(rows - last_rows) / (now - last_at):.1f}/s "
+            f"{status(now)} total={rows}{mutated}"
+        )
+        last_rows, last_at = rows, now
 
 
 if __name__ == "__main__":
-    random.seed()
-    main()
+    if sys.argv[1:2] == ["bench"]:
+        bench_generation(batch_size=int(sys.argv[2]) if len(sys.argv) > 2 else 10_000)
+    elif LOADGEN_DRIVER == "asyncpg":
+        import pg_trip_writer_async
+
+        pg_trip_writer_async.main()
+    else:
+        main()
 
@@ -0,0 +1,127 @@
+"""asyncio/asyncpg variant of pg_trip_writer (LOADGEN_DRIVER=asyncpg).
+
+One process, WORKERS connections, each with its own writer task, so up to WORKERS
+batches are in flight at once and throughput scales with connections instead of
+being bound by one round trip at a time. Batches come from the same make_batch
+generator and the same monotonic Pacer as the psycopg writer, and the per-second
+log line has the same shape, so the two drivers can be compared run for run.
+
+INSERT_MODE=copy uses copy_records_to_table (binary COPY); anything else uses
+executemany on a statement asyncpg prepares once per connection and pipelines.
+Replay, mutations and the CDC probe stay with the psycopg driver.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import asyncpg
+import numpy as np
+
+from pg_trip_writer import (
+    BATCH_SIZE,
+    CDC_PROBE_INTERVAL,
+    COLUMNS,
+    DELETE_RATIO,
+    INSERT_MODE,
+    LOADGEN_SEED,
+    MAX_LAG_SECONDS,
+    PGDATABASE,
+    PGHOST,
+    PGPASSWORD,
+    PGPORT,
+    PGUSER,
+    RATE_PER_SEC,
+    REPLAY_FILE,
+    UPDATE_RATIO,
+    WORKERS,
+    Pacer,
+    logger,
+    make_batch,
+    prepare_database,
+)
+
+# asyncpg takes $n placeholders, not psycopg's %s.
+INSERT_SQL = "INSERT INTO realtime_trips ({}) VALUES ({})".format(
+    ", ".join(COLUMNS), ", ".join(f"${i}" for i in range(1, len(COLUMNS) + 1))
+)
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.rows = 0
+
+
+async def write_batches(
+    conn: asyncpg.Connection, pacer: Pacer, rng: np.random.Generator, written: Counter
+) -> None:
+    """Insert batches on the slots the pacer hands out, one in flight on this connection."""
+    insert = await conn.prepare(INSERT_SQL)
+    while True:
+        # claim() never awaits, so the writer tasks cannot interleave inside it.
+        await asyncio.sleep(pacer.claim(time.monotonic()))
+        rows = make_batch(rng, datetime.now(timezone.utc), BATCH_SIZE)
+        if INSERT_MODE == "copy":
+            await conn.copy_records_to_table("realtime_trips", records=rows, columns=COLUMNS)
+        else:
+            await insert.executemany(rows)
+        written.rows += len(rows)
+
+
+async def report(pacer: Pacer, written: Counter) -> None:
+    last_rows, last_at = 0, time.monotonic()
+    while True:
+        await asyncio.sleep(1.0)
+        now = time.monotonic()
+        rows = written.rows
+        logger.info(
+            f"[loadgen] inserted {rows - last_rows} trips: rate={(rows - last_rows) / (now - last_at):.1f}/s "
+            f"target={RATE_PER_SEC:g}/s lag={pacer.lag(now):.3f}s restarts={pacer.restarts} total={rows}"
+        )
+        last_rows, last_at = rows, now
+
+
+async def run() -> None:
+    connections = [
+        await asyncpg.connect(host=PGHOST, port=PGPORT, database=PGDATABASE, user=PGUSER, password=PGPASSWORD)
+        for _ in range(WORKERS)
+    ]
+    pacer = Pacer(max(0.001, RATE_PER_SEC) / BATCH_SIZE, MAX_LAG_SECONDS)
+    written = Counter()
+    seeds = np.random.SeedSequence(None if LOADGEN_SEED is None else int(LOADGEN_SEED)).spawn(WORKERS)
+    try:
+        # gather() without return_exceptions: the first failing connection ends the
+        # run, the same as a dead worker process ends the psycopg driver.
+        await asyncio.gather(
+            report(pacer, written),
+            *(
+                write_batches(conn, pacer, np.random.default_rng(seed), written)
+                for conn, seed in zip(connections, seeds)
+            ),
+        )
+    finally:
+        await asyncio.gather(*(conn.close() for conn in connections), return_exceptions=True)
+
+
+def main() -> None:
+    if INSERT_MODE not in ("executemany", "copy"):
+        raise SystemExit(f"[loadgen] the asyncpg driver supports INSERT_MODE executemany or copy; got {INSERT_MODE!r}")
+    if WORKERS < 1:
+        raise SystemExit(f"[loadgen] WORKERS must be >= 1; got {WORKERS}")
+    if REPLAY_FILE or UPDATE_RATIO or DELETE_RATIO or CDC_PROBE_INTERVAL > 0:
+        raise SystemExit(
+            "[loadgen] REPLAY_FILE, UPDATE_RATIO/DELETE_RATIO and CDC_PROBE_INTERVAL need LOADGEN_DRIVER=psycopg"
+        )
+    logger.info(
+        f"[loadgen] connecting: {PGHOST}:{PGPORT} db={PGDATABASE} user={PGUSER} "
+        f"driver=asyncpg mode={INSERT_MODE} connections={WORKERS}"
+    )
+    # Table and publication setup is one-off, so it reuses the psycopg path.
+    prepare_database(f"host={PGHOST} port={PGPORT} dbname={PGDATABASE} user={PGUSER} password={PGPASSWORD}")
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Offline unit tests for pg_trip_writer.run_cdc_probe.
+
+Postgres and ClickHouse are fakes and time.sleep ends the loop, so what is checked is
+the property that matters: the probe is a measurement, and a failure on either side is
+counted and retried rather than ending the process that shares the load generator.
+"""
+
+from __future__ import annotations
+
+import logging
+
+import numpy as np
+import pytest
+
+import pg_trip_writer
+
+
+class _Stop(Exception):
+    pass
+
+
+class _Cursor:
+    def __init__(self, inserted: list[tuple]) -> None:
+        self.inserted = inserted
+
+    def __enter__(self) -> "_Cursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, sql: str, trip: tuple) -> None:
+        self.inserted.append(trip)
+
+    def fetchone(self) -> tuple:
+        return (len(self.inserted),)
+
+
+class _Conn:
+    def __init__(self, inserted: list[tuple]) -> None:
+        self.inserted = inserted
+
+    def cursor(self) -> _Cursor:
+        return _Cursor(self.inserted)
+
+    def close(self) -> None:
+        pass
+
+
+class _ClickHouse:
+    """Finds every marker Postgres has committed, as a caught-up pipe would."""
+
+    def __init__(self, inserted: list[tuple]) -> None:
+        self.inserted = inserted
+
+    def query(self, sql: str, parameters: dict):
+        rows = [(int(t[0].timestamp()), t[2], t[3], t[6]) for t in self.inserted]
+        return type("QueryResult", (), {"result_rows": rows})()
+
+
+def test_a_clickhouse_failure_is_counted_and_retried_not_fatal(monkeypatch, caplog) -> None:
+    inserted: list[tuple] = []
+    connects = []
+
+    def get_client():
+        connects.append(1)
+        if len(connects) == 1:
+            raise OSError("Code: 516. Authentication failed")
+        return _ClickHouse(inserted)
+
+    sleeps = []
+
+    def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+        if len(sleeps) == 2:
+            raise _Stop
+
+    monkeypatch.setattr(pg_trip_writer.psycopg, "connect", lambda *a, **k: _Conn(inserted))
+    monkeypatch.setattr(pg_trip_writer, "_cdc_client", get_client)
+    monkeypatch.setattr(pg_trip_writer.time, "sleep", sleep)
+    monkeypatch.setattr(pg_trip_writer, "CDC_PROBE_INTERVAL", 3600.0)
+    monkeypatch.setattr(pg_trip_writer, "CDC_PROBE_WINDOW", 0.0)
+
+    with caplog.at_level(logging.INFO, logger="loadgen"), pytest.raises(_Stop):
+        pg_trip_writer.run_cdc_probe("dbname=x", np.random.SeedSequence(1))
+
+    reports = [r.getMessage() for r in caplog.records if "cdc lag:" in r.getMessage()]
+    assert "Authentication failed" in caplog.text
+    # First poll: the marker is committed but the lookup fails. Second: a fresh client finds it.
+    assert "seen=0" in reports[0] and "pending=1" in reports[0] and "errors=1" in reports[0]
+    assert "seen=1" in reports[1] and "pending=0" in reports[1] and "errors=0" in reports[1]
+    assert len(inserted) == 1
@@ -0,0 +1,53 @@
+"""Offline unit tests for pg_trip_writer.load_trips.
+
+No database: load_trips only reads a file, and the replay's rows are whatever it
+returns, so a value it misreads is a value every dashboard shows.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+
+from pg_trip_writer import load_trips
+
+SAMPLE = Path(__file__).resolve().parents[2] / "db" / "sample" / "trips.csv"
+
+
+def write_trips(tmp_path: Path, rows: list[str]) -> str:
+    path = tmp_path / "trips.csv"
+    path.write_text(
+        "pickup_datetime,dropoff_datetime,vendor_id,passenger_count,trip_distance,"
+        "pickup_zone_id,dropoff_zone_id,payment_type,fare_amount,tip_amount\n" + "\n".join(rows) + "\n"
+    )
+    return str(path)
+
+
+def test_the_sample_file_loads_sorted_by_pickup() -> None:
+    trips = load_trips(str(SAMPLE))
+
+    assert len(trips["pickup"]) > 0
+    assert np.all(np.diff(trips["pickup"]) >= 0)
+    assert set(trips["car_type"]) == {"yellow"}
+    np.testing.assert_allclose(trips["total_amount"], trips["fare_amount"] + trips["tip_amount"])
+
+
+def test_blank_fields_default_to_one_for_counts_and_zero_for_money(tmp_path) -> None:
+    path = write_trips(
+        tmp_path,
+        [
+            "2026-01-02 20:03:00,2026-01-02 20:12:40,2,,,107,79,,12.0,",
+            "2026-01-02 20:01:00,2026-01-02 20:13:10,1,3,2.1,161,234,1,,2.5",
+        ],
+    )
+
+    trips = load_trips(path)
+
+    # Sorted by pickup, so the row with the blanks is second.
+    assert trips["passenger_count"].tolist() == [3, 1]
+    assert trips["payment_type"].tolist() == [1, 1]
+    assert trips["trip_distance"].tolist() == [2.1, 0.0]
+    assert trips["fare_amount"].tolist() == [0.0, 12.0]
+    assert trips["tip_amount"].tolist() == [2.5, 0.0]
+    assert trips["total_amount"].tolist() == [2.5, 12.0]
@@ -0,0 +1,73 @@
+"""Offline unit tests for pg_trip_writer.Pacer.
+
+claim() takes the time as an argument, so a test plays a worker by handing it the
+monotonic clock it would have read: the returned wait is what the worker sleeps, and
+the clock only moves as far as the test moves it.
+"""
+
+from __future__ import annotations
+
+import pytest
+
+from pg_trip_writer import Pacer
+
+
+def test_slots_are_spaced_one_interval_apart() -> None:
+    pacer = Pacer(batches_per_sec=4.0, max_lag_seconds=5.0)
+
+    # A worker claiming every slot the moment the last one was handed out waits one
+    # interval longer each time: the slots are on the schedule, not after the claim.
+    assert [pacer.claim(100.0) for _ in range(4)] == [0.0, 0.25, 0.5, 0.75]
+    assert pacer.lag(100.0) == 0.0
+
+
+def test_insert_time_comes_out_of_the_wait_not_the_rate() -> None:
+    pacer = Pacer(batches_per_sec=10.0, max_lag_seconds=5.0)
+    now = 0.0
+    starts = []
+    for _ in range(5):
+        now += pacer.claim(now)
+        starts.append(now)
+        now += 0.06  # the insert
+
+    assert starts == pytest.approx([0.0, 0.1, 0.2, 0.3, 0.4])
+
+
+def test_a_slow_stretch_is_caught_up_within_the_lag_bound() -> None:
+    pacer = Pacer(batches_per_sec=4.0, max_lag_seconds=5.0)
+    pacer.claim(0.0)
+
+    # Postgres stalls for 2 s: the schedule is 1.75 s behind, and the missed slots are
+    # handed out back to back until it is level again.
+    assert pacer.lag(2.0) == 1.75
+    assert [pacer.claim(2.0) for _ in range(8)] == [0.0] * 8
+    assert pacer.claim(2.0) == 0.25
+    assert pacer.lag(2.0) == 0.0
+    assert pacer.restarts == 0
+
+
+def test_a_schedule_beyond_max_lag_restarts_from_now() -> None:
+    pacer = Pacer(batches_per_sec=10.0, max_lag_seconds=5.0)
+    pacer.claim(0.0)
+
+    # 30 s behind: instead of bursting 300 batches, start over and count it.
+    assert pacer.claim(30.0) == 0.0
+    assert pacer.restarts == 1
+    assert pacer.claim(30.0) == pytest.approx(0.1)
+    assert pacer.lag(30.0) == 0.0
+
+    pacer.claim(60.0)
+    assert pacer.restarts == 2
+
+
+def test_exactly_max_lag_behind_is_still_caught_up() -> None:
+    pacer = Pacer(batches_per_sec=4.0, max_lag_seconds=5.0)
+    pacer.claim(0.0)
+
+    assert pacer.claim(5.25) == 0.0  # the slot at 0.25 s is 5.0 s behind
+    assert pacer.restarts == 0
+    assert pacer.lag(5.25) == 4.75
+
+
+def test_lag_is_zero_before_the_first_claim() -> None:
+    assert Pacer(batches_per_sec=1.0, max_lag_seconds=5.0).lag(1_000.0) == 0.0
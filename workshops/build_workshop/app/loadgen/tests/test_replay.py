@@ -0,0 +1,110 @@
+"""Offline unit tests for pg_trip_writer.Replay.
+
+No database and no sleeping: due() and lag() take the monotonic time as an argument,
+so a test can walk the clock forward and see exactly which trips come out when. The
+file here is four trips ten seconds apart, short enough that the time-of-day start for
+day-long files does not apply and source time starts at the first pickup.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from pg_trip_writer import Replay
+
+STARTED_AT = 1_800_000_000.0
+PICKUPS = [1_000, 1_010, 1_020, 1_030]  # one loop of the file is 40 s: 30 s of trips plus a typical gap
+
+
+def trips() -> dict[str, np.ndarray]:
+    n = len(PICKUPS)
+    pickup = np.asarray(PICKUPS, dtype=np.int64)
+    return {
+        "pickup": pickup,
+        "dropoff": pickup + 300,
+        "pickup_zone": np.arange(n) + 1,  # tells the trips apart in the emitted rows
+        "dropoff_zone": np.full(n, 79),
+        "passenger_count": np.ones(n, dtype=np.int64),
+        "trip_distance": np.full(n, 1.5),
+        "fare_amount": np.full(n, 10.0),
+        "tip_amount": np.full(n, 2.0),
+        "total_amount": np.full(n, 12.0),
+        "payment_type": np.ones(n, dtype=np.int64),
+        "vendor_id": np.full(n, 2),
+        "car_type": np.full(n, "yellow", dtype=object),
+    }
+
+
+def replay(speed: float = 1.0, shard: int = 0, shards: int = 1) -> Replay:
+    return Replay(trips(), speed, shard, shards, started_at=STARTED_AT, started_mono=0.0)
+
+
+def walk(r: Replay, until: float, step: float = 1.0, limit: int = 100) -> list[tuple[float, int]]:
+    """(seconds after start, pickup zone) for every trip due up to `until`."""
+    out = []
+    now = 0.0
+    while now <= until:
+        rows, _ = r.due(now, limit)
+        out.extend((row[0].timestamp() - STARTED_AT, row[2]) for row in rows)
+        now += step
+    return out
+
+
+def test_the_file_loops_without_doubling_or_skipping_a_trip() -> None:
+    emitted = walk(replay(), until=125.0)
+
+    # Three loops and a bit: every trip once per loop, each ten seconds after the last,
+    # including across the wrap from the last trip back to the first.
+    assert [at for at, _ in emitted] == [10.0 * i for i in range(13)]
+    assert [zone for _, zone in emitted] == [1, 2, 3, 4] * 3 + [1]
+
+
+def test_durations_are_kept_as_recorded() -> None:
+    (row,), _ = replay().due(0.0, 10)
+
+    assert (row[1] - row[0]).total_seconds() == 300
+
+
+def test_limit_holds_back_due_trips_and_says_there_is_no_wait() -> None:
+    r = replay()
+
+    rows, wait = r.due(25.0, 2)
+    assert [row[2] for row in rows] == [1, 2]
+    assert wait == 0.0  # the third trip was due at 20 s and is still waiting
+    assert r.lag(25.0) == 5.0
+
+    rows, wait = r.due(25.0, 2)
+    assert [row[2] for row in rows] == [3]
+    assert wait == 5.0  # the fourth trip is due at 30 s
+    assert r.lag(25.0) == 0.0
+
+
+def test_the_wait_reaches_across_the_wrap() -> None:
+    r = replay()
+    rows, wait = r.due(31.0, 10)
+
+    assert len(rows) == 4
+    assert wait == 9.0  # the first trip comes round again at 40 s
+
+
+def test_speed_compresses_source_time_onto_the_wall_clock() -> None:
+    r = replay(speed=2.0)
+
+    rows, wait = r.due(10.0, 10)  # 20 source seconds in
+
+    assert [row[0].timestamp() - STARTED_AT for row in rows] == [0.0, 5.0, 10.0]
+    assert wait == 5.0  # 10 source seconds to the fourth trip is 5 wall seconds
+    assert r.lag(12.0) == 0.0
+    assert r.lag(16.0) == 1.0  # 32 source seconds in, 2 past the fourth trip
+    assert [at for at, _ in walk(replay(speed=2.0), until=40.0)] == [5.0 * i for i in range(9)]
+
+
+@pytest.mark.parametrize("shards", [2, 3])
+def test_shards_split_the_trips_without_overlap(shards: int) -> None:
+    per_shard = [walk(replay(shard=shard, shards=shards), until=125.0) for shard in range(shards)]
+
+    together = sorted(trip for emitted in per_shard for trip in emitted)
+    assert together == walk(replay(), until=125.0)
+    assert len(set(together)) == len(together)
+    assert all(emitted for emitted in per_shard)
@@ -0,0 +1,128 @@
+"""Fixed-memory, mergeable latency histogram, shared by writer.py and bench/run.py.
+
+Both used to keep every latency in a list and sort it to read a percentile. At a high
+`--rate` over a long window that is memory that grows with the run and an O(n log n) sort
+inside the same event loop that is issuing the transactions being measured -- the
+measurement competing with the workload. A histogram records in O(1), reads in time
+proportional to its (fixed) bucket count, and two of them merge by adding counts, so a
+window, a query or a whole run all cost the same few kilobytes.
+
+Buckets grow geometrically from LOWEST_MS to HIGHEST_MS, so the error is relative rather
+than absolute: a 2 ms commit and a 2 s dashboard query are both reported to within
+RELATIVE_ERROR. Every histogram uses the same layout, which is what makes merging an
+element-wise add with no rebinning.
+
+`percentile` keeps the nearest-rank rule writer.py and bench/run.py document: it finds the
+bucket holding the sample a sorted list would have returned, and reports that bucket's
+midpoint clamped to the exact min and max seen. So the answer is within RELATIVE_ERROR of
+the latency the list-based rule gives, and exact whenever that rank is the smallest or
+largest sample -- a window of one sample, or a p95 over twenty or fewer. Values outside
+[LOWEST_MS, HIGHEST_MS] are clamped into the end buckets; min and max stay exact.
+
+No third-party dependency on purpose: this is imported by the offline unit tests of both
+the writer and the harness, which must run with nothing but pytest installed.
+"""
+
+from __future__ import annotations
+
+import math
+
+LOWEST_MS = 0.001  # 1 microsecond; anything faster is below what either clock resolves
+HIGHEST_MS = 3_600_000.0  # one hour; anything slower has already failed the benchmark
+RELATIVE_ERROR = 0.01
+
+# A bucket [low, low * GROWTH) reported at its geometric midpoint low * sqrt(GROWTH) is
+# off by at most sqrt(GROWTH) - 1 for any value inside it, hence the square.
+GROWTH = (1.0 + RELATIVE_ERROR) ** 2
+_LOG_GROWTH = math.log(GROWTH)
+BUCKETS = int(math.ceil(math.log(HIGHEST_MS / LOWEST_MS) / _LOG_GROWTH)) + 1
+
+
+def bucket_index(value_ms: float) -> int:
+    if value_ms <= LOWEST_MS:
+        return 0
+    return min(BUCKETS - 1, int(math.log(value_ms / LOWEST_MS) / _LOG_GROWTH))
+
+
+def bucket_midpoint(index: int) -> float:
+    return LOWEST_MS * GROWTH ** (index + 0.5)
+
+
+class LatencyHistogram:
+    """Counts of latencies (in milliseconds) per log-spaced bucket, plus exact count/min/max."""
+
+    __slots__ = ("counts", "count", "min", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value_ms: float) -> None:
+        self.counts[bucket_index(value_ms)] += 1
+        self.count += 1
+        if value_ms < self.min:
+            self.min = value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Add `other`'s samples into this one. Exact: same layout, so counts just add."""
+        if not other.count:
+            return
+        counts = self.counts
+        for index, n in enumerate(other.counts):
+            if n:
+                counts[index] += n
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction: float) -> float:
+        """Nearest-rank percentile, within RELATIVE_ERROR. 0.0 for an empty histogram."""
+        if not self.count:
+            return 0.0
+        # The same index the list-based rule takes: int(n * fraction), clamped to the top.
+        rank = min(self.count - 1, int(self.count * fraction))
+        # The ends are known exactly, so a p95 over a small window (where it is the
+        # largest sample) reports the real latency rather than a bucket midpoint.
+        if rank == self.count - 1:
+            return self.max
+        if rank == 0:
+            return self.min
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen > rank:
+                return min(self.max, max(self.min, bucket_midpoint(index)))
+        return self.max
+
+    def to_dict(self) -> dict:
+        """JSON-safe form: only the non-empty buckets, so an idle window is a few bytes."""
+        return {
+            "counts": {str(index): n for index, n in enumerate(self.counts) if n},
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, payload: dict) -> "LatencyHistogram":
+        h = cls()
+        for index, n in payload.get("counts", {}).items():
+            h.counts[int(index)] += int(n)
+            h.count += int(n)
+        if h.count:
+            h.min = float(payload["min"])
+            h.max = float(payload["max"])
+        return h
+
+    def summary(self) -> dict[str, float | int]:
+        """p50/p95/p99/max in milliseconds, rounded the way both reports print them."""
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(0.50), 1),
+            "p95_ms": round(self.percentile(0.95), 1),
+            "p99_ms": round(self.percentile(0.99), 1),
+            "max_ms": round(self.max, 1) if self.count else 0.0,
+        }
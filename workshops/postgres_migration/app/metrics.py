@@ -0,0 +1,122 @@
+"""Binary interval samples from writer.py to bench/run.py, for `--metrics-socket`.
+
+The stdout contract is a JSON line per window with one p95 in it: enough for a 10 s
+median, too coarse to see a one-second stall, and every line is an encode on the writer's
+event loop and a parse on the harness's thread. Over a Unix datagram socket the writer
+instead sends each window as fixed-layout records -- window number, TPS, counts, and the
+window's whole latency histogram, non-empty buckets only -- so the harness can afford a
+one-second window and can merge an exact p95 over any span of them.
+
+A datagram socket rather than a shared-memory ring: the kernel keeps message boundaries, so
+a record arrives whole or not at all and there is no framing, no read cursor and no torn
+write to guard against, and a histogram's size varies with how spread the latencies were,
+which a ring of fixed slots would have to pad to the worst case. The writer sends without
+blocking; a record the harness is too slow to take is dropped and counted, never waited
+for, which is the property the stdout pipe needs a dedicated reader thread to get.
+
+No datagram exceeds MAX_DATAGRAM_BYTES, the macOS default for Unix datagrams
+(net.local.dgram.maxdgram); Linux allows far more. A window whose histogram does not fit
+is split into `parts` records that each repeat the header and carry a slice of the
+buckets, and Reassembler joins them. Merging adjacent buckets to fit would have been
+smaller, but would give up the exact p95 this channel exists for.
+
+Layout, little-endian: the HEADER fields, then `buckets` (index, count) pairs. The magic
+carries the version, so a harness and a writer from different commits fail loudly.
+"""
+
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+
+from histogram import BUCKETS, LatencyHistogram
+
+MAGIC = b"WRM2"
+# magic, window, part, parts, tps, committed, failed, latency min, latency max, buckets here
+HEADER = struct.Struct("<4sIBBdIIddH")
+BUCKET = struct.Struct("<HI")
+MAX_DATAGRAM_BYTES = 2048
+BUCKETS_PER_DATAGRAM = (MAX_DATAGRAM_BYTES - HEADER.size) // BUCKET.size
+
+
+@dataclass(frozen=True)
+class Record:
+    """One window, or one part of it; a whole window has part 0 of 1."""
+
+    window: int
+    part: int
+    parts: int
+    tps: float
+    committed: int
+    failed: int
+    latencies: LatencyHistogram
+
+
+def encode_sample(window: int, tps: float, committed: int, failed: int, latencies: LatencyHistogram) -> list[bytes]:
+    """One window as datagram payloads, each at most MAX_DATAGRAM_BYTES; usually just one."""
+    buckets = [(index, n) for index, n in enumerate(latencies.counts) if n]
+    slices = [buckets[i : i + BUCKETS_PER_DATAGRAM] for i in range(0, len(buckets), BUCKETS_PER_DATAGRAM)] or [[]]
+    low, high = (latencies.min, latencies.max) if latencies.count else (0.0, 0.0)
+    payloads = []
+    for part, chunk in enumerate(slices):
+        fields = [HEADER.pack(MAGIC, window, part, len(slices), tps, committed, failed, low, high, len(chunk))]
+        fields.extend(BUCKET.pack(index, n) for index, n in chunk)
+        payloads.append(b"".join(fields))
+    return payloads
+
+
+def decode_sample(data: bytes) -> Record:
+    """The Record in one of `encode_sample`'s payloads.
+
+    ValueError for anything else -- a short read, another version, a bucket out of range --
+    so the harness counts it as malformed, as it does a bad stdout line.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError(f"metrics sample of {len(data)} bytes is shorter than its header")
+    magic, window, part, parts, tps, committed, failed, low, high, buckets = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"metrics sample has magic {magic!r}, expected {MAGIC!r}")
+    if not part < parts:
+        raise ValueError(f"metrics sample is part {part} of {parts}")
+    if len(data) != HEADER.size + buckets * BUCKET.size:
+        raise ValueError(f"metrics sample is {len(data)} bytes; its header says {buckets} buckets")
+    latencies = LatencyHistogram()
+    for index, n in BUCKET.iter_unpack(data[HEADER.size :]):
+        if index >= BUCKETS:
+            raise ValueError(f"metrics sample has bucket {index} of {BUCKETS}")
+        latencies.counts[index] += n
+        latencies.count += n
+    if latencies.count:
+        latencies.min, latencies.max = low, high
+    return Record(window, part, parts, tps, committed, failed, latencies)
+
+
+class Reassembler:
+    """Joins a split window's parts back into one Record.
+
+    Parts of one window are sent back to back, so once a later window completes, an
+    earlier one still missing a part lost it to a drop; it is discarded and counted in
+    `incomplete` rather than held forever.
+    """
+
+    def __init__(self) -> None:
+        self.partial: dict[int, tuple[Record, set[int]]] = {}
+        self.incomplete = 0
+
+    def add(self, record: Record) -> Record | None:
+        """The whole window once its last part is in, else None."""
+        if record.parts > 1:
+            held, seen = self.partial.pop(record.window, (None, set()))
+            if held is None:
+                held = Record(record.window, 0, 1, record.tps, record.committed, record.failed, LatencyHistogram())
+            if record.part not in seen:
+                seen.add(record.part)
+                held.latencies.merge(record.latencies)
+            if len(seen) < record.parts:
+                self.partial[record.window] = (held, seen)
+                return None
+            record = held
+        for window in [w for w in self.partial if w < record.window]:
+            del self.partial[window]
+            self.incomplete += 1
+        return record
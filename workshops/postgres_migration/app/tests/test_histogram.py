@@ -0,0 +1,106 @@
+"""Offline unit tests for histogram.py.
+
+The histogram replaces sorted lists in both writer.py and bench/run.py, so the
+property that matters is that it answers what the list did: the nearest-rank
+sample, to within RELATIVE_ERROR. Each test checks against writer.percentile on the
+same samples rather than against hand-computed numbers, so the two rules cannot
+drift apart without a failure here.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+
+import pytest
+
+import histogram
+from histogram import RELATIVE_ERROR, LatencyHistogram
+from writer import percentile
+
+
+def recorded(values: list[float]) -> LatencyHistogram:
+    h = LatencyHistogram()
+    for value in values:
+        h.record(value)
+    return h
+
+
+def test_empty_histogram_reads_zero_like_an_empty_list() -> None:
+    h = LatencyHistogram()
+
+    assert h.count == 0
+    assert h.percentile(0.95) == 0.0 == percentile([], 0.95)
+    assert h.summary() == {"count": 0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+
+@pytest.mark.parametrize("fraction", [0.0, 0.25, 0.5, 0.9, 0.95, 0.99, 0.999, 1.0])
+def test_percentile_is_nearest_rank_within_the_relative_error(fraction: float) -> None:
+    # Log-normal latencies spanning four orders of magnitude: the shape a loaded
+    # database actually produces, and the case an absolute-error histogram gets wrong.
+    rng = random.Random(7)
+    values = [rng.lognormvariate(2.0, 1.5) for _ in range(5000)]
+
+    exact = percentile(values, fraction)
+
+    assert recorded(values).percentile(fraction) == pytest.approx(exact, rel=RELATIVE_ERROR)
+
+
+def test_smallest_and_largest_ranks_are_exact() -> None:
+    # A p95 over twenty or fewer samples is the largest one; a report of 19.9 ms for
+    # a 20 ms commit would be within tolerance and still look wrong in a table.
+    values = [10.0, 20.0]
+    h = recorded(values)
+
+    assert h.percentile(0.95) == 20.0 == percentile(values, 0.95)
+    assert h.percentile(0.0) == 10.0
+    assert recorded([3.3]).percentile(0.5) == 3.3
+
+
+def test_merge_equals_recording_everything_in_one() -> None:
+    rng = random.Random(11)
+    left = [rng.uniform(1, 50) for _ in range(300)]
+    right = [rng.uniform(20, 900) for _ in range(200)]
+    merged = recorded(left)
+
+    merged.merge(recorded(right))
+    together = recorded(left + right)
+
+    assert merged.counts == together.counts
+    assert (merged.count, merged.min, merged.max) == (together.count, together.min, together.max)
+
+
+def test_merging_an_empty_histogram_changes_nothing() -> None:
+    h = recorded([5.0, 6.0])
+
+    h.merge(LatencyHistogram())
+
+    assert (h.count, h.min, h.max) == (2, 5.0, 6.0)
+
+
+def test_memory_does_not_grow_with_samples() -> None:
+    h = LatencyHistogram()
+    for n in range(100_000):
+        h.record(1.0 + n % 1000)
+
+    assert len(h.counts) == histogram.BUCKETS
+    assert h.count == 100_000
+
+
+def test_out_of_range_values_are_clamped_but_min_and_max_stay_exact() -> None:
+    h = recorded([0.0, 1e-6, 10 * histogram.HIGHEST_MS])
+
+    assert h.counts[0] == 2
+    assert h.counts[-1] == 1
+    assert (h.min, h.max) == (0.0, 10 * histogram.HIGHEST_MS)
+
+
+def test_dict_round_trip_is_lossless_and_json_safe() -> None:
+    # This is how a --processes child hands its window to the parent, over a pipe.
+    h = recorded([0.5, 2.0, 2.0, 750.0])
+
+    back = LatencyHistogram.from_dict(json.loads(json.dumps(h.to_dict())))
+
+    assert back.counts == h.counts
+    assert (back.count, back.min, back.max) == (4, 0.5, 750.0)
+    assert LatencyHistogram.from_dict(LatencyHistogram().to_dict()).count == 0
@@ -0,0 +1,112 @@
+"""Offline unit tests for metrics.py.
+
+The records are the only thing the writer and the harness share over --metrics-socket,
+so what matters is that a histogram survives the trip bucket for bucket however wide it
+is, that no datagram outgrows what macOS will carry, and that anything that is not a
+record from this version is refused rather than misread.
+"""
+
+from __future__ import annotations
+
+import random
+
+import pytest
+
+import metrics
+from histogram import LatencyHistogram
+from metrics import BUCKET, HEADER, MAX_DATAGRAM_BYTES, Reassembler, decode_sample, encode_sample
+
+
+def recorded(values: list[float]) -> LatencyHistogram:
+    h = LatencyHistogram()
+    for value in values:
+        h.record(value)
+    return h
+
+
+def wide() -> LatencyHistogram:
+    """Latencies from 0.1 ms to 100 s: far more non-empty buckets than one datagram holds."""
+    rng = random.Random(5)
+    return recorded([10 ** rng.uniform(-1, 5) for _ in range(20_000)])
+
+
+def test_a_window_survives_the_round_trip() -> None:
+    h = recorded([0.4, 3.0, 3.1, 45.0, 2_500.0])
+
+    (payload,) = encode_sample(7, 99.5, 5, 2, h)
+    record = decode_sample(payload)
+
+    assert (record.window, record.part, record.parts) == (7, 0, 1)
+    assert (record.tps, record.committed, record.failed) == (99.5, 5, 2)
+    assert record.latencies.counts == h.counts
+    assert (record.latencies.count, record.latencies.min, record.latencies.max) == (5, 0.4, 2_500.0)
+
+
+def test_only_non_empty_buckets_are_sent() -> None:
+    (payload,) = encode_sample(1, 3.0, 3, 0, recorded([5.0, 5.0, 900.0]))
+
+    assert len(payload) == HEADER.size + 2 * BUCKET.size
+
+
+def test_an_idle_window_is_just_the_header() -> None:
+    (payload,) = encode_sample(3, 0.0, 0, 4, LatencyHistogram())
+
+    assert len(payload) == HEADER.size
+    record = decode_sample(payload)
+    assert (record.committed, record.failed, record.latencies.count) == (0, 4, 0)
+    assert record.latencies.percentile(0.95) == 0.0
+
+
+def test_a_wide_spread_is_split_under_the_macos_datagram_limit_and_rejoined() -> None:
+    h = wide()
+    assert sum(1 for n in h.counts if n) > metrics.BUCKETS_PER_DATAGRAM
+
+    payloads = encode_sample(4, 200.0, h.count, 0, h)
+    reassembler = Reassembler()
+    joined = [reassembler.add(decode_sample(payload)) for payload in payloads]
+
+    assert len(payloads) > 1
+    assert all(len(payload) <= MAX_DATAGRAM_BYTES for payload in payloads)
+    assert joined[:-1] == [None] * (len(payloads) - 1)
+    whole = joined[-1]
+    assert (whole.window, whole.parts, whole.tps, whole.committed) == (4, 1, 200.0, h.count)
+    assert whole.latencies.counts == h.counts
+    assert whole.latencies.percentile(0.95) == h.percentile(0.95)
+
+
+def test_the_fullest_histogram_still_fits() -> None:
+    h = LatencyHistogram()
+    for index in range(len(h.counts)):
+        h.counts[index] = 1
+    h.count, h.min, h.max = len(h.counts), 0.1, 1e6
+
+    assert max(len(payload) for payload in encode_sample(1, 1.0, h.count, 0, h)) <= MAX_DATAGRAM_BYTES
+
+
+def test_a_window_missing_a_part_is_given_up_when_a_later_one_completes() -> None:
+    h = wide()
+    reassembler = Reassembler()
+    first = encode_sample(1, 1.0, h.count, 0, h)
+    for payload in first[:-1]:  # the last part was dropped
+        assert reassembler.add(decode_sample(payload)) is None
+
+    (second,) = encode_sample(2, 1.0, 1, 0, recorded([1.0]))
+
+    assert reassembler.add(decode_sample(second)).window == 2
+    assert reassembler.incomplete == 1
+    assert reassembler.partial == {}
+
+
+@pytest.mark.parametrize(
+    "data, message",
+    [
+        (b"WRM2", "shorter than its header"),
+        (HEADER.pack(b"WRM1", 1, 0, 1, 0.0, 0, 0, 0.0, 0.0, 0), "magic"),
+        (HEADER.pack(metrics.MAGIC, 1, 2, 2, 0.0, 0, 0, 0.0, 0.0, 0), "part 2 of 2"),
+        (HEADER.pack(metrics.MAGIC, 1, 0, 1, 0.0, 1, 0, 1.0, 1.0, 2) + BUCKET.pack(3, 1), "says 2 buckets"),
+        (HEADER.pack(metrics.MAGIC, 1, 0, 1, 0.0, 1, 0, 1.0, 1.0, 1) + BUCKET.pack(65_000, 1), "bucket 65000"),
+    ],
+)
+def test_anything_else_is_a_value_error(data: bytes, message: str) -> None:
+    with pytest.raises(ValueError, match=message):
+        decode_sample(data)
@@ -14,15 +14,30 @@ realism, the assertions go through pytest.approx.
 from __future__ import annotations
 
 import asyncio
+import errno
 import json
+import socket
 import time
 
 import pytest
 
 import writer
+from metrics import decode_sample
 from writer import Pacer, Stats, parse_args, percentile, sleep_or_stop
 
 
+def window(stats: Stats) -> tuple[int, int, int, float | None, float | None]:
+    """take_window() as plain values: (committed, failed, samples, min, max).
+
+    The latencies come back as a histogram, whose min and max are exact, so for the
+    one- and two-sample windows below this pins down every latency recorded.
+    """
+    committed, failed, latencies = stats.take_window()
+    if not latencies.count:
+        return committed, failed, 0, None, None
+    return committed, failed, latencies.count, latencies.min, latencies.max
+
+
 # --------------------------------------------------------------------------
 # percentile
 # --------------------------------------------------------------------------
@@ -218,7 +233,7 @@ def test_pacer_never_returns_a_negative_delay() -> None:
 
 
 def test_take_window_of_an_untouched_stats_is_empty() -> None:
-    assert Stats().take_window() == (0, 0, [])
+    assert window(Stats()) == (0, 0, 0, None, None)
 
 
 def test_consecutive_windows_report_disjoint_counts() -> None:
@@ -227,16 +242,16 @@ def test_consecutive_windows_report_disjoint_counts() -> None:
     stats.record_commit(2.0)
     stats.record_failure()
 
-    first = stats.take_window()
+    first = window(stats)
 
     stats.record_commit(3.0)
     stats.record_failure()
     stats.record_failure()
 
-    second = stats.take_window()
+    second = window(stats)
 
-    assert first == (2, 1, [1.0, 2.0])
-    assert second == (1, 2, [3.0])
+    assert first == (2, 1, 2, 1.0, 2.0)
+    assert second == (1, 2, 1, 3.0, 3.0)
 
 
 def test_a_commit_between_windows_is_credited_to_the_second() -> None:
@@ -248,19 +263,19 @@ def test_a_commit_between_windows_is_credited_to_the_second() -> None:
 
     stats.record_commit(7.5)
 
-    assert stats.take_window() == (1, 0, [7.5])
+    assert window(stats) == (1, 0, 1, 7.5, 7.5)
 
 
 def test_an_empty_window_between_two_busy_ones_loses_nothing() -> None:
     stats = Stats()
     stats.record_commit(1.0)
 
-    assert stats.take_window() == (1, 0, [1.0])
-    assert stats.take_window() == (0, 0, [])
+    assert window(stats) == (1, 0, 1, 1.0, 1.0)
+    assert window(stats) == (0, 0, 0, None, None)
 
     stats.record_commit(2.0)
 
-    assert stats.take_window() == (1, 0, [2.0])
+    assert window(stats) == (1, 0, 1, 2.0, 2.0)
     assert stats.committed == 2
 
 
@@ -270,16 +285,16 @@ def test_latencies_are_drained_per_window() -> None:
 
     drained = stats.take_window()[2]
 
-    # The reporter keeps the returned list while workers keep recording; the two
-    # must not be the same object, or the next window's samples would land in a
-    # list that has already been percentiled.
+    # The reporter keeps the returned histogram while workers keep recording; the
+    # two must not be the same object, or the next window's samples would land in
+    # a histogram that has already been percentiled.
     assert drained is not stats.latencies
-    assert stats.latencies == []
+    assert stats.latencies.count == 0
 
     stats.record_commit(2.0)
 
-    assert drained == [1.0]
-    assert stats.latencies == [2.0]
+    assert (drained.count, drained.max) == (1, 1.0)
+    assert (stats.latencies.count, stats.latencies.max) == (1, 2.0)
 
 
 def test_failures_are_counted_separately_from_commits() -> None:
@@ -292,7 +307,7 @@ def test_failures_are_counted_separately_from_commits() -> None:
     assert (committed, failed) == (0, 2)
     # A failed order has no latency sample: the transaction did not complete, so
     # timing it would drag p95 towards whatever the error path costs.
-    assert latencies == []
+    assert latencies.count == 0
 
 
 def test_lifetime_counters_survive_windowing() -> None:
@@ -407,7 +422,7 @@ def test_report_stops_without_printing_a_partial_window(monkeypatch, capsys) ->
 
     assert capsys.readouterr().out == ""
     # Nothing was consumed, so the final line still sees the sample.
-    assert stats.take_window() == (1, 0, [5.0])
+    assert window(stats) == (1, 0, 1, 5.0, 5.0)
 
 
 # --------------------------------------------------------------------------
@@ -453,3 +468,266 @@ def test_parse_args_rejects_non_positive_tuning(flag: str, value: str) -> None:
     # report-seconds 0 a reporter that never yields.
     with pytest.raises(SystemExit):
         parse_args(["--dsn", "postgres://x/y", flag, value])
+
+
+@pytest.mark.parametrize("value", ["per-row", "executemany", "unnest"])
+def test_parse_args_accepts_every_items_mode(value: str) -> None:
+    assert parse_args(["--dsn", "postgres://x/y", "--items", value]).items == value
+
+
+def test_parse_args_items_defaults_to_one_statement_per_row() -> None:
+    # The published numbers were all measured per-row; changing the default would
+    # silently make new runs incomparable with them.
+    assert parse_args(["--dsn", "postgres://x/y"]).items == "per-row"
+    with pytest.raises(SystemExit):
+        parse_args(["--dsn", "postgres://x/y", "--items", "copy"])
+
+
+# --------------------------------------------------------------------------
+# insert_items: same rows, different round trips
+# --------------------------------------------------------------------------
+
+
+class RecordingConnection:
+    """Records every statement sent, so a test can count round trips per order."""
+
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, str, tuple]] = []
+
+    async def execute(self, sql: str, *params) -> None:
+        self.calls.append(("execute", sql, params))
+
+    async def executemany(self, sql: str, rows) -> None:
+        self.calls.append(("executemany", sql, tuple(rows)))
+
+
+ITEMS = [(11, 2, 19.5), (12, 1, 4.25), (13, 5, 100.0)]
+
+
+def test_per_row_items_send_one_statement_each() -> None:
+    conn = RecordingConnection()
+
+    asyncio.run(writer.insert_items(conn, 7, ITEMS, "per-row"))
+
+    assert [kind for kind, _, _ in conn.calls] == ["execute"] * 3
+    assert [params for _, _, params in conn.calls] == [(7, *item) for item in ITEMS]
+
+
+def test_executemany_items_are_one_call_with_every_row() -> None:
+    conn = RecordingConnection()
+
+    asyncio.run(writer.insert_items(conn, 7, ITEMS, "executemany"))
+
+    assert conn.calls == [("executemany", writer.INSERT_ITEM, tuple((7, *item) for item in ITEMS))]
+
+
+def test_unnest_items_are_one_statement_of_parallel_arrays() -> None:
+    # The arrays must stay index-aligned: unnest zips them back into rows, so a
+    # reordering here would attach quantities to the wrong products.
+    conn = RecordingConnection()
+
+    asyncio.run(writer.insert_items(conn, 7, ITEMS, "unnest"))
+
+    assert conn.calls == [
+        ("execute", writer.INSERT_ITEMS_UNNEST, (7, [11, 12, 13], [2, 1, 5], [19.5, 4.25, 100.0]))
+    ]
+
+
+# --------------------------------------------------------------------------
+# --processes: sharding the load and merging the children's lines
+# --------------------------------------------------------------------------
+
+
+def test_shard_splits_evenly_and_loses_nothing() -> None:
+    assert writer.shard(200, 3) == [67, 67, 66]
+    assert writer.shard(16, 4) == [4, 4, 4, 4]
+    assert sum(writer.shard(7, 5)) == 7
+
+
+def test_parse_args_processes_defaults_to_one() -> None:
+    args = parse_args(["--dsn", "postgres://x/y"])
+
+    assert (args.processes, args.child) == (1, False)
+
+
+def test_parse_args_rejects_more_processes_than_rate_or_connections() -> None:
+    # A child with a zero share of --rate would divide by zero in its Pacer, and one
+    # with a zero share of --concurrency would have an empty pool.
+    with pytest.raises(SystemExit):
+        parse_args(["--dsn", "postgres://x/y", "--rate", "2", "--processes", "3"])
+    with pytest.raises(SystemExit):
+        parse_args(["--dsn", "postgres://x/y", "--concurrency", "2", "--processes", "3"])
+
+
+def child_line(window: int, latencies: list[float], committed: int, tps: float) -> dict:
+    h = writer.LatencyHistogram()
+    for value in latencies:
+        h.record(value)
+    return {"committed": committed, "failed": 0, "tps": tps, "p95_ms": 0.0, "window": window, "hist": h.to_dict()}
+
+
+def test_merged_line_waits_for_every_child_and_keeps_the_contract() -> None:
+    merger = writer.WindowMerger(2)
+
+    assert merger.feed(0, child_line(1, [5.0], 1, 0.1)) is None
+    line = merger.feed(1, child_line(1, [50.0, 60.0], 2, 0.2))
+
+    # Exactly the keys the single-process writer prints, so bench/run.py cannot tell.
+    assert set(line) == {"committed", "failed", "tps", "p95_ms"}
+    assert (line["committed"], line["failed"], line["tps"]) == (3, 0, 0.3)
+    # p95 over all three samples, not an average of per-child p95s.
+    assert line["p95_ms"] == 60.0
+
+
+def test_a_fast_child_does_not_split_a_slow_childs_window() -> None:
+    merger = writer.WindowMerger(2)
+
+    assert merger.feed(0, child_line(1, [1.0], 1, 0.1)) is None
+    assert merger.feed(0, child_line(2, [1.0], 1, 0.1)) is None
+    assert merger.feed(1, child_line(1, [1.0], 1, 0.1))["committed"] == 2
+    assert merger.feed(1, child_line(2, [1.0], 1, 0.1))["committed"] == 2
+
+
+def test_final_line_sums_lifetimes_and_covers_unprinted_windows() -> None:
+    merger = writer.WindowMerger(2)
+    # Child 0 reached window 1 before the stop; child 1 did not. That window was never
+    # printed, so its latency has to land in the final line's p95.
+    merger.feed(0, child_line(1, [80.0], 1, 0.1))
+    tail = writer.LatencyHistogram()
+    tail.record(3.0)
+    merger.feed(0, {"final": True, "committed": 4, "failed": 1, "p95_ms": 3.0, "hist": tail.to_dict()})
+    merger.feed(1, {"final": True, "committed": 5, "failed": 0, "p95_ms": 0.0, "hist": writer.LatencyHistogram().to_dict()})
+
+    final = merger.final(12.34)
+
+    assert final == {"final": True, "committed": 9, "failed": 1, "p95_ms": 80.0, "elapsed_seconds": 12.3}
+    assert "tps" not in final
+
+
+def test_child_interval_lines_carry_the_window_and_histogram(monkeypatch, capsys) -> None:
+    stats = Stats()
+    stats.record_commit(4.0)
+    calls = []
+
+    async def one_window(stopping: asyncio.Event, delay: float) -> bool:
+        calls.append(delay)
+        return len(calls) > 1
+
+    monkeypatch.setattr(writer, "sleep_or_stop", one_window)
+
+    asyncio.run(writer.report(stats, asyncio.Event(), 10, child=True))
+
+    line = json.loads(capsys.readouterr().out)
+    assert line["window"] == 1
+    assert writer.LatencyHistogram.from_dict(line["hist"]).max == 4.0
+
+
+# --------------------------------------------------------------------------
+# --metrics-socket: binary records instead of interval lines
+# --------------------------------------------------------------------------
+
+
+def test_report_sends_each_window_over_the_channel_and_prints_nothing(monkeypatch, capsys) -> None:
+    stats = Stats()
+    stats.record_commit(7.0)
+    calls = []
+
+    async def one_window(stopping: asyncio.Event, delay: float) -> bool:
+        calls.append(delay)
+        return len(calls) > 1
+
+    monkeypatch.setattr(writer, "sleep_or_stop", one_window)
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    channel = writer.MetricsChannel(ours)
+    try:
+        asyncio.run(writer.report(stats, asyncio.Event(), 1, channel=channel))
+        record = decode_sample(theirs.recv(65_536))
+    finally:
+        channel.close()
+        theirs.close()
+
+    assert capsys.readouterr().out == ""
+    assert (record.window, record.committed, record.failed) == (1, 1, 0)
+    assert record.latencies.max == 7.0
+    assert (channel.sent, channel.dropped) == (1, 0)
+
+
+class MacSocket:
+    """A Unix datagram socket with macOS's default 2048-byte limit."""
+
+    def __init__(self) -> None:
+        self.sent: list[bytes] = []
+
+    def setblocking(self, flag: bool) -> None:
+        assert flag is False
+
+    def send(self, payload: bytes) -> int:
+        if len(payload) > 2048:
+            raise OSError(errno.EMSGSIZE, "Message too long")
+        self.sent.append(payload)
+        return len(payload)
+
+
+def test_a_wide_latency_spread_fits_the_macos_datagram_limit() -> None:
+    stats = Stats()
+    for i in range(5_000):
+        stats.record_commit(0.1 * 1.003**i)  # 0.1 ms to ~300 s, one bucket after another
+    committed, failed, latencies = stats.take_window()
+    sock = MacSocket()
+    channel = writer.MetricsChannel(sock)
+
+    channel.send_window(1, 100.0, committed, failed, latencies)
+
+    assert len(sock.sent) > 1
+    assert (channel.failed, channel.dropped) == (0, 0)
+    merged = writer.LatencyHistogram()
+    for payload in sock.sent:
+        merged.merge(decode_sample(payload).latencies)
+    assert merged.counts == latencies.counts
+
+
+def test_a_send_that_would_block_is_dropped_not_waited_for() -> None:
+    class FullSocket:
+        def setblocking(self, flag: bool) -> None:
+            assert flag is False
+
+        def send(self, payload: bytes) -> int:
+            raise BlockingIOError(errno.EAGAIN, "Resource temporarily unavailable")
+
+    channel = writer.MetricsChannel(FullSocket())
+    channel.send(b"record")
+
+    assert (channel.sent, channel.dropped, channel.failed) == (0, 1, 0)
+    assert channel.final_fields() == {"metrics_dropped": 1, "metrics_failed": 0}
+
+
+def test_an_oversized_record_is_a_failure_not_a_slow_harness(capsys) -> None:
+    channel = writer.MetricsChannel(MacSocket())
+
+    channel.send(b"x" * 4096)
+    channel.send(b"x" * 4096)
+
+    assert (channel.dropped, channel.failed) == (0, 2)
+    assert "Message too long" in channel.final_fields()["metrics_error"]
+    # Said once on stderr, not once per window.
+    assert capsys.readouterr().err.count("cannot send a metrics record") == 1
+
+
+def test_parse_args_metrics_socket_is_for_the_parent_only() -> None:
+    base = ["--dsn", "postgres://x/y"]
+
+    assert parse_args(base).metrics_socket is None
+    assert parse_args([*base, "--metrics-socket", "/tmp/m.sock"]).metrics_socket == "/tmp/m.sock"
+    with pytest.raises(SystemExit):
+        parse_args([*base, "--child", "--metrics-socket", "/tmp/m.sock"])
+
+
+def test_merged_window_keeps_its_number_and_histogram() -> None:
+    merger = writer.WindowMerger(2)
+
+    assert merger.feed_window(0, child_line(1, [5.0], 1, 0.1)) is None
+    window_number, line, latencies = merger.feed_window(1, child_line(1, [50.0], 1, 0.1))
+
+    assert window_number == 1
+    assert line["committed"] == 2
+    assert (latencies.count, latencies.max) == (2, 50.0)
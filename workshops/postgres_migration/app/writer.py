@@ -9,7 +9,9 @@ database cannot keep up, TPS falls, which is the entire point of the measurement
 Every order is one transaction -- one `orders` row, then one to four `order_items`
 rows. That shape is what makes writer TPS a meaningful contention measurement: a
 single-row insert would rarely wait on the dashboard's scans, and a bulk COPY would
-not resemble a checkout path at all.
+not resemble a checkout path at all. `--items` only changes how the item rows travel
+(one statement each, one pipelined executemany, or one unnest INSERT), never what
+the transaction writes, so it isolates round-trip cost from the contention signal.
 
 Output contract, relied on by `bench/run.py`:
   - interval lines: {"committed": N, "failed": N, "tps": F, "p95_ms": F}, flushed
@@ -21,6 +23,21 @@ Output contract, relied on by `bench/run.py`:
     line that reported them. It deliberately carries no "tps" key, because the harness
     treats every line that has one as a throughput sample to be taken into a median.
 Anything that is not part of that contract goes to stderr.
+
+`--metrics-socket PATH` moves the interval lines off stdout: each window goes instead as one
+binary record (metrics.py) to the Unix datagram socket the harness bound at PATH, histogram
+included, and stdout carries only the final line. The harness uses it with a one-second
+`--report-seconds` for a per-second TPS series and an exact p95 over its window. Sends
+never block; the final line gains "metrics_dropped", the records the harness did not take
+in time, and "metrics_failed" (with "metrics_error"), the records the socket refused.
+
+`--processes N` exists because one asyncio loop in one process tops out at a core's worth of
+JSON, random and asyncpg decoding, and past that writer TPS plateaus for reasons that have
+nothing to do with the database. It runs N copies of this script as children, each with a
+share of `--rate` and `--concurrency`, and turns their lines back into the contract above:
+the k-th interval line is printed once every child has reported its k-th window, with counts
+and TPS summed and p95 read from the children's merged latency histograms; the final line
+sums the children's lifetime counts. The harness cannot tell one process from several.
 """
 
 from __future__ import annotations
@@ -29,9 +46,15 @@ import argparse
 import asyncio
 import json
 import random
+import errno
 import signal
+import socket
 import sys
 import time
+from pathlib import Path
+
+from histogram import LatencyHistogram
+from metrics import encode_sample
 
 INSERT_ORDER = """
 INSERT INTO orders (customer_id, status, placed_at, updated_at)
@@ -44,32 +67,51 @@ INSERT INTO order_items (order_id, product_id, quantity, line_total, placed_at)
 VALUES ($1, $2, $3, $4, now())
 """
 
+# All of an order's items in one statement: three parallel arrays, one row per index.
+INSERT_ITEMS_UNNEST = """
+INSERT INTO order_items (order_id, product_id, quantity, line_total, placed_at)
+SELECT $1, product_id, quantity, line_total, now()
+FROM unnest($2::bigint[], $3::int[], $4::numeric[]) AS item(product_id, quantity, line_total)
+"""
+
+# How the item rows reach the server. asyncpg prepares and caches every statement per
+# connection whichever is chosen, so the modes differ only in round trips per order:
+#   per-row     -- one execute per item, up to four round trips (the default, and what
+#                  every published number was measured with)
+#   executemany -- one executemany of INSERT_ITEM, pipelined into a single round trip
+#   unnest      -- one INSERT ... SELECT FROM unnest(...), a single statement
+ITEM_MODES = ("per-row", "executemany", "unnest")
+
 
 class Stats:
-    """Lifetime counters plus the latency samples of the window in progress.
+    """Lifetime counters plus the latency histogram of the window in progress.
 
     Exactly one instance lives for the whole run and is never replaced. The reporter
-    takes a window out of it by differencing the totals and draining the latency
-    list. Replacing the object instead would silently drop every order that was
+    takes a window out of it by differencing the totals and swapping in a fresh
+    histogram. Replacing the object instead would silently drop every order that was
     in flight at report time: those coroutines hold a reference to the old object,
     so their increments would land on something nobody ever prints.
+
+    Latencies go into a fixed-size histogram rather than a list, so a long window at
+    a high `--rate` costs neither growing memory nor a sort inside the event loop
+    that is running the orders being timed.
     """
 
     def __init__(self) -> None:
         self.committed = 0
         self.failed = 0
-        self.latencies: list[float] = []
+        self.latencies = LatencyHistogram()
         self._reported_committed = 0
         self._reported_failed = 0
 
     def record_commit(self, latency_ms: float) -> None:
         self.committed += 1
-        self.latencies.append(latency_ms)
+        self.latencies.record(latency_ms)
 
     def record_failure(self) -> None:
         self.failed += 1
 
-    def take_window(self) -> tuple[int, int, list[float]]:
+    def take_window(self) -> tuple[int, int, LatencyHistogram]:
         """Return (committed, failed, latencies) since the previous call.
 
         Safe without a lock: there is no await between reading the counters and
@@ -78,7 +120,7 @@ class Stats:
         rather than lost.
         """
         latencies = self.latencies
-        self.latencies = []
+        self.latencies = LatencyHistogram()
         window = (
             self.committed - self._reported_committed,
             self.failed - self._reported_failed,
@@ -123,6 +165,7 @@ class Pacer:
 
 
 def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of a list: the rule LatencyHistogram.percentile follows."""
     if not values:
         return 0.0
     ordered = sorted(values)
@@ -141,21 +184,36 @@ async def sleep_or_stop(stopping: asyncio.Event, delay: float) -> bool:
     return True
 
 
-async def place_order(pool, max_customer: int, max_product: int, stats: Stats, errors: list[str]) -> None:
+async def insert_items(conn, order_id: int, items: list[tuple[int, int, float]], mode: str) -> None:
+    if mode == "unnest":
+        products, quantities, totals = (list(column) for column in zip(*items))
+        await conn.execute(INSERT_ITEMS_UNNEST, order_id, products, quantities, totals)
+    elif mode == "executemany":
+        await conn.executemany(INSERT_ITEM, [(order_id, *item) for item in items])
+    else:
+        for item in items:
+            await conn.execute(INSERT_ITEM, order_id, *item)
+
+
+async def place_order(
+    pool,
+    max_customer: int,
+    max_product: int,
+    stats: Stats,
+    errors: list[str],
+    items_mode: str = "per-row",
+) -> None:
     """One order, one transaction: the `orders` row plus its one to four items."""
     started = time.perf_counter()
     try:
         async with pool.acquire() as conn:
             async with conn.transaction():
                 order_id = await conn.fetchval(INSERT_ORDER, random.randint(1, max_customer))
-                for _ in range(random.randint(1, 4)):
-                    await conn.execute(
-                        INSERT_ITEM,
-                        order_id,
-                        random.randint(1, max_product),
-                        random.randint(1, 5),
-                        round(random.uniform(1, 500), 2),
-                    )
+                items = [
+                    (random.randint(1, max_product), random.randint(1, 5), round(random.uniform(1, 500), 2))
+                    for _ in range(random.randint(1, 4))
+                ]
+                await insert_items(conn, order_id, items, items_mode)
     except Exception as exc:  # a failed order is data, not a crash: it is what "failed" counts
         stats.record_failure()
         if not errors:
@@ -175,34 +233,176 @@ async def worker(
     max_customer: int,
     max_product: int,
     errors: list[str],
+    items_mode: str = "per-row",
 ) -> None:
     """One long-lived worker. `--concurrency` of these bound the in-flight orders."""
     while not stopping.is_set():
         if await sleep_or_stop(stopping, pacer.claim(time.perf_counter())):
             return
-        await place_order(pool, max_customer, max_product, stats, errors)
+        await place_order(pool, max_customer, max_product, stats, errors, items_mode)
 
 
-async def report(stats: Stats, stopping: asyncio.Event, report_seconds: int) -> None:
+class MetricsChannel:
+    """The writer's end of `--metrics-socket`: nonblocking sends, drops counted, never waited on.
+
+    A full socket buffer means the harness is not keeping up; waiting for it would stall the
+    event loop that is running the transactions being measured, so the record is dropped.
+    Any other error -- a record too large for the platform, a harness that has gone away --
+    is a send that will not succeed by waiting either, and is counted apart as `failed`
+    with its message, so it is not reported as a slow harness. Either way the run goes on
+    to its final line.
+    """
+
+    BUFFER_FULL = frozenset({errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS})
+
+    def __init__(self, sock: socket.socket) -> None:
+        sock.setblocking(False)
+        self.sock = sock
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.error: str | None = None
+
+    @classmethod
+    def connect(cls, path: str) -> "MetricsChannel":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            raise
+        return cls(sock)
+
+    def send(self, payload: bytes) -> None:
+        try:
+            self.sock.send(payload)
+            self.sent += 1
+        except OSError as exc:
+            if exc.errno in self.BUFFER_FULL:
+                self.dropped += 1
+                return
+            if not self.failed:
+                print(f"writer: cannot send a metrics record: {exc}", file=sys.stderr)
+            self.failed += 1
+            self.error = f"{type(exc).__name__}: {exc}"
+
+    def send_window(self, window: int, tps: float, committed: int, failed: int, latencies: LatencyHistogram) -> None:
+        for payload in encode_sample(window, tps, committed, failed, latencies):
+            self.send(payload)
+
+    def final_fields(self) -> dict:
+        """The final line's account of this channel."""
+        fields = {"metrics_dropped": self.dropped, "metrics_failed": self.failed}
+        if self.error is not None:
+            fields["metrics_error"] = self.error
+        return fields
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+async def report(
+    stats: Stats,
+    stopping: asyncio.Event,
+    report_seconds: int,
+    child: bool = False,
+    channel: MetricsChannel | None = None,
+) -> None:
     window_started = time.perf_counter()
+    window = 0
     while not stopping.is_set():
         if await sleep_or_stop(stopping, report_seconds):
             return
         now = time.perf_counter()
         elapsed = now - window_started
         window_started = now
+        window += 1
         committed, failed, latencies = stats.take_window()
-        print(
-            json.dumps(
-                {
-                    "committed": committed,
-                    "failed": failed,
-                    "tps": round(committed / elapsed, 1) if elapsed > 0 else 0.0,
-                    "p95_ms": round(percentile(latencies, 0.95), 1),
-                }
-            ),
-            flush=True,
-        )
+        tps = committed / elapsed if elapsed > 0 else 0.0
+        if channel is not None:
+            channel.send_window(window, tps, committed, failed, latencies)
+            continue
+        line = {
+            "committed": committed,
+            "failed": failed,
+            "tps": round(tps, 1),
+            "p95_ms": round(latencies.percentile(0.95), 1),
+        }
+        if child:
+            # Only ever read by a --processes parent, which needs the window number to
+            # line children up and the histogram to merge an honest p95 across them.
+            line.update({"window": window, "hist": latencies.to_dict()})
+        print(json.dumps(line), flush=True)
+
+
+def shard(total: int, parts: int) -> list[int]:
+    """Split `total` into `parts` integers that differ by at most one and sum to it."""
+    return [total // parts + (1 if index < total % parts else 0) for index in range(parts)]
+
+
+class WindowMerger:
+    """Joins the children's interval lines into lines of the single-process contract.
+
+    Children start within milliseconds of each other and report on the same interval,
+    so their k-th windows cover the same stretch of time; the k-th merged line waits
+    for all of them rather than printing on a timer of its own, which could split one
+    child's window across two printed ones. TPS is the sum of the children's TPS, and
+    p95 comes from their merged histograms -- averaging their p95s would not be one.
+    """
+
+    def __init__(self, children: int) -> None:
+        self.children = children
+        self.pending: dict[int, dict[int, dict]] = {}
+        self.finals: dict[int, dict] = {}
+
+    def feed(self, child: int, payload: dict) -> dict | None:
+        """Take one line from `child`; return a merged interval line once one is complete."""
+        merged = self.feed_window(child, payload)
+        return None if merged is None else merged[1]
+
+    def feed_window(self, child: int, payload: dict) -> tuple[int, dict, LatencyHistogram] | None:
+        """`feed`, also returning the window number and merged histogram, for --metrics-socket."""
+        if payload.get("final"):
+            self.finals[child] = payload
+            return None
+        window = int(payload["window"])
+        lines = self.pending.setdefault(window, {})
+        lines[child] = payload
+        if len(lines) < self.children:
+            return None
+        del self.pending[window]
+        latencies = self._merged(line.get("hist") for line in lines.values())
+        line = {
+            "committed": sum(line["committed"] for line in lines.values()),
+            "failed": sum(line["failed"] for line in lines.values()),
+            "tps": round(sum(line["tps"] for line in lines.values()), 1),
+            "p95_ms": round(latencies.percentile(0.95), 1),
+        }
+        return window, line, latencies
+
+    def final(self, elapsed_seconds: float) -> dict:
+        """The final line: lifetime sums, and a p95 over everything not yet printed.
+
+        That is each child's own tail window plus any window only some children reached
+        before the stop signal, which was never printed as an interval line.
+        """
+        unprinted = [line.get("hist") for lines in self.pending.values() for line in lines.values()]
+        tails = [final.get("hist") for final in self.finals.values()]
+        return {
+            "final": True,
+            "committed": sum(final["committed"] for final in self.finals.values()),
+            "failed": sum(final["failed"] for final in self.finals.values()),
+            "p95_ms": round(self._merged(unprinted + tails).percentile(0.95), 1),
+            "elapsed_seconds": round(elapsed_seconds, 1),
+        }
+
+    @staticmethod
+    def _merged(payloads) -> LatencyHistogram:
+        merged = LatencyHistogram()
+        for payload in payloads:
+            if payload:
+                merged.merge(LatencyHistogram.from_dict(payload))
+        return merged
 
 
 def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
@@ -217,13 +417,52 @@ def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser.add_argument(
         "--report-seconds", type=int, default=10, help="seconds between JSON lines (default: 10)"
     )
+    parser.add_argument(
+        "--items",
+        choices=ITEM_MODES,
+        default="per-row",
+        help="how each order's item rows are sent (default: per-row)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="child processes sharing --rate and --concurrency (default: 1, no children)",
+    )
+    parser.add_argument(
+        "--metrics-socket",
+        help=(
+            "send each interval as a binary record to this Unix datagram socket instead of "
+            "a JSON line on stdout (stdout keeps the final line)"
+        ),
+    )
+    # Set by a --processes parent on its children: adds what the parent needs to merge.
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
     args = parser.parse_args(argv)
-    for name in ("rate", "concurrency", "report_seconds"):
+    for name in ("rate", "concurrency", "report_seconds", "processes"):
         if getattr(args, name) < 1:
             parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    if args.processes > min(args.rate, args.concurrency):
+        # Every child needs at least one order per second and one connection.
+        parser.error("--processes cannot exceed --rate or --concurrency")
+    if args.metrics_socket and args.child:
+        parser.error("--metrics-socket is the parent's: children report to it on stdout")
+    if args.metrics_socket and not hasattr(socket, "AF_UNIX"):
+        parser.error("--metrics-socket needs Unix domain sockets (use WSL on Windows)")
     return args
 
 
+def open_channel(path: str | None) -> MetricsChannel | None:
+    """Connect to the harness's socket, or say why not on stderr and return None."""
+    if not path:
+        return None
+    try:
+        return MetricsChannel.connect(path)
+    except OSError as exc:
+        print(f"writer: cannot connect to --metrics-socket {path}: {exc}", file=sys.stderr)
+        return None
+
+
 def install_stop_handlers(stopping: asyncio.Event) -> None:
     loop = asyncio.get_running_loop()
     for sig in (signal.SIGINT, signal.SIGTERM):
@@ -245,6 +484,9 @@ async def run(args: argparse.Namespace) -> int:
         )
         return 2
 
+    channel = open_channel(args.metrics_socket)
+    if args.metrics_socket and channel is None:
+        return 2
     pool = await asyncpg.create_pool(args.dsn, min_size=args.concurrency, max_size=args.concurrency)
     try:
         max_customer = await pool.fetchval("SELECT max(customer_id) FROM customers")
@@ -264,10 +506,10 @@ async def run(args: argparse.Namespace) -> int:
         errors: list[str] = []
         started = time.perf_counter()
 
-        reporter = asyncio.create_task(report(stats, stopping, args.report_seconds))
+        reporter = asyncio.create_task(report(stats, stopping, args.report_seconds, args.child, channel))
         workers = [
             asyncio.create_task(
-                worker(pool, pacer, stats, stopping, max_customer, max_product, errors)
+                worker(pool, pacer, stats, stopping, max_customer, max_product, errors, args.items)
             )
             for _ in range(args.concurrency)
         ]
@@ -289,27 +531,109 @@ async def run(args: argparse.Namespace) -> int:
                 "the database fell more than a second behind --rate",
                 file=sys.stderr,
             )
-        print(
-            json.dumps(
-                {
-                    "final": True,
-                    "committed": stats.committed,
-                    "failed": stats.failed,
-                    "p95_ms": round(percentile(tail_latencies, 0.95), 1),
-                    "elapsed_seconds": round(time.perf_counter() - started, 1),
-                }
-            ),
-            flush=True,
-        )
+        final = {
+            "final": True,
+            "committed": stats.committed,
+            "failed": stats.failed,
+            "p95_ms": round(tail_latencies.percentile(0.95), 1),
+            "elapsed_seconds": round(time.perf_counter() - started, 1),
+        }
+        if args.child:
+            final["hist"] = tail_latencies.to_dict()
+        if channel is not None:
+            final.update(channel.final_fields())
+        print(json.dumps(final), flush=True)
         return 0
     finally:
         await pool.close()
+        if channel is not None:
+            channel.close()
+
+
+async def run_processes(args: argparse.Namespace) -> int:
+    """Run `--processes` children and print their merged lines as our own."""
+    channel = open_channel(args.metrics_socket)
+    if args.metrics_socket and channel is None:
+        return 2
+    stopping = asyncio.Event()
+    install_stop_handlers(stopping)
+    started = time.perf_counter()
+    children = [
+        await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "--dsn",
+            args.dsn,
+            "--rate",
+            str(rate),
+            "--concurrency",
+            str(concurrency),
+            "--report-seconds",
+            str(args.report_seconds),
+            "--items",
+            args.items,
+            "--child",
+            # stderr is inherited, so each child's first-failure message still reaches
+            # whoever is watching ours.
+            stdout=asyncio.subprocess.PIPE,
+        )
+        for rate, concurrency in zip(shard(args.rate, args.processes), shard(args.concurrency, args.processes))
+    ]
+    merger = WindowMerger(len(children))
+
+    async def pump(index: int, stream: asyncio.StreamReader) -> None:
+        async for raw in stream:
+            try:
+                payload = json.loads(raw)
+            except ValueError:
+                print(f"writer: child {index} printed a non-JSON line: {raw[:200]!r}", file=sys.stderr)
+                continue
+            merged = merger.feed_window(index, payload)
+            if merged is None:
+                continue
+            window, line, latencies = merged
+            if channel is not None:
+                channel.send_window(window, line["tps"], line["committed"], line["failed"], latencies)
+            else:
+                print(json.dumps(line), flush=True)
+
+    pumps = [asyncio.create_task(pump(index, child.stdout)) for index, child in enumerate(children)]
+    exits = [asyncio.create_task(child.wait()) for child in children]
+    stop = asyncio.create_task(stopping.wait())
+    await asyncio.wait([stop, *exits], return_when=asyncio.FIRST_COMPLETED)
+    stop.cancel()
+
+    early = [child.returncode for child in children if child.returncode is not None]
+    for child in children:
+        if child.returncode is None:
+            child.send_signal(signal.SIGTERM)
+    await asyncio.gather(*exits)
+    await asyncio.gather(*pumps)
+
+    if early:
+        # A child that exits unasked (no driver, empty seed tables, a crash) means the
+        # offered load is no longer --rate. Fail like the single-process writer would,
+        # with no final line, so the harness does not mistake it for a clean stop.
+        code = next((c for c in early if c), 1)
+        print(f"writer: a child process exited with code {code}; stopped the others", file=sys.stderr)
+        return code
+    if len(merger.finals) < len(children):
+        print(
+            f"writer: only {len(merger.finals)} of {len(children)} children printed a final line",
+            file=sys.stderr,
+        )
+    final = merger.final(time.perf_counter() - started)
+    if channel is not None:
+        final.update(channel.final_fields())
+        channel.close()
+    print(json.dumps(final), flush=True)
+    return 0
 
 
 def main() -> int:
     args = parse_args()
     try:
-        return asyncio.run(run(args))
+        return asyncio.run(run_processes(args) if args.processes > 1 else run(args))
     except KeyboardInterrupt:
         return 0
 
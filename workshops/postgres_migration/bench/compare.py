@@ -0,0 +1,397 @@
+"""Compares benchmark results files: `python3 run.py compare before.json after.json`.
+
+Two medians side by side are not a result. A p95 that moved from 180 ms to 40 ms over a
+few hundred runs is a finding, one that moved from 42 ms to 40 ms is noise, and the
+printed tables from run.py cannot tell the two apart. This puts a bootstrap confidence
+interval on every ratio and every delta, then derives the verdict from the intervals
+rather than from the point estimates.
+
+What is compared, per candidate file against the first (the baseline):
+
+  - per query: p50 and p95 speedup (baseline / candidate, so above 1 is faster), each
+    with a percentile-bootstrap interval
+  - writer TPS: candidate median minus baseline median, with an interval over the
+    writer's per-window TPS samples -- the headline number, with its error bar
+
+The config blocks must match, key for key. Two runs at different concurrency are two
+experiments, not a before and an after, and saying so is this tool's first job; keys
+that are meant to differ (`target` for an FDW-versus-direct run) are allowed by name with
+`--allow-config-diff`, and the allowance is printed with the result.
+
+Bootstrapping a percentile from a histogram: resampling n values from the empirical
+distribution and taking the k-th smallest is the same as drawing U from Beta(k, n+1-k)
+and reading the empirical quantile at U. Each replicate therefore costs one beta draw
+and a binary search over the non-empty buckets, not n draws, so a results file with a
+million runs compares as fast as one with a hundred. The seed is fixed: comparing the
+same files twice prints the same intervals.
+
+No third-party imports, for the same reason as run.py: it has to run on the laptop the
+results files were copied to.
+"""
+
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import random
+import statistics
+import sys
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+from histogram import LatencyHistogram, bucket_midpoint  # noqa: E402
+
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_SEED = 0
+CONFIDENCE = 0.95
+
+
+class CompareError(Exception):
+    """A results file that cannot be compared at all: unreadable, a sweep, or mismatched."""
+
+
+# ---------------------------------------------------------------------------
+# Bootstrap
+# ---------------------------------------------------------------------------
+
+
+class RankTable:
+    """A histogram's empirical quantile function, readable by rank in O(log buckets).
+
+    Reports exactly what LatencyHistogram.percentile does for the same rank -- the bucket
+    midpoint clamped to [min, max], exact at the two ends -- so a bootstrap centred on
+    this agrees with the p50/p95 printed in the results file.
+    """
+
+    def __init__(self, histogram: LatencyHistogram) -> None:
+        self.histogram = histogram
+        self.cumulative: list[int] = []
+        self.indexes: list[int] = []
+        seen = 0
+        for index, n in enumerate(histogram.counts):
+            if n:
+                seen += n
+                self.cumulative.append(seen)
+                self.indexes.append(index)
+
+    def at(self, rank: int) -> float:
+        h = self.histogram
+        if rank >= h.count - 1:
+            return h.max
+        if rank <= 0:
+            return h.min
+        index = self.indexes[bisect.bisect_right(self.cumulative, rank)]
+        return min(h.max, max(h.min, bucket_midpoint(index)))
+
+
+def bootstrap_percentile(
+    histogram: LatencyHistogram, fraction: float, rng: random.Random, resamples: int = BOOTSTRAP_RESAMPLES
+) -> list[float]:
+    """`resamples` bootstrap replicates of the nearest-rank percentile of `histogram`."""
+    n = histogram.count
+    if not n:
+        return []
+    table = RankTable(histogram)
+    # 1-based order statistic of the percentile the results file reports.
+    k = min(n - 1, int(n * fraction)) + 1
+    return [table.at(min(n - 1, int(rng.betavariate(k, n + 1 - k) * n))) for _ in range(resamples)]
+
+
+def bootstrap_median_delta(
+    base: list[float], candidate: list[float], rng: random.Random, resamples: int = BOOTSTRAP_RESAMPLES
+) -> list[float]:
+    """Replicates of median(candidate) - median(base), each series resampled independently."""
+    if not base or not candidate:
+        return []
+    return [
+        statistics.median(rng.choices(candidate, k=len(candidate)))
+        - statistics.median(rng.choices(base, k=len(base)))
+        for _ in range(resamples)
+    ]
+
+
+def interval(replicates: list[float], confidence: float = CONFIDENCE) -> list[float] | None:
+    """The percentile-bootstrap interval: the central `confidence` of the replicates."""
+    if not replicates:
+        return None
+    ordered = sorted(replicates)
+    tail = (1.0 - confidence) / 2.0
+    low = ordered[min(len(ordered) - 1, int(len(ordered) * tail))]
+    high = ordered[min(len(ordered) - 1, int(len(ordered) * (1.0 - tail)))]
+    return [low, high]
+
+
+# ---------------------------------------------------------------------------
+# Comparison
+# ---------------------------------------------------------------------------
+
+
+def load_result(path: Path) -> dict[str, Any]:
+    try:
+        result = json.loads(path.read_text())
+    except (OSError, ValueError) as exc:
+        raise CompareError(f"{path}: {type(exc).__name__}: {exc}") from None
+    if "curve" in result:
+        raise CompareError(f"{path} is a --sweep file; compare the single runs it was calibrated for")
+    if "queries" not in result or "config" not in result:
+        raise CompareError(f"{path} is not a run.py results file")
+    return result
+
+
+def config_differences(configs: list[dict[str, Any]]) -> dict[str, list[Any]]:
+    """Every config key whose value is not the same in all files, with each file's value."""
+    keys = sorted({key for config in configs for key in config})
+    return {
+        key: [config.get(key) for config in configs]
+        for key in keys
+        if any(config.get(key) != configs[0].get(key) for config in configs[1:])
+    }
+
+
+def ratio_interval(base: list[float], candidate: list[float]) -> list[float] | None:
+    if not base or not candidate:
+        return None
+    return interval([b / c for b, c in zip(base, candidate) if c > 0])
+
+
+def compare_query(base: dict[str, Any], candidate: dict[str, Any], rng: random.Random) -> dict[str, Any]:
+    """One query's speedups with intervals, and a verdict taken from the intervals.
+
+    "faster" and "slower" need the whole p95 (or, for slower, either) interval on one side
+    of 1.0. A query with no histogram -- a results file from before they were recorded --
+    still gets its point ratios, but no interval and so no significance claim.
+    """
+    row: dict[str, Any] = {"name": base["name"]}
+    if not base.get("runs") or not candidate.get("runs"):
+        row["verdict"] = "not comparable"
+        return row
+    base_h = LatencyHistogram.from_dict(base["histogram"]) if "histogram" in base else None
+    candidate_h = LatencyHistogram.from_dict(candidate["histogram"]) if "histogram" in candidate else None
+    for label, fraction in (("p50", 0.50), ("p95", 0.95)):
+        key = f"{label}_ms"
+        row[f"{label}_base_ms"] = base[key]
+        row[f"{label}_candidate_ms"] = candidate[key]
+        row[f"{label}_speedup"] = round(base[key] / candidate[key], 2) if candidate[key] else None
+        ci = None
+        if base_h is not None and candidate_h is not None:
+            ci = ratio_interval(
+                bootstrap_percentile(base_h, fraction, rng), bootstrap_percentile(candidate_h, fraction, rng)
+            )
+        row[f"{label}_speedup_ci"] = None if ci is None else [round(ci[0], 2), round(ci[1], 2)]
+    p50_ci, p95_ci = row["p50_speedup_ci"], row["p95_speedup_ci"]
+    if p50_ci is None or p95_ci is None:
+        row["verdict"] = "no interval"
+    elif p95_ci[1] < 1.0 or p50_ci[1] < 1.0:
+        row["verdict"] = "slower"
+    elif p95_ci[0] > 1.0:
+        row["verdict"] = "faster"
+    else:
+        row["verdict"] = "no significant change"
+    return row
+
+
+def compare_writer(base: dict[str, Any], candidate: dict[str, Any], rng: random.Random) -> dict[str, Any]:
+    base_writer = base.get("writer") or {}
+    candidate_writer = candidate.get("writer") or {}
+    base_tps, candidate_tps = base.get("writer_tps"), candidate.get("writer_tps")
+    block: dict[str, Any] = {"base_tps": base_tps, "candidate_tps": candidate_tps}
+    if base_tps is None or candidate_tps is None:
+        block["verdict"] = "not comparable"
+        return block
+    block["delta_tps"] = round(candidate_tps - base_tps, 1)
+    block["delta_pct"] = round(100.0 * (candidate_tps - base_tps) / base_tps, 1) if base_tps else None
+    ci = interval(
+        bootstrap_median_delta(base_writer.get("tps_series") or [], candidate_writer.get("tps_series") or [], rng)
+    )
+    block["delta_tps_ci"] = None if ci is None else [round(ci[0], 1), round(ci[1], 1)]
+    if ci is None:
+        block["verdict"] = "no interval"
+    elif ci[1] < 0:
+        block["verdict"] = "lower"
+    elif ci[0] > 0:
+        block["verdict"] = "higher"
+    else:
+        block["verdict"] = "no significant change"
+    return block
+
+
+def compare_pair(base: dict[str, Any], candidate: dict[str, Any], rng: random.Random) -> dict[str, Any]:
+    """Candidate against baseline, with the overall verdict.
+
+    The verdict is deliberately asymmetric. One slower panel, or a writer whose TPS fell,
+    is a REGRESSION however much else improved -- that is the claim a migration has to
+    survive. A query set that differs, or a run whose writer died, is NOT COMPARABLE
+    before any statistics are computed.
+    """
+    reasons: list[str] = []
+    base_names = [row["name"] for row in base["queries"]]
+    candidate_rows = {row["name"]: row for row in candidate["queries"]}
+    if base_names != [row["name"] for row in candidate["queries"]]:
+        reasons.append("the two files replayed different query sets")
+    for result in (base, candidate):
+        if result.get("queries_without_results"):
+            reasons.append(
+                f"{result['label']}: queries never returned: {', '.join(result['queries_without_results'])}"
+            )
+        if result.get("writer_died"):
+            reasons.append(f"{result['label']}: the writer died mid-run")
+
+    queries = [
+        compare_query(row, candidate_rows[row["name"]], rng)
+        for row in base["queries"]
+        if row["name"] in candidate_rows
+    ]
+    writer = compare_writer(base, candidate, rng)
+
+    verdicts = [row["verdict"] for row in queries]
+    if reasons:
+        verdict = "NOT COMPARABLE"
+    elif "slower" in verdicts or writer["verdict"] == "lower":
+        verdict = "REGRESSION"
+    elif "faster" in verdicts or writer["verdict"] == "higher":
+        verdict = "IMPROVEMENT"
+    else:
+        verdict = "NO SIGNIFICANT CHANGE"
+    return {
+        "base": base["label"],
+        "candidate": candidate["label"],
+        "queries": queries,
+        "writer": writer,
+        "verdict": verdict,
+        "reasons": reasons,
+    }
+
+
+def compare_results(
+    results: list[dict[str, Any]],
+    allowed_differences: list[str] | None = None,
+    seed: int = BOOTSTRAP_SEED,
+) -> dict[str, Any]:
+    """Every file after the first against the first. Raises CompareError on a config mismatch."""
+    if len(results) < 2:
+        raise CompareError("compare needs a baseline and at least one candidate")
+    allowed = set(allowed_differences or [])
+    differences = config_differences([result["config"] for result in results])
+    refused = {key: values for key, values in differences.items() if key not in allowed}
+    if refused:
+        lines = [
+            f"  {key}: {' vs '.join(json.dumps(value) for value in values)}" for key, values in refused.items()
+        ]
+        raise CompareError(
+            "config blocks differ, so these are different experiments:\n"
+            + "\n".join(lines)
+            + "\n(--allow-config-diff KEY if a difference is the point of the comparison)"
+        )
+    rng = random.Random(seed)
+    return {
+        "config": results[0]["config"],
+        "allowed_differences": {key: values for key, values in differences.items() if key in allowed},
+        "bootstrap": {"resamples": BOOTSTRAP_RESAMPLES, "confidence": CONFIDENCE, "seed": seed},
+        "comparisons": [compare_pair(results[0], candidate, rng) for candidate in results[1:]],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Output
+# ---------------------------------------------------------------------------
+
+
+def _ci(values: list[float] | None) -> str:
+    return "-" if values is None else f"{values[0]}-{values[1]}"
+
+
+def _value(value: Any) -> str:
+    return "-" if value is None else str(value)
+
+
+def render_markdown(report: dict[str, Any]) -> str:
+    lines: list[str] = []
+    confidence = int(report["bootstrap"]["confidence"] * 100)
+    for comparison in report["comparisons"]:
+        lines.append(f"## Benchmark comparison: {comparison['base']} -> {comparison['candidate']}")
+        lines.append("")
+        lines.append(f"Verdict: **{comparison['verdict']}**")
+        for reason in comparison["reasons"]:
+            lines.append(f"- {reason}")
+        lines.append("")
+        base, candidate = comparison["base"], comparison["candidate"]
+        lines.append(
+            f"| Query | p50 {base} | p50 {candidate} | p50 speedup ({confidence}% CI) "
+            f"| p95 {base} | p95 {candidate} | p95 speedup ({confidence}% CI) | verdict |"
+        )
+        lines.append("| --- " * 8 + "|")
+        for row in comparison["queries"]:
+            cells = [row["name"]]
+            for label in ("p50", "p95"):
+                cells += [
+                    _value(row.get(f"{label}_base_ms")),
+                    _value(row.get(f"{label}_candidate_ms")),
+                    f"{_value(row.get(f'{label}_speedup'))}x ({_ci(row.get(f'{label}_speedup_ci'))})",
+                ]
+            cells.append(row["verdict"])
+            lines.append("| " + " | ".join(cells) + " |")
+        writer = comparison["writer"]
+        lines.append("")
+        lines.append(f"| Writer TPS | {base} | {candidate} | delta ({confidence}% CI) | verdict |")
+        lines.append("| --- | --- | --- | --- | --- |")
+        delta = writer.get("delta_tps")
+        pct = writer.get("delta_pct")
+        lines.append(
+            f"| median | {_value(writer['base_tps'])} | {_value(writer['candidate_tps'])} | "
+            f"{_value(delta)}{'' if pct is None else f' ({pct:+}%)'} ({_ci(writer.get('delta_tps_ci'))}) "
+            f"| {writer['verdict']} |"
+        )
+        lines.append("")
+    if report["allowed_differences"]:
+        lines.append("Config differences allowed for this comparison:")
+        for key, values in report["allowed_differences"].items():
+            lines.append(f"- {key}: {' vs '.join(json.dumps(value) for value in values)}")
+    else:
+        lines.append("Config blocks: identical.")
+    bootstrap = report["bootstrap"]
+    lines.append(
+        f"Intervals: percentile bootstrap, {bootstrap['resamples']} resamples, seed {bootstrap['seed']}."
+    )
+    return "\n".join(lines)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="run.py compare",
+        description=(
+            "Compares run.py results files against the first one: per-query p50/p95 speedups "
+            "and writer TPS delta, each with a bootstrap confidence interval, and a verdict."
+        ),
+    )
+    parser.add_argument("baseline", type=Path, help="results file everything is compared against")
+    parser.add_argument("candidates", type=Path, nargs="+", help="one or more results files to compare")
+    parser.add_argument("--out", type=Path, help="also write the comparison as JSON here")
+    parser.add_argument(
+        "--allow-config-diff",
+        action="append",
+        default=[],
+        metavar="KEY",
+        help="config key allowed to differ between the files, e.g. target; repeatable",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    try:
+        report = compare_results(
+            [load_result(path) for path in [args.baseline, *args.candidates]], args.allow_config_diff
+        )
+    except CompareError as exc:
+        print(f"compare: {exc}", file=sys.stderr)
+        return 2
+    if args.out is not None:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(report, indent=2) + "\n")
+    print(render_markdown(report))
+    # Same convention as a run: a result that must not be quoted as an improvement exits 1.
+    if any(comparison["verdict"] in ("REGRESSION", "NOT COMPARABLE") for comparison in report["comparisons"]):
+        return 1
+    return 0
@@ -0,0 +1,5 @@
+SELECT toStartOfHour(placed_at) AS hour, sum(line_total) AS revenue
+FROM order_items
+WHERE placed_at >= now() - INTERVAL 7 DAY
+GROUP BY hour
+ORDER BY hour
@@ -0,0 +1,5 @@
+SELECT toStartOfDay(placed_at) AS day, status, count() AS orders
+FROM orders
+WHERE placed_at >= now() - INTERVAL 30 DAY
+GROUP BY day, status
+ORDER BY day, status
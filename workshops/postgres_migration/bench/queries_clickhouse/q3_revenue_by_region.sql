@@ -0,0 +1,7 @@
+SELECT c.region AS region, sum(i.quantity) AS units, sum(i.line_total) AS revenue
+FROM order_items AS i
+INNER JOIN orders AS o ON o.order_id = i.order_id
+INNER JOIN customers AS c ON c.customer_id = o.customer_id
+WHERE i.placed_at >= now() - INTERVAL 30 DAY
+GROUP BY region
+ORDER BY revenue DESC
@@ -0,0 +1,9 @@
+SELECT toStartOfDay(placed_at) AS day, round(avg(order_total), 2) AS avg_order_value
+FROM (
+  SELECT order_id, placed_at, sum(line_total) AS order_total
+  FROM order_items
+  WHERE placed_at >= now() - INTERVAL 30 DAY
+  GROUP BY order_id, placed_at
+) AS per_order
+GROUP BY day
+ORDER BY day
@@ -0,0 +1,7 @@
+SELECT p.sku AS sku, p.category AS category, sum(i.quantity) AS units, sum(i.line_total) AS revenue
+FROM order_items AS i
+INNER JOIN products AS p ON p.product_id = i.product_id
+WHERE i.placed_at >= now() - INTERVAL 30 DAY
+GROUP BY sku, category
+ORDER BY revenue DESC
+LIMIT 20
@@ -0,0 +1,8 @@
+SELECT p.category AS category,
+       sum(i.line_total) AS revenue,
+       round(100 * sum(i.line_total) / (SELECT sum(line_total) FROM order_items WHERE placed_at >= now() - INTERVAL 90 DAY), 2) AS pct_of_revenue
+FROM order_items AS i
+INNER JOIN products AS p ON p.product_id = i.product_id
+WHERE i.placed_at >= now() - INTERVAL 90 DAY
+GROUP BY category
+ORDER BY revenue DESC
@@ -0,0 +1,8 @@
+SELECT day, revenue, avg(revenue) OVER (ORDER BY day ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS rolling_7d
+FROM (
+  SELECT toStartOfDay(placed_at) AS day, sum(line_total) AS revenue
+  FROM order_items
+  WHERE placed_at >= now() - INTERVAL 90 DAY
+  GROUP BY day
+) AS daily
+ORDER BY day
@@ -0,0 +1,9 @@
+SELECT c.region AS region,
+       count() AS orders,
+       countIf(o.status = 'refunded') AS refunded,
+       round(100.0 * countIf(o.status = 'refunded') / count(), 2) AS refund_pct
+FROM orders AS o
+INNER JOIN customers AS c ON c.customer_id = o.customer_id
+WHERE o.placed_at >= now() - INTERVAL 90 DAY
+GROUP BY region
+ORDER BY refund_pct DESC
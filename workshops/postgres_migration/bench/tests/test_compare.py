@@ -0,0 +1,198 @@
+"""Offline unit tests for compare.py.
+
+Results files are built with run.build_result from seeded samples, so what is compared
+here is exactly what a run writes. The properties that matter: the intervals are centred
+on the numbers the results file printed, a real difference is called and noise is not,
+and two runs that are not the same experiment are refused before any statistics.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+
+import pytest
+
+import compare
+import run
+from histogram import LatencyHistogram
+from run import DashboardStats, build_result
+
+QUERIES = ["q1_revenue_by_hour", "q6_category_mix"]
+
+
+def config(**overrides) -> dict:
+    block = {"target": "postgres", "dashboard_concurrency": 8, "duration_seconds": 300, "queries": 2}
+    block.update(overrides)
+    return block
+
+
+def result(
+    label: str,
+    scale: float,
+    tps: list[float] | None = None,
+    runs: int = 400,
+    seed: int = 1,
+    **config_overrides,
+) -> dict:
+    """A results file whose latencies are log-normal around `scale` ms."""
+    rng = random.Random(seed)
+    stats = DashboardStats()
+    for name in QUERIES:
+        for _ in range(runs):
+            stats.record_timing(name, scale * rng.lognormvariate(0.0, 0.4))
+    series = tps if tps is not None else [100.0 + rng.uniform(-3, 3) for _ in range(29)]
+    return json.loads(
+        json.dumps(
+            build_result(
+                label=label,
+                config=config(**config_overrides),
+                query_names=QUERIES,
+                stats=stats,
+                elapsed_seconds=300.0,
+                writer_summary={
+                    "tps": round(sorted(series)[len(series) // 2], 1),
+                    "tps_series": series,
+                    "died_before_stop": False,
+                    "final_line_seen": True,
+                },
+            )
+        )
+    )
+
+
+def test_bootstrap_is_centred_on_the_reported_percentile() -> None:
+    rng = random.Random(3)
+    h = LatencyHistogram()
+    for _ in range(2000):
+        h.record(rng.lognormvariate(3.0, 0.5))
+
+    replicates = compare.bootstrap_percentile(h, 0.95, random.Random(0))
+    low, high = compare.interval(replicates)
+
+    assert len(replicates) == compare.BOOTSTRAP_RESAMPLES
+    assert low <= h.percentile(0.95) <= high
+    assert high / low < 1.3
+
+
+def test_rank_table_agrees_with_the_histogram_at_every_rank() -> None:
+    h = LatencyHistogram()
+    for value in (1.0, 2.0, 2.0, 5.0, 40.0, 41.0, 300.0):
+        h.record(value)
+    table = compare.RankTable(h)
+
+    for rank in range(h.count):
+        assert table.at(rank) == h.percentile(rank / h.count)
+
+
+def test_the_same_distribution_is_no_significant_change() -> None:
+    report = compare.compare_results([result("before", 50.0, seed=1), result("again", 50.0, seed=2)])
+    comparison = report["comparisons"][0]
+
+    for row in comparison["queries"]:
+        low, high = row["p95_speedup_ci"]
+        assert low <= 1.0 <= high
+        assert row["verdict"] == "no significant change"
+    assert comparison["verdict"] == "NO SIGNIFICANT CHANGE"
+
+
+def test_a_real_speedup_is_called_with_its_interval() -> None:
+    report = compare.compare_results([result("before", 200.0), result("after", 50.0, seed=2)])
+    comparison = report["comparisons"][0]
+    row = comparison["queries"][0]
+
+    assert row["p95_speedup"] == pytest.approx(4.0, rel=0.2)
+    assert 1.0 < row["p95_speedup_ci"][0] <= row["p95_speedup"] <= row["p95_speedup_ci"][1]
+    assert row["verdict"] == "faster"
+    assert comparison["verdict"] == "IMPROVEMENT"
+
+
+def test_one_slower_panel_is_a_regression_whatever_else_improved() -> None:
+    before = result("before", 50.0)
+    after = result("after", 20.0, seed=2)
+    slow = result("slow", 150.0, seed=3)
+    after["queries"][1] = slow["queries"][1]
+
+    comparison = compare.compare_results([before, after])["comparisons"][0]
+
+    assert [row["verdict"] for row in comparison["queries"]] == ["faster", "slower"]
+    assert comparison["verdict"] == "REGRESSION"
+
+
+def test_writer_tps_that_fell_is_a_regression() -> None:
+    before = result("before", 50.0, tps=[120.0 + i % 3 for i in range(29)])
+    after = result("after", 50.0, seed=2, tps=[90.0 + i % 3 for i in range(29)])
+
+    comparison = compare.compare_results([before, after])["comparisons"][0]
+
+    assert comparison["writer"]["delta_tps"] == -30.0
+    assert comparison["writer"]["delta_tps_ci"][1] < 0
+    assert comparison["writer"]["verdict"] == "lower"
+    assert comparison["verdict"] == "REGRESSION"
+
+
+def test_mismatched_configs_are_refused_unless_the_difference_is_allowed() -> None:
+    before = result("before", 50.0)
+    after = result("after", 50.0, seed=2, dashboard_concurrency=32)
+
+    with pytest.raises(compare.CompareError, match="dashboard_concurrency: 8 vs 32"):
+        compare.compare_results([before, after])
+
+    direct = result("direct", 50.0, seed=2, target="clickhouse")
+    report = compare.compare_results([before, direct], allowed_differences=["target"])
+    assert report["allowed_differences"] == {"target": ["postgres", "clickhouse"]}
+    assert "- target: \"postgres\" vs \"clickhouse\"" in compare.render_markdown(report)
+
+
+def test_a_panel_that_never_ran_makes_the_pair_not_comparable() -> None:
+    after = result("after", 50.0, seed=2)
+    after["queries"][1]["runs"] = 0
+    after["queries_without_results"] = ["q6_category_mix"]
+
+    comparison = compare.compare_results([result("before", 50.0), after])["comparisons"][0]
+
+    assert comparison["queries"][1]["verdict"] == "not comparable"
+    assert comparison["verdict"] == "NOT COMPARABLE"
+
+
+def test_files_without_histograms_get_ratios_but_no_claim() -> None:
+    before, after = result("before", 200.0), result("after", 50.0, seed=2)
+    for row in before["queries"]:
+        del row["histogram"]
+
+    row = compare.compare_results([before, after])["comparisons"][0]["queries"][0]
+
+    assert row["p95_speedup"] > 1
+    assert row["p95_speedup_ci"] is None
+    assert row["verdict"] == "no interval"
+
+
+def test_intervals_are_reproducible() -> None:
+    files = [result("before", 80.0), result("after", 60.0, seed=2)]
+
+    assert compare.compare_results(files) == compare.compare_results(files)
+
+
+def test_sweep_files_are_not_compared(tmp_path) -> None:
+    path = tmp_path / "sweep.json"
+    path.write_text(json.dumps({"label": "cal", "config": {}, "curve": [], "levels": []}))
+
+    with pytest.raises(compare.CompareError, match="--sweep"):
+        compare.load_result(path)
+
+
+def test_run_py_dispatches_compare_and_exits_by_verdict(tmp_path, capsys) -> None:
+    before, after, worse = tmp_path / "before.json", tmp_path / "after.json", tmp_path / "worse.json"
+    before.write_text(json.dumps(result("before", 200.0)))
+    after.write_text(json.dumps(result("after", 50.0, seed=2)))
+    worse.write_text(json.dumps(result("worse", 400.0, seed=3)))
+    out = tmp_path / "compare.json"
+
+    assert run.main(["compare", str(before), str(after), "--out", str(out)]) == 0
+    printed = capsys.readouterr().out
+    assert "## Benchmark comparison: before -> after" in printed
+    assert "Verdict: **IMPROVEMENT**" in printed
+    assert json.loads(out.read_text())["comparisons"][0]["verdict"] == "IMPROVEMENT"
+
+    assert run.main(["compare", str(before), str(after), str(worse)]) == 1
+    assert run.main(["compare", str(before), str(tmp_path / "missing.json")]) == 2
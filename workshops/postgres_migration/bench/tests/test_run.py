@@ -15,10 +15,16 @@ from __future__ import annotations
 
 import asyncio
 import json
+import random
+import socket
+import threading
+from datetime import datetime, timezone
 
 import pytest
 
 import run
+from histogram import LatencyHistogram
+from metrics import encode_sample
 from run import (
     DashboardStats,
     WriterMonitor,
@@ -243,6 +249,18 @@ def test_summary_p95_covers_the_eligible_windows_only() -> None:
     assert summary["p95_ms"] == 30.0
 
 
+def test_forget_before_drops_only_the_samples_already_used() -> None:
+    # A daemon summarises each window from its own samples, then has no use for them.
+    monitor = WriterMonitor(report_seconds=10)
+    for at in (10.0, 20.0, 30.0, 40.0):
+        monitor.feed(interval_line(100.0 + at), at=at)
+
+    monitor.forget_before(30.0)
+
+    assert [sample.at for sample in monitor.samples] == [30.0, 40.0]
+    assert monitor.summary(30.0, 50.0)["tps_series"] == [140.0]
+
+
 # --------------------------------------------------------------------------
 # The pipe pump, without a subprocess
 # --------------------------------------------------------------------------
@@ -282,6 +300,140 @@ def test_pump_tolerates_a_missing_stream() -> None:
     assert monitor.samples == []
 
 
+# --------------------------------------------------------------------------
+# --writer-metrics socket: binary records instead of interval lines
+# --------------------------------------------------------------------------
+
+
+def record(tps: float, latencies: list[float], window: int = 1) -> bytes:
+    h = LatencyHistogram()
+    for value in latencies:
+        h.record(value)
+    (payload,) = encode_sample(window, tps, len(latencies), 0, h)
+    return payload
+
+
+def test_a_binary_record_becomes_a_sample_with_its_histogram() -> None:
+    monitor = WriterMonitor(report_seconds=1)
+    monitor.feed_record(record(250.0, [4.0, 9.0]), at=3.0)
+
+    (sample,) = monitor.samples
+    assert (sample.at, sample.tps, sample.committed) == (3.0, 250.0, 2)
+    assert sample.p95_ms == sample.latencies.percentile(0.95)
+    assert sample.latencies.max == 9.0
+
+
+def test_a_window_split_across_datagrams_becomes_one_sample() -> None:
+    h = LatencyHistogram()
+    for i in range(5_000):
+        h.record(0.1 * 1.003**i)  # 0.1 ms to ~300 s: too many buckets for one datagram
+    payloads = encode_sample(1, 500.0, h.count, 0, h)
+    assert len(payloads) > 1
+
+    monitor = WriterMonitor(report_seconds=1)
+    for payload in payloads:
+        monitor.feed_record(payload, at=2.0)
+
+    (sample,) = monitor.samples
+    assert (sample.tps, sample.committed) == (500.0, h.count)
+    assert sample.latencies.counts == h.counts
+    assert sample.p95_ms == h.percentile(0.95)
+
+
+def test_a_bad_record_is_counted_not_raised() -> None:
+    monitor = WriterMonitor(report_seconds=1)
+    monitor.feed_record(b"not a record", at=1.0)
+
+    assert monitor.samples == []
+    assert monitor.malformed == 1
+    assert "binary record" in monitor.malformed_lines[0]
+
+
+def test_p95_is_merged_exactly_when_every_window_has_its_histogram() -> None:
+    # One slow second among fast ones: its p95 alone is not the window's p95, and a
+    # percentile of per-second p95s would report it anyway.
+    monitor = WriterMonitor(report_seconds=1)
+    for second in range(1, 20):
+        monitor.feed_record(record(100.0, [2.0] * 99), at=float(second))
+    monitor.feed_record(record(100.0, [2.0] * 90 + [800.0] * 9), at=20.0)
+
+    summary = monitor.summary(start=0.0, end=20.0)
+    assert summary["p95_basis"] == "merged-histograms"
+    assert summary["p95_ms"] == pytest.approx(2.0, rel=0.01)
+
+    monitor.feed(interval_line(100.0, p95_ms=5.0), at=20.5)
+    assert monitor.summary(start=0.0, end=21.0)["p95_basis"] == "window-p95s"
+
+
+def test_receiver_drains_records_until_closed_and_polled_empty() -> None:
+    # The socket is a fake: recv hands out what the writer sent, then times out, and the
+    # reader returns on the first timeout after close without spending a real poll.
+    closing = threading.Event()
+    queued = [record(100.0, [1.0]), record(110.0, [1.0], window=2)]
+
+    class FakeSocket:
+        def recv(self, size: int) -> bytes:
+            assert size == run.MAX_DATAGRAM_BYTES
+            if queued:
+                return queued.pop(0)
+            closing.set()
+            raise socket.timeout
+
+    monitor = WriterMonitor(report_seconds=1)
+    ticks = iter([1.0, 2.0])
+    run.MetricsReceiver._receive(FakeSocket(), monitor, lambda: next(ticks), closing)
+
+    assert [(s.at, s.tps) for s in monitor.samples] == [(1.0, 100.0), (2.0, 110.0)]
+
+
+def test_dropped_records_are_a_warning() -> None:
+    summary = {"tps": 100.0, "final_line_seen": True, "metrics_dropped": 3}
+    result = build_result(
+        label="x",
+        config={},
+        query_names=[],
+        stats=DashboardStats(),
+        elapsed_seconds=1.0,
+        writer_summary=summary,
+    )
+
+    assert any("dropped 3 metrics records" in warning for warning in result["warnings"])
+
+
+def test_records_the_writer_could_not_send_are_a_warning_of_their_own() -> None:
+    summary = {
+        "tps": 100.0,
+        "final_line_seen": True,
+        "metrics_dropped": 0,
+        "metrics_failed": 60,
+        "metrics_error": "OSError: [Errno 40] Message too long",
+    }
+    result = build_result(
+        label="x",
+        config={},
+        query_names=[],
+        stats=DashboardStats(),
+        elapsed_seconds=1.0,
+        writer_summary=summary,
+    )
+
+    (warning,) = [w for w in result["warnings"] if "metrics records" in w]
+    assert "could not send 60 metrics records" in warning
+    assert "Message too long" in warning
+
+
+def test_writer_metrics_defaults_to_stdout_and_records_its_interval() -> None:
+    base = ["--dsn", "postgres:///shop", "--writer-dsn", "postgres:///shop", "--label", "x", "--out", "o.json"]
+
+    assert run.WRITER_METRICS == "stdout"
+    config = run.build_config(parse_args(base), query_count=8)
+    assert (config["writer_metrics"], config["writer_report_seconds"]) == ("stdout", run.WRITER_REPORT_SECONDS)
+    config = run.build_config(parse_args(base + ["--writer-metrics", "socket"]), query_count=8)
+    assert (config["writer_metrics"], config["writer_report_seconds"]) == ("socket", run.WRITER_METRICS_SECONDS)
+    with pytest.raises(SystemExit):
+        parse_args(base + ["--writer-metrics", "shm"])
+
+
 # --------------------------------------------------------------------------
 # build_result: a query that fails on one target must not hide
 # --------------------------------------------------------------------------
@@ -527,9 +679,35 @@ def test_markdown_query_table_is_one_row_per_query_with_error_counts() -> None:
     rendered = render_markdown(sample_result())
     lines = rendered.splitlines()
 
-    assert "| Query | runs | errors | p50 ms | p95 ms |" in lines
-    assert "| q1_revenue_by_hour | 2 | 0 | 30.0 | 30.0 |" in lines
-    assert "| q6_category_mix | 0 | 1 | 0.0 | 0.0 |" in lines
+    assert "| Query | runs | errors | p50 ms | p95 ms | p99 ms | p99.9 ms | max ms |" in lines
+    assert "| q1_revenue_by_hour | 2 | 0 | 30.0 | 30.0 | 30.0 | 30.0 | 30.0 |" in lines
+    assert "| q6_category_mix | 0 | 1 | 0.0 | 0.0 | 0.0 | 0.0 | 0.0 |" in lines
+
+
+def test_tail_percentiles_and_the_distribution_are_kept() -> None:
+    stats = DashboardStats()
+    for n in range(1, 1001):
+        stats.record_timing("q1_revenue_by_hour", float(n))
+
+    result = build_result(
+        label="before",
+        config=config_for(1),
+        query_names=["q1_revenue_by_hour"],
+        stats=stats,
+        elapsed_seconds=10.0,
+        writer_summary=writer_summary(),
+    )
+    row = result["queries"][0]
+
+    assert row["p99_ms"] == pytest.approx(991.0, rel=run.RELATIVE_ERROR)
+    assert row["p999_ms"] == 1000.0 == row["max_ms"]
+    assert sum(row["histogram"]["counts"].values()) == 1000
+    # The layout is what turns a stored bucket index back into milliseconds.
+    layout = result["histogram_layout"]
+    index = int(max(row["histogram"]["counts"], key=int))
+    low = layout["lowest_ms"] * layout["growth"] ** index
+    assert low <= 1000.0 < low * layout["growth"]
+    assert result["timeline"] == []
 
 
 def test_markdown_shows_warnings_and_the_error_text() -> None:
@@ -565,6 +743,310 @@ def test_markdown_is_a_string_with_no_emoji() -> None:
     assert rendered.isascii()
 
 
+# --------------------------------------------------------------------------
+# Server-side stats: what the database says each panel cost
+# --------------------------------------------------------------------------
+
+
+def pg_row(calls: int, total_ms: float, rows: int = 0, hit: int = 0, read: int = 0, temp: int = 0) -> dict:
+    return {
+        "calls": calls,
+        "total_exec_time": total_ms,
+        "rows": rows,
+        "shared_blks_hit": hit,
+        "shared_blks_read": read,
+        "temp_blks_written": temp,
+    }
+
+
+def test_query_id_comes_from_the_explain_plan() -> None:
+    plan = json.dumps([{"Plan": {"Node Type": "Sort"}, "Query Identifier": -4128791134567}])
+
+    assert run.query_id_from_plan(plan) == -4128791134567
+    # compute_query_id = off: the key is simply absent.
+    assert run.query_id_from_plan([{"Plan": {}}]) is None
+
+
+def test_pg_stat_deltas_cover_only_the_window() -> None:
+    # Warm-up already ran q1 40 times; only what happened after the first snapshot counts.
+    before = {11: pg_row(40, 400.0, rows=4000, hit=100, read=10)}
+    after = {
+        11: pg_row(140, 1400.0, rows=14000, hit=900, read=10, temp=0),
+        22: pg_row(5, 250.0, rows=5, hit=0, read=70, temp=12),
+    }
+
+    deltas = run.stat_deltas(before, after, {11: "q1", 22: "q6", 33: "q8"})
+
+    assert deltas["q1"] == {
+        "calls": 100,
+        "mean_exec_ms": 10.0,
+        "rows": 10000,
+        "shared_blks_hit": 800,
+        "shared_blks_read": 0,
+        "temp_blks_written": 0,
+    }
+    # First seen inside the window: counted from zero, spill included.
+    assert deltas["q6"]["calls"] == 5
+    assert deltas["q6"]["temp_blks_written"] == 12
+    # Never ran in the window: absent, not a row of zeros that looks measured.
+    assert "q8" not in deltas
+
+
+def test_query_log_rows_are_keyed_by_panel_name() -> None:
+    rows = [("bench:q1", 20, 400, 1_000_000, 8_000_000, 64_000_000, 168), ("other", 3, 3, 3, 3, 3, 3)]
+
+    stats = run.query_log_stats(rows, {"bench:q1": "q1"})
+
+    assert stats == {
+        "q1": {
+            "queries": 20,
+            "mean_server_ms": 20.0,
+            "read_rows": 1_000_000,
+            "read_bytes": 8_000_000,
+            "max_memory_bytes": 64_000_000,
+            "result_rows": 168,
+        }
+    }
+
+
+class FakeQueryLogClient:
+    """A clickhouse-connect client that records what the harness sends and what it asks the log for."""
+
+    def __init__(self, logged: list[tuple]) -> None:
+        self.logged = logged
+        self.sent: list[tuple[str, dict]] = []
+        self.log_parameters: dict | None = None
+
+    async def query(self, sql: str, parameters: dict | None = None, settings: dict | None = None):
+        if "FROM system.query_log" in sql or "query_log)" in sql:
+            self.log_parameters = parameters
+            rows = self.logged
+        elif "now64" in sql:
+            rows = [(0.0,)]
+        else:
+            self.sent.append((sql, settings or {}))
+            rows = []
+        return type("QueryResult", (), {"result_rows": rows})()
+
+    async def command(self, sql: str) -> None:
+        pass
+
+
+def test_query_log_is_matched_on_the_tag_the_panel_query_carried() -> None:
+    # The tag the session sends and the tag the log query groups by come from one place;
+    # a panel that ran but left no rows is an error, not a silently missing table row.
+    client = FakeQueryLogClient([])
+    stats = run.ClickHouseServerStats("https://ch")
+    stats.client = client
+    stats.names_by_tag = {run.panel_log_comment(n): n for n in ("q1_revenue_by_hour", "q2_orders_by_status")}
+
+    async def scenario() -> dict:
+        await run.fetch_panel(run.ClickHouseSession(client), "q1_revenue_by_hour", "SELECT 1")
+        sent_tag = client.sent[0][1]["log_comment"]
+        client.logged = [(sent_tag, 2, 10, 1, 1, 1, 1)]
+        await stats.begin()
+        return await stats.end()
+
+    block = asyncio.run(scenario())
+
+    assert client.sent == [("SELECT 1", {"log_comment": "bench:q1_revenue_by_hour"})]
+    assert "bench:q1_revenue_by_hour" in client.log_parameters["tags"]
+    assert block["queries"]["q1_revenue_by_hour"]["queries"] == 2
+    assert block["error"] == "no rows for q2_orders_by_status"
+
+
+def test_postgres_connections_are_sent_the_bare_panel_sql() -> None:
+    class Conn:
+        async def fetch(self, sql: str) -> list:
+            return [sql]
+
+    assert asyncio.run(run.fetch_panel(Conn(), "q1", "SELECT 1")) == ["SELECT 1"]
+
+
+def server_block(**overrides) -> dict:
+    block = {
+        "source": "pg_stat_statements",
+        "columns": ["calls", "mean_exec_ms", "temp_blks_written"],
+        "queries": {"q1_revenue_by_hour": {"calls": 2, "mean_exec_ms": 9.5, "temp_blks_written": 0}},
+        "error": None,
+    }
+    block.update(overrides)
+    return block
+
+
+def test_server_stats_travel_in_the_result_and_render_per_query() -> None:
+    stats = DashboardStats()
+    stats.record_timing("q1_revenue_by_hour", 10.0)
+    stats.record_timing("q6_category_mix", 10.0)
+    result = build_result(
+        label="before",
+        config=config_for(),
+        query_names=["q1_revenue_by_hour", "q6_category_mix"],
+        stats=stats,
+        elapsed_seconds=10.0,
+        writer_summary=writer_summary(),
+        server_stats=server_block(),
+    )
+    lines = render_markdown(result).splitlines()
+
+    assert result["server"]["queries"]["q1_revenue_by_hour"]["calls"] == 2
+    assert "| Query | calls | mean_exec_ms | temp_blks_written |" in lines
+    assert "| q1_revenue_by_hour | 2 | 9.5 | 0 |" in lines
+    assert "| q6_category_mix | - | - | - |" in lines
+
+
+def test_unavailable_server_stats_warn_but_do_not_void_the_run() -> None:
+    result = build_result(
+        label="before",
+        config=config_for(1),
+        query_names=["q1_revenue_by_hour"],
+        stats=DashboardStats(),
+        elapsed_seconds=10.0,
+        writer_summary=writer_summary(),
+        server_stats=server_block(
+            queries={}, error='UndefinedTableError: relation "pg_stat_statements" does not exist'
+        ),
+    )
+
+    assert any("pg_stat_statements are unavailable" in warning for warning in result["warnings"])
+    assert "Server side" not in render_markdown(result)
+
+
+class FakeStatsConnection:
+    """Returns scripted pg_stat_statements snapshots, one per fetch, like asyncpg would."""
+
+    def __init__(self, snapshots: list[list[dict]]) -> None:
+        self.snapshots = snapshots
+
+    async def fetch(self, sql: str, ids: list[int]) -> list[dict]:
+        assert sorted(ids) == [11, 22]
+        return self.snapshots.pop(0)
+
+def test_postgres_capture_snapshots_at_begin_and_end() -> None:
+    server = run.PostgresServerStats("postgres:///shop")
+    server.conn = FakeStatsConnection(
+        [[{"queryid": 11, **pg_row(3, 30.0)}], [{"queryid": 11, **pg_row(7, 70.0)}]]
+    )
+    server.names_by_id = {11: "q1", 22: "q2"}
+
+    async def scenario() -> dict:
+        await server.begin()
+        return await server.end()
+
+    block = asyncio.run(scenario())
+
+    assert block["error"] is None
+    assert block["source"] == "pg_stat_statements"
+    assert block["queries"]["q1"]["calls"] == 4
+    assert block["queries"]["q1"]["mean_exec_ms"] == 10.0
+
+
+def test_server_stats_are_on_by_default_and_recorded_by_source() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    assert parse_args(base).server_stats is run.SERVER_STATS is True
+    assert run.build_config(parse_args(base), query_count=8)["server_stats"] == "pg_stat_statements"
+    config = run.build_config(parse_args(base + ["--target", "clickhouse"]), query_count=8)
+    assert config["server_stats"] == "system.query_log"
+    assert run.build_config(parse_args(base + ["--no-server-stats"]), query_count=8)["server_stats"] is None
+
+
+# --------------------------------------------------------------------------
+# --sweep: one result per concurrency level, combined into a curve
+# --------------------------------------------------------------------------
+
+
+def level_result(concurrency: int, q1_ms: float, writer_tps: float, q6_runs: int = 1) -> dict:
+    stats = DashboardStats()
+    stats.record_timing("q1_revenue_by_hour", q1_ms)
+    for _ in range(q6_runs):
+        stats.record_timing("q6_category_mix", 5.0)
+    config = config_for()
+    config["dashboard_concurrency"] = concurrency
+    return build_result(
+        label="before",
+        config=config,
+        query_names=["q1_revenue_by_hour", "q6_category_mix"],
+        stats=stats,
+        elapsed_seconds=10.0,
+        writer_summary=writer_summary(tps=writer_tps),
+    )
+
+
+def sweep_config(levels: list[int]) -> dict:
+    config = config_for()
+    config["dashboard_concurrency"] = None
+    config["sweep"] = levels
+    return config
+
+
+def test_sweep_levels_parse_sorted_and_deduplicated() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    assert parse_args(base).sweep is None
+    assert parse_args(base + ["--sweep", "8,1,2,8"]).sweep == [1, 2, 8]
+    for bad in ("0,1", "1,x", ","):
+        with pytest.raises(SystemExit):
+            parse_args(base + ["--sweep", bad])
+
+
+def test_a_sweep_config_records_the_levels_instead_of_one_concurrency() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    config = run.build_config(parse_args(base + ["--sweep", "1,4"]), query_count=8)
+
+    assert config["sweep"] == [1, 4]
+    assert config["dashboard_concurrency"] is None
+    assert run.build_config(parse_args(base), query_count=8)["sweep"] is None
+
+
+def test_sweep_result_is_one_curve_point_per_level() -> None:
+    levels = [level_result(1, 10.0, 120.0), level_result(4, 40.0, 90.0)]
+
+    result = run.build_sweep_result(label="before", config=sweep_config([1, 4]), levels=levels)
+
+    assert [point["dashboard_concurrency"] for point in result["curve"]] == [1, 4]
+    assert [point["writer_tps"] for point in result["curve"]] == [120.0, 90.0]
+    assert result["curve"][1]["p95_ms"] == {"q1_revenue_by_hour": 40.0, "q6_category_mix": 5.0}
+    assert result["levels"] == levels
+    assert result["comparable"] is True
+    assert result["warnings"] == []
+
+
+def test_a_panel_that_fails_at_one_level_voids_the_whole_curve() -> None:
+    # Losing q6 only at concurrency 32 would change the query set at exactly the knee
+    # the sweep is meant to find.
+    levels = [level_result(1, 10.0, 120.0), level_result(32, 90.0, 60.0, q6_runs=0)]
+
+    result = run.build_sweep_result(label="before", config=sweep_config([1, 32]), levels=levels)
+
+    assert result["comparable"] is False
+    assert result["queries_without_results"] == ["q6_category_mix"]
+    assert any(warning.startswith("concurrency 32: ") for warning in result["warnings"])
+
+
+def test_a_sweep_cut_short_names_the_levels_it_never_measured() -> None:
+    result = run.build_sweep_result(
+        label="before", config=sweep_config([1, 4, 16]), levels=[level_result(1, 10.0, 120.0)]
+    )
+
+    assert result["warnings"][-1].endswith("never measured: 4, 16")
+
+
+def test_sweep_markdown_is_a_table_of_qps_writer_tps_and_p95_per_level() -> None:
+    levels = [level_result(1, 10.0, 120.0), level_result(4, 40.0, 90.0)]
+    rendered = run.render_sweep_markdown(
+        run.build_sweep_result(label="before", config=sweep_config([1, 4]), levels=levels)
+    )
+    lines = rendered.splitlines()
+
+    assert "| sweep | 1,4 |" in lines
+    assert "| Concurrency | QPS | Writer TPS | q1_revenue_by_hour p95 ms | q6_category_mix p95 ms |" in lines
+    assert "| 1 | 0.2 | 120.0 | 10.0 | 5.0 |" in lines
+    assert "| 4 | 0.2 | 90.0 | 40.0 | 5.0 |" in lines
+    assert rendered.isascii()
+
+
 # --------------------------------------------------------------------------
 # dashboard_worker: one connection per session, warm-up discarded
 # --------------------------------------------------------------------------
@@ -665,6 +1147,395 @@ def test_worker_start_index_staggers_the_panel_it_begins_with() -> None:
     assert pool.connection.fetched == ["SELECT 3"]
 
 
+def test_worker_with_params_sends_a_fresh_rendering_each_execution() -> None:
+    queries = [("q1", "SELECT {{end_offset_hours}}")]
+    pool = FakePool()
+    clock = stepping_clock([0.0, 0.0, 1.0, 1.0, 2.0, 2.0, 99.0])
+
+    asyncio.run(
+        run.dashboard_worker(
+            pool,
+            queries,
+            0,
+            measure_start=0.0,
+            deadline=10.0,
+            stats=DashboardStats(),
+            clock=clock,
+            params=random.Random(0),
+        )
+    )
+
+    fetched = pool.connection.fetched
+    assert len(fetched) == 3
+    assert len(set(fetched)) > 1
+    assert not any("{{" in sql for sql in fetched)
+
+
+def test_timeline_windows_include_warmup_and_show_a_stall() -> None:
+    # 10 s windows from run start; warm-up is 30 s, so window 3 starts the measurement.
+    stats = DashboardStats(timeline_seconds=10, timeline_origin=100.0)
+    stats.record_window("q1", 900.0, at=101.0)  # cold first pass
+    stats.record_window("q1", 20.0, at=135.0)
+    stats.record_window("q1", 2000.0, at=158.0)  # a stall
+    stats.record_window("q2", 25.0, at=159.0)
+
+    result = build_result(
+        label="before",
+        config=config_for(2),
+        query_names=["q1", "q2"],
+        stats=stats,
+        elapsed_seconds=60.0,
+        writer_summary=writer_summary(),
+    )
+    timeline = result["timeline"]
+
+    assert [(w["start_seconds"], w["warmup"], w["count"]) for w in timeline] == [
+        (-30, True, 1),
+        (0, False, 1),
+        (20, False, 2),
+    ]
+    assert timeline[0]["max_ms"] == 900.0
+    assert timeline[2]["queries"]["q1"]["max_ms"] == 2000.0
+    assert timeline[2]["queries"]["q2"]["count"] == 1
+    lines = render_markdown(result).splitlines()
+    assert "| start s | runs | p50 ms | p95 ms | p99 ms | max ms |" in lines
+    assert "| -30 | 1 | 900.0 | 900.0 | 900.0 | 900.0 |" in lines
+
+
+def test_timeline_is_off_unless_asked_for() -> None:
+    stats = DashboardStats()
+    stats.record_window("q1", 5.0, at=1.0)
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    assert stats.timeline == {}
+    assert parse_args(base).timeline_seconds == run.TIMELINE_SECONDS == 0
+    assert run.build_config(parse_args(base), query_count=8)["timeline_seconds"] is None
+    assert run.build_config(parse_args(base + ["--timeline-seconds", "5"]), query_count=8)["timeline_seconds"] == 5
+    with pytest.raises(SystemExit):
+        parse_args(base + ["--timeline-seconds", "-1"])
+
+
+def test_worker_records_warmup_latency_on_the_timeline_only() -> None:
+    pool = FakePool()
+    stats = DashboardStats(timeline_seconds=1, timeline_origin=0.0)
+    # loop check 0.0, after q1 0.5 (warm-up), loop check 0.5, after q2 2.5 (measured), then stop.
+    clock = stepping_clock([0.0, 0.5, 0.5, 2.5, 99.0])
+
+    asyncio.run(
+        run.dashboard_worker(
+            pool,
+            [("q1", "SELECT 1"), ("q2", "SELECT 2")],
+            0,
+            measure_start=2.0,
+            deadline=10.0,
+            stats=stats,
+            clock=clock,
+        )
+    )
+
+    assert set(stats.timings) == {"q2"}
+    assert sorted((index, name) for index, window in stats.timeline.items() for name in window) == [
+        (0, "q1"),
+        (2, "q2"),
+    ]
+
+
+# --------------------------------------------------------------------------
+# --agents: sessions spread over processes, histograms merged back
+# --------------------------------------------------------------------------
+
+
+def test_agent_stats_merge_to_what_one_process_would_have_recorded() -> None:
+    one = DashboardStats(timeline_seconds=10)
+    left = DashboardStats(timeline_seconds=10)
+    right = DashboardStats(timeline_seconds=10)
+    for n in range(200):
+        for stats in (one, left if n % 2 else right):
+            stats.record_timing("q1", 1.0 + n)
+            stats.record_window("q1", 1.0 + n, at=float(n))
+    right.record_error("q6", RuntimeError("boom"))
+    right.unstarted = 3
+
+    merged = DashboardStats(timeline_seconds=10)
+    for agent in (left, right):
+        merged.merge(json.loads(json.dumps(agent.to_dict())))
+
+    assert merged.timings["q1"].counts == one.timings["q1"].counts
+    assert merged.timings["q1"].percentile(0.95) == one.timings["q1"].percentile(0.95)
+    per_window = {index: window["q1"].count for index, window in one.timeline.items()}
+    assert {index: window["q1"].count for index, window in merged.timeline.items()} == per_window
+    assert merged.error_counts == {"q6": 1}
+    assert merged.error_messages == {"q6": ["RuntimeError: boom"]}
+    assert merged.unstarted == 3
+
+
+def test_agent_command_line_carries_its_share_of_the_load() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "after", "--out", "out.json"]
+    args = parse_args(
+        base
+        + ["--dashboard-concurrency", "10", "--agents", "3", "--arrival-rate", "50"]
+        + ["--duration-seconds", "60", "--warmup-seconds", "5"]
+    )
+    shares = run.shard(10, 3)
+
+    args.query_params = "random"
+    agent = parse_args(run.agent_argv(args, shares[1], 10, 1, shares[0], 1234.5)[1:])
+
+    assert shares == [4, 3, 3]
+    assert agent.dashboard_concurrency == 3
+    assert agent.arrival_rate == pytest.approx(15.0)
+    assert (agent.agent_start_at, agent.agent_index, agent.agent_offset) == (1234.5, 1, 4)
+    assert (agent.duration_seconds, agent.warmup_seconds, agent.dsn) == (60, 5, "postgres:///shop")
+    assert (agent.query_params, agent.result_cache) == ("random", False)
+    # Agents never start writers of their own: the coordinator owns the one OLTP load.
+    assert agent.writer_dsn is None
+    assert agent.agents == 1
+
+
+def test_agents_are_pinned_validated_and_recorded() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    assert parse_args(base).agents == run.AGENTS == 1
+    assert run.build_config(parse_args(base + ["--agents", "4"]), query_count=8)["agents"] == 4
+    with pytest.raises(SystemExit):
+        parse_args(base + ["--agents", "0"])
+    with pytest.raises(SystemExit):
+        # More agents than sessions would leave one with nothing to run.
+        parse_args(base + ["--agents", "9"])
+    with pytest.raises(SystemExit):
+        parse_args(base + ["--agents", "2", "--sweep", "1,2,4"])
+
+
+# --------------------------------------------------------------------------
+# Open-loop arrivals: the schedule does not wait, latency runs from intended start
+# --------------------------------------------------------------------------
+
+
+def drain(queue: asyncio.Queue) -> list:
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_fixed_arrivals_are_evenly_spaced_and_end_with_one_stop_per_session() -> None:
+    queue: asyncio.Queue = asyncio.Queue()
+    queries = [("q1", "SELECT 1"), ("q2", "SELECT 2")]
+
+    # The clock is already past every arrival, so no real sleeping happens.
+    asyncio.run(
+        run.open_loop_arrivals(
+            queries, 4.0, "fixed", 1.0, 2, queue, run.random.Random(0), clock=stepping_clock([0.0, 100.0])
+        )
+    )
+    items = drain(queue)
+
+    assert items[:3] == [("q1", "SELECT 1", 0.25), ("q2", "SELECT 2", 0.5), ("q1", "SELECT 1", 0.75)]
+    assert items[3:] == [None, None]
+
+
+def test_poisson_arrivals_average_the_rate_and_replay_from_the_seed() -> None:
+    def schedule() -> list[float]:
+        queue: asyncio.Queue = asyncio.Queue()
+        asyncio.run(
+            run.open_loop_arrivals(
+                [("q1", "SELECT 1")],
+                10.0,
+                "poisson",
+                100.0,
+                1,
+                queue,
+                run.random.Random(run.ARRIVAL_SEED),
+                clock=stepping_clock([0.0, 1000.0]),
+            )
+        )
+        return [item[2] for item in drain(queue) if item is not None]
+
+    first = schedule()
+
+    assert 900 <= len(first) <= 1100
+    assert first == schedule()
+    assert len(set(round(b - a, 6) for a, b in zip(first, first[1:]))) > 1
+
+
+def test_open_loop_latency_includes_the_wait_for_a_session() -> None:
+    # Meant to start at t=1.0, picked up at 3.0, returned at 3.5: 2.5 s, not the 0.5 s a
+    # closed-loop timer would report. The 2 s queue wait is the tail coordinated omission hides.
+    queue: asyncio.Queue = asyncio.Queue()
+    queue.put_nowait(("q1", "SELECT 1", 1.0))
+    queue.put_nowait(None)
+    stats = DashboardStats()
+
+    asyncio.run(
+        run.open_loop_session(
+            FakePool(), queue, measure_start=0.0, deadline=10.0, stats=stats, clock=stepping_clock([3.0, 3.5])
+        )
+    )
+
+    assert stats.timings["q1"].max == pytest.approx(2500.0)
+
+
+def test_open_loop_discards_warmup_and_counts_the_backlog_at_the_deadline() -> None:
+    queue: asyncio.Queue = asyncio.Queue()
+    queue.put_nowait(("q1", "SELECT warm", 1.0))
+    queue.put_nowait(("q1", "SELECT late", 6.0))
+    queue.put_nowait(("q1", "SELECT warm late", 2.0))
+    queue.put_nowait(None)
+    stats = DashboardStats()
+    pool = FakePool()
+
+    asyncio.run(
+        run.open_loop_session(
+            pool, queue, measure_start=5.0, deadline=10.0, stats=stats, clock=stepping_clock([5.5, 11.0])
+        )
+    )
+
+    assert pool.connection.fetched == ["SELECT warm"]
+    assert stats.timings == {}
+    # Only the measured arrival counts; a warm-up one left over is not part of the window.
+    assert stats.unstarted == 1
+    result = build_result(
+        label="after",
+        config=config_for(),
+        query_names=["q1"],
+        stats=stats,
+        elapsed_seconds=5.0,
+        writer_summary=writer_summary(),
+    )
+    assert result["dashboard_unstarted"] == 1
+    assert any("lower bound" in warning for warning in result["warnings"])
+
+
+# --------------------------------------------------------------------------
+# --every: windows on a schedule, stored for trends
+# --------------------------------------------------------------------------
+
+
+def stored_result() -> dict:
+    stats = DashboardStats()
+    stats.record_timing("q1_revenue_by_hour", 40.0)
+    stats.record_error("q6_category_mix", RuntimeError("function not supported"))
+    return build_result(
+        label="nightly",
+        config={"target": "postgres", "dashboard_concurrency": 8},
+        query_names=["q1_revenue_by_hour", "q6_category_mix"],
+        stats=stats,
+        elapsed_seconds=60.0,
+        writer_summary=writer_summary(tps=97.5),
+    )
+
+
+def test_a_window_is_one_stored_row_per_query_with_the_writer_tps_beside_it() -> None:
+    start = datetime(2026, 10, 19, 3, 0, tzinfo=timezone.utc)
+
+    rows = [dict(zip(run.STORE_COLUMNS, row)) for row in run.store_rows(stored_result(), start)]
+
+    assert [row["query"] for row in rows] == ["q1_revenue_by_hour", "q6_category_mix"]
+    assert all(len(row) == len(run.STORE_COLUMNS) for row in rows)
+    assert rows[0]["p95_ms"] == 40.0 and rows[0]["runs"] == 1
+    # A panel that never ran is still a row, so the trend shows a gap with errors, not nothing.
+    assert (rows[1]["runs"], rows[1]["errors"]) == (0, 1)
+    assert {row["writer_tps"] for row in rows} == {97.5}
+    assert {row["window_start"] for row in rows} == {start}
+    assert json.loads(rows[0]["config"])["dashboard_concurrency"] == 8
+    for column in run.STORE_COLUMNS:
+        assert column in run.STORE_TABLE_SQL
+
+
+class FakeStoreClient:
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.inserted: list[list[tuple]] = []
+        self.closed = False
+
+    async def insert(self, table: str, rows: list[tuple], column_names: list[str]) -> None:
+        assert table == run.STORE_TABLE and column_names == list(run.STORE_COLUMNS)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("store unreachable")
+        self.inserted.append(rows)
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def test_a_failed_insert_keeps_its_rows_for_the_next_window() -> None:
+    store = run.ResultStore("https://store:8443/bench")
+    store.client = FakeStoreClient(failures=1)
+
+    async def scenario() -> None:
+        store.add([("w1",)])
+        await store.inserting
+        store.add([("w2",)])
+        await store.inserting
+        await store.close()
+
+    asyncio.run(scenario())
+
+    assert store.client.inserted == [[("w1",), ("w2",)]]
+    assert store.pending == []
+    assert store.client.closed
+
+
+def test_an_unreachable_store_drops_the_oldest_rows_past_the_cap(monkeypatch) -> None:
+    monkeypatch.setattr(run, "MAX_PENDING_STORE_ROWS", 3)
+    store = run.ResultStore("https://store:8443/bench")
+    store.client = FakeStoreClient(failures=99)
+
+    async def scenario() -> None:
+        for window in range(5):
+            store.add([(window,)])
+            await store.inserting
+
+    asyncio.run(scenario())
+
+    assert store.pending == [(2,), (3,), (4,)]
+    assert store.dropped == 2
+
+
+def test_only_a_writer_death_turns_a_cancelled_window_into_an_aborted_one() -> None:
+    # Anything else cancelling a window is Ctrl-C: a daemon must not store the half-window.
+    async def scenario() -> tuple[bool, bool, bool]:
+        async def watchdog(code: int | None) -> int | None:
+            return code
+
+        died, finished = asyncio.create_task(watchdog(1)), asyncio.create_task(watchdog(None))
+        await asyncio.gather(died, finished)
+        return run.stopped_by_watchdog(died), run.stopped_by_watchdog(finished), run.stopped_by_watchdog(None)
+
+    assert asyncio.run(scenario()) == (True, False, False)
+
+
+def test_every_needs_a_store_and_room_for_its_window() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "nightly", "--out", "out.json"]
+    store = ["--store-dsn", "https://store:8443/bench"]
+
+    assert run.EVERY_SECONDS is None
+    assert run.build_config(parse_args(base), query_count=8)["every_seconds"] is None
+    config = run.build_config(
+        parse_args(base + ["--every", "600", "--warmup-seconds", "30", "--duration-seconds", "120"] + store),
+        query_count=8,
+    )
+    assert config["every_seconds"] == 600
+    for extra in (
+        ["--every", "600"],
+        ["--every", "100"] + store,
+        ["--every", "600", "--sweep", "1,2"] + store,
+        store,
+    ):
+        with pytest.raises(SystemExit):
+            parse_args(base + extra)
+
+
+def test_the_trend_dashboard_reads_the_table_the_daemon_writes() -> None:
+    path = run.BENCH_DIR.parent / "grafana" / "bench_dashboards" / "bench-trends.json"
+    dashboard = json.loads(path.read_text())
+
+    sql = [target["rawSql"] for panel in dashboard["panels"] for target in panel.get("targets", [])]
+    assert sql
+    assert all(run.STORE_TABLE in text for text in sql)
+
+
 # --------------------------------------------------------------------------
 # CLI surface and pinned defaults
 # --------------------------------------------------------------------------
@@ -736,6 +1607,49 @@ def test_config_block_records_the_writer_settings_when_present() -> None:
     assert config["writer_report_seconds"] == 10
 
 
+def test_writer_items_is_pinned_and_recorded_only_with_a_writer() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    assert parse_args(base).writer_items == run.WRITER_ITEMS == "per-row"
+    assert run.build_config(parse_args(base), query_count=8)["writer_items"] is None
+    config = run.build_config(
+        parse_args(base + ["--writer-dsn", "postgres:///w", "--writer-items", "unnest"]), query_count=8
+    )
+    assert config["writer_items"] == "unnest"
+
+
+def test_writer_processes_is_pinned_validated_and_recorded() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    assert parse_args(base).writer_processes == run.WRITER_PROCESSES == 1
+    with pytest.raises(SystemExit):
+        parse_args(base + ["--writer-processes", "0"])
+    with pytest.raises(SystemExit):
+        # More children than connections would leave one with an empty pool.
+        parse_args(base + ["--writer-processes", "17"])
+    config = run.build_config(
+        parse_args(base + ["--writer-dsn", "postgres:///w", "--writer-processes", "4"]), query_count=8
+    )
+    assert config["writer_processes"] == 4
+
+
+def test_load_model_is_closed_loop_unless_an_arrival_rate_is_given() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    closed = run.build_config(parse_args(base), query_count=8)
+    assert run.ARRIVAL_RATE is None
+    assert closed["load_model"] == "closed-loop"
+    assert closed["latency_measured_from"] == "send"
+    assert closed["arrival"] is None
+
+    opened = run.build_config(parse_args(base + ["--arrival-rate", "40", "--arrival", "fixed"]), query_count=8)
+    assert opened["load_model"] == "open-loop"
+    assert (opened["arrival"], opened["arrival_rate"]) == ("fixed", 40.0)
+    assert opened["latency_measured_from"] == "intended-start"
+    with pytest.raises(SystemExit):
+        parse_args(base + ["--arrival-rate", "0"])
+
+
 # --------------------------------------------------------------------------
 # The queries the harness replays
 # --------------------------------------------------------------------------
@@ -758,6 +1672,158 @@ def test_load_queries_accepts_a_directory(tmp_path) -> None:
     assert load_queries(tmp_path) == [("q1_a", "SELECT 1"), ("q2_b", "SELECT 2")]
 
 
+def test_every_target_replays_the_same_panels_under_the_same_names() -> None:
+    # Results from two targets are compared row by row, so a panel missing from one
+    # dialect would shorten one table and leave it looking comparable.
+    names = {
+        name: [query for query, _ in load_queries(target.query_dir)] for name, target in run.TARGETS.items()
+    }
+
+    assert names["clickhouse"] == names["postgres"]
+    assert len(names["clickhouse"]) == 8
+
+
+def test_clickhouse_queries_are_not_the_postgres_text() -> None:
+    # date_trunc and interval '7 days' are Postgres; a copy would fail on the first panel.
+    for _, sql in load_queries(run.CLICKHOUSE_QUERY_DIR):
+        assert "date_trunc" not in sql
+        assert "interval '" not in sql
+
+
+def test_every_panel_has_a_template_under_the_same_name() -> None:
+    # --query-params random swaps the files, not the panels: the rows of a fixed run and
+    # a random one still line up in compare.
+    for target in run.TARGETS.values():
+        fixed = [name for name, _ in load_queries(target.query_dir)]
+        templates = load_queries(target.query_dir, templates=True)
+
+        assert [name for name, _ in templates] == fixed
+        for _, template in templates:
+            assert "{{end_offset_hours}}" in template
+            assert "{{" not in run.render_query(template, random.Random(0))
+
+
+def test_a_template_only_moves_the_window_of_its_panel() -> None:
+    # Same tables, joins, filters and grouping as the panel: a line that differs must be
+    # one of the window's bounds. Anything more is a different query, not another range.
+    for target in run.TARGETS.values():
+        panels = dict(load_queries(target.query_dir))
+        for name, template in load_queries(target.query_dir, templates=True):
+            kept = [line for line in template.splitlines() if "{{end_offset_hours}}" not in line]
+            assert kept == [line for line in panels[name].splitlines() if "now()" not in line], name
+
+
+def test_the_panel_files_themselves_stay_fixed_sql() -> None:
+    # scripts/preflight.sh holds the dashboard's panels byte-identical to these files.
+    for target in run.TARGETS.values():
+        assert not any("{{" in sql for _, sql in load_queries(target.query_dir))
+
+
+def test_render_draws_each_parameter_once_and_replays_from_the_seed() -> None:
+    template = "{{end_offset_hours}} {{end_offset_hours}}"
+
+    first = run.render_query(template, random.Random(7))
+    offset, again = first.split()
+
+    assert offset == again
+    assert 0 <= int(offset) < run.MAX_END_OFFSET_HOURS
+    assert run.render_query(template, random.Random(7)) == first
+
+
+def test_a_template_parameter_without_a_generator_is_refused(tmp_path) -> None:
+    (tmp_path / "q1_a.sql.tmpl").write_text("SELECT {{warehouse}}\n")
+
+    with pytest.raises(ValueError, match="warehouse"):
+        load_queries(tmp_path, templates=True)
+
+
+def test_query_params_and_result_cache_are_pinned_validated_and_recorded() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    fixed = run.build_config(parse_args(base), query_count=8)
+    assert run.QUERY_PARAMS == "fixed" and run.RESULT_CACHE is False
+    assert (fixed["query_params"], fixed["query_params_seed"], fixed["result_cache_allowed"]) == (
+        "fixed",
+        None,
+        False,
+    )
+
+    cached = run.build_config(
+        parse_args(base + ["--target", "clickhouse", "--query-params", "random", "--result-cache"]),
+        query_count=8,
+    )
+    assert (cached["query_params"], cached["query_params_seed"], cached["result_cache_allowed"]) == (
+        "random",
+        run.QUERY_PARAMS_SEED,
+        True,
+    )
+    with pytest.raises(SystemExit):
+        # Nothing on the Postgres side to allow.
+        parse_args(base + ["--result-cache"])
+
+
+def test_target_is_pinned_and_recorded() -> None:
+    base = ["--dsn", "postgres:///shop", "--label", "before", "--out", "out.json"]
+
+    assert parse_args(base).target == run.TARGET == "postgres"
+    assert run.build_config(parse_args(base + ["--target", "clickhouse"]), query_count=8)["target"] == "clickhouse"
+    with pytest.raises(SystemExit):
+        parse_args(base + ["--target", "mysql"])
+
+
+class FakeClickHouseClient:
+    def __init__(self) -> None:
+        self.queries: list[str] = []
+        self.closed = False
+
+    async def query(self, sql: str):
+        self.queries.append(sql)
+        return type("QueryResult", (), {"result_rows": [(1, 2.5)]})()
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def test_clickhouse_pool_hands_each_session_its_own_client() -> None:
+    clients = [FakeClickHouseClient(), FakeClickHouseClient()]
+    pool = run.ClickHousePool(clients)
+
+    async def scenario() -> list:
+        async with pool.acquire() as first, pool.acquire() as second:
+            rows = await first.fetch("SELECT 1")
+            await second.fetch("SELECT 2")
+        await pool.close()
+        return rows
+
+    rows = asyncio.run(scenario())
+
+    assert rows == [(1, 2.5)]
+    assert sorted(client.queries[0] for client in clients) == ["SELECT 1", "SELECT 2"]
+    assert pool.idle.qsize() == 2
+    assert all(client.closed for client in clients)
+
+
+def test_clickhouse_pool_makes_an_extra_session_wait_for_a_client() -> None:
+    pool = run.ClickHousePool([FakeClickHouseClient()])
+    order: list[str] = []
+
+    async def session(name: str) -> None:
+        async with pool.acquire() as conn:
+            order.append(f"{name} in")
+            await conn.fetch(f"SELECT '{name}'")
+            await asyncio.sleep(0)
+            order.append(f"{name} out")
+
+    async def scenario() -> None:
+        await asyncio.gather(session("a"), session("b"))
+
+    asyncio.run(scenario())
+
+    # One client, two sessions: the second waits instead of raising IndexError.
+    assert order == ["a in", "a out", "b in", "b out"]
+    assert pool.idle.qsize() == 1
+
+
 def test_writer_path_points_at_the_order_writer() -> None:
     # The harness spawns it by path, so a directory move must fail here rather than at
     # minute one of a five-minute measurement.